@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+# Benchmark the extraction of the SCORES> records from .ou files done by
+# vs_results.py. A synthetic VS directory is generated (repeat directories
+# containing .ou slice outputs of the requested total size), then the records
+# are collected using the line by line parser and the memory-mapped scanner,
+# and both results are compared.
+#
+# https://github.com/thomas-coudrat/toolbx_vs
+# Thomas Coudrat <thomas.coudrat@gmail.com>
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+import vs_results
+
+
+# Text written by ICM between two docked ligands, making up most of an .ou
+FILLER = "".join(["  Info> ligand {0} conformation of the stack, " +
+                  "energy minimization done\n"] * 12)
+
+
+def main():
+    """
+    Run script
+    """
+
+    sizeMB, repeatNum, sliceNum, workDir, keep = parseArguments()
+
+    vsDir = tempfile.mkdtemp(prefix="bench_vs_", dir=workDir)
+
+    try:
+        print("\nGENERATING:\n")
+        start = time.time()
+        generateVs(vsDir, sizeMB, repeatNum, sliceNum)
+        print("\t{} MB written in {:.1f} s".format(sizeMB,
+                                                   time.time() - start))
+
+        print("\nTIMING:\n")
+        lineResults, lineTime = timeCollect(collectLines, vsDir)
+        print("\tline parser:    {:8.2f} s".format(lineTime))
+        scanResults, scanTime = timeCollect(collectScan, vsDir)
+        print("\tmmap scanner:   {:8.2f} s".format(scanTime))
+        print("\tspeedup:        {:8.2f} x".format(lineTime / scanTime))
+
+        if not sameResults(lineResults, scanResults):
+            print("\nERROR: the scanner and line parser results differ")
+            sys.exit(1)
+        print("\n\tidentical results for {} dockings\n".format(
+            vs_results.resultsLength(scanResults)))
+    finally:
+        if keep:
+            print("\tkept " + vsDir)
+        else:
+            shutil.rmtree(vsDir)
+
+
+def parseArguments():
+
+    descr = "Benchmark the .ou parsing of vs_results.py on synthetic data"
+    descr_size = "Total size of the generated .ou files in MB (default 200)"
+    descr_repeats = "Number of repeat directories (default 3)"
+    descr_slices = "Number of .ou slices per repeat (default 20)"
+    descr_dir = "Directory where the synthetic VS is generated"
+    descr_keep = "Keep the synthetic VS directory"
+
+    parser = argparse.ArgumentParser(description=descr)
+    parser.add_argument("--size", type=int, default=200, help=descr_size)
+    parser.add_argument("--repeats", type=int, default=3,
+                        help=descr_repeats)
+    parser.add_argument("--slices", type=int, default=20, help=descr_slices)
+    parser.add_argument("--dir", default=None, help=descr_dir)
+    parser.add_argument("-keep", action="store_true", help=descr_keep)
+
+    args = parser.parse_args()
+
+    return args.size, args.repeats, args.slices, args.dir, args.keep
+
+
+def scoreLine(ligID, rand):
+    """
+    Return a synthetic "SCORES>" record for this ligand ID
+    """
+
+    terms = [rand.randint(10, 60), rand.randint(0, 12)] + \
+        ["{:.2f}".format(rand.uniform(-30., 10.)) for i in range(6)]
+    score = "{:.2f}".format(rand.uniform(-45., -5.))
+    mfScore = "{:.2f}".format(rand.uniform(-120., -10.))
+
+    return ("SCORES> 1 {} Nat= {} Nva= {} dEhb= {} dEgrid= {} dEin= {} "
+            "dEsurf= {} dEel= {} dEhp= {} Score= {} mfScore= {} "
+            "Name= lig_{}\n").format(ligID, *(terms + [score, mfScore,
+                                                      ligID]))
+
+
+def generateVs(vsDir, sizeMB, repeatNum, sliceNum):
+    """
+    Write the repeat directories and their .ou slices, splitting the same
+    ligand range between the slices of each repeat
+    """
+
+    rand = random.Random(0)
+    sliceBytes = sizeMB * 1024 * 1024 // (repeatNum * sliceNum)
+    ligPerSlice = max(1, sliceBytes // (len(FILLER) + len(scoreLine(1, rand))))
+
+    for repeat in range(1, repeatNum + 1):
+        repeatDir = os.path.join(vsDir, str(repeat))
+        os.makedirs(repeatDir)
+        for sl in range(sliceNum):
+            firstID = sl * ligPerSlice + 1
+            lastID = firstID + ligPerSlice - 1
+            ouPath = os.path.join(repeatDir, "bench_{}.ou".format(lastID))
+            with open(ouPath, "w") as f:
+                for ligID in range(firstID, lastID + 1):
+                    f.write(FILLER.format(ligID))
+                    f.write(scoreLine(ligID, rand))
+
+
+def collectLines(vsDir):
+    """
+    Read each .ou with readlines() and parse each "SCORES>" line by tokens
+    """
+
+    allResults = []
+    for ouFilePath in vs_results.glob.glob(vsDir + "/*/*.ou"):
+        repeatNum = os.path.basename(os.path.dirname(ouFilePath))
+        with open(ouFilePath, "r") as f:
+            lines = f.readlines()
+        ligInfos = [vs_results.decodeScoreLine(line, repeatNum)
+                    for line in lines if "SCORES>" in line]
+        allResults.append(vs_results.ligInfosResults(ligInfos))
+
+    return vs_results.concatResults(allResults)
+
+
+def collectScan(vsDir):
+    """
+    Memory-map each .ou and decode the "SCORES>" records at the byte level
+    """
+
+    allResults = []
+    for ouFilePath in vs_results.glob.glob(vsDir + "/*/*.ou"):
+        repeatNum = os.path.basename(os.path.dirname(ouFilePath))
+        allResults.append(vs_results.scanOuFile(ouFilePath, repeatNum))
+
+    return vs_results.concatResults(allResults)
+
+
+def sameResults(results, otherResults):
+    """
+    Compare two results column by column
+    """
+
+    return all([vs_results.np.array_equal(results[column],
+                                          otherResults[column])
+                for column in vs_results.RESULT_COLUMNS])
+
+
+def timeCollect(collect, vsDir):
+    """
+    Time a collection function over the synthetic VS directory
+    """
+
+    start = time.time()
+    results = collect(vsDir)
+
+    return results, time.time() - start
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+# Check the local execution backend end to end, without ICM nor a queuing
+# system. A VS is built with vs_build.py ... local in a temporary directory,
+# with icm64_stub.py standing in for ICM, and run with vs_submit.py ... local.
+# One slice per repeat is made to fail: the exit codes of local_status.json
+# and the ligands of the .ou files are checked, then a -resume build docks
+# the missing ligands, and every ligand is checked to be in the results of
+# vs_results.py exactly once per repeat.
+#
+# https://github.com/thomas-coudrat/toolbx_vs
+# Thomas Coudrat <thomas.coudrat@gmail.com>
+
+import os
+import sys
+import json
+import glob
+import shutil
+import tempfile
+import argparse
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+import vs_results
+
+# Name of the VS setup directory, and project name, of the checked VS
+PROJ_NAME = "check"
+
+
+def main():
+    """
+    Run script
+    """
+
+    ligNum, sliceSize, repeatNum, jobs, workDir, keep = parseArguments()
+
+    checkDir = tempfile.mkdtemp(prefix="check_local_", dir=workDir)
+    vsDir = os.path.join(checkDir, "vs")
+    failTo = min(2 * sliceSize, ligNum)
+    errors = []
+
+    try:
+        env = setupVs(checkDir, vsDir)
+
+        print("\nBUILD AND RUN:\n")
+        runScript(["vs_build.py", "1", str(ligNum), str(sliceSize),
+                   str(repeatNum), "1.", "0-01:00:00", PROJ_NAME, "local"],
+                  vsDir, env)
+        env["ICM_STUB_FAIL"] = str(failTo)
+        runScript(["vs_submit.py", ".", "local", "--jobs", str(jobs)], vsDir,
+                  env, "yes\n")
+
+        # Every slice ran, the slice docking up to failTo failed in each
+        # repeat, and its ligands are missing from the .ou files
+        status = readStatus(vsDir)
+        sliceNum = repeatNum * -(-ligNum // sliceSize)
+        failed = sorted([relPath for relPath in status
+                         if status[relPath]["exitCode"] != 0])
+        check(errors, len(status) == sliceNum,
+              "{} slices run out of {}".format(len(status), sliceNum))
+        check(errors, len(failed) == repeatNum and
+              all(relPath.endswith("_sl" + str(failTo) + ".local")
+                  for relPath in failed),
+              "failed slices: " + ", ".join(failed))
+        for repeat in range(1, repeatNum + 1):
+            missing = missingIDs(vsDir, repeat, ligNum)
+            check(errors, 0 < len(missing) < sliceSize and
+                  missing[-1] == failTo,
+                  "repeat {}: ligands missing after the failure: {}".format(
+                      repeat, missing))
+            check(errors, len(glob.glob(os.path.join(vsDir, str(repeat),
+                                                     "*.out"))) ==
+                  sliceNum // repeatNum,
+                  "repeat {}: one .out file per slice".format(repeat))
+
+        print("\nRESUME:\n")
+        del env["ICM_STUB_FAIL"]
+        runScript(["vs_build.py", "1", str(ligNum), str(sliceSize),
+                   str(repeatNum), "1.", "0-01:00:00", PROJ_NAME, "local",
+                   "-resume"], vsDir, env)
+        runScript(["vs_submit.py", ".", "local", "--jobs", str(jobs)], vsDir,
+                  env, "yes\n")
+
+        status = readStatus(vsDir)
+        check(errors, len(status) == repeatNum and
+              all(status[relPath]["exitCode"] == 0 for relPath in status),
+              "resume slices: " + json.dumps(status))
+        for repeat in range(1, repeatNum + 1):
+            check(errors, not missingIDs(vsDir, repeat, ligNum),
+                  "repeat {}: ligands missing after the resume".format(
+                      repeat))
+
+        # Each ligand is in the results once, in the file of each repeat
+        runScript(["vs_results.py", vsDir, "-allRep"], vsDir, env)
+        for repeat in range(1, repeatNum + 1):
+            ligIDs = resultIDs(os.path.join(vsDir, "repeat" + str(repeat) +
+                                            "_results_vs.csv"))
+            check(errors, ligIDs == list(range(1, ligNum + 1)),
+                  "repeat {}: {} results for {} ligands".format(
+                      repeat, len(ligIDs), ligNum))
+    finally:
+        if keep:
+            print("\n\tkept " + checkDir)
+        else:
+            shutil.rmtree(checkDir)
+
+    print("\nCHECKS:\n")
+    if errors:
+        for error in errors:
+            print("\tFAILED: " + error)
+        print()
+        sys.exit(1)
+    print("\tall checks passed\n")
+
+
+def parseArguments():
+
+    descr = "Check vs_build.py and vs_submit.py with the local option," \
+        " using a stub of ICM"
+    descr_ligands = "Number of ligands of the library (default 95)"
+    descr_sliceSize = "Size of the slices (default 10)"
+    descr_repeats = "Number of repeats (default 2)"
+    descr_jobs = "Number of slices run at the same time (default 4)"
+    descr_dir = "Directory where the VS is built"
+    descr_keep = "Keep the VS directory"
+
+    parser = argparse.ArgumentParser(description=descr)
+    parser.add_argument("--ligands", type=int, default=95,
+                        help=descr_ligands)
+    parser.add_argument("--sliceSize", type=int, default=10,
+                        help=descr_sliceSize)
+    parser.add_argument("--repeats", type=int, default=2,
+                        help=descr_repeats)
+    parser.add_argument("--jobs", type=int, default=4, help=descr_jobs)
+    parser.add_argument("--dir", default=None, help=descr_dir)
+    parser.add_argument("-keep", action="store_true", help=descr_keep)
+
+    args = parser.parse_args()
+
+    if args.ligands < 2 * args.sliceSize:
+        parser.error("--ligands must cover at least two slices")
+
+    return args.ligands, args.sliceSize, args.repeats, max(1, args.jobs), \
+        args.dir, args.keep
+
+
+def setupVs(checkDir, vsDir):
+    """
+    Create the ICMHOME directory holding the stub of ICM, and the VS
+    directory with its setup directory. Return the environment of the
+    scripts run
+    """
+
+    icmHome = os.path.join(checkDir, "icm")
+    os.makedirs(icmHome)
+    os.symlink(os.path.join(BENCH_DIR, "icm64_stub.py"),
+               os.path.join(icmHome, "icm64"))
+
+    setupDir = os.path.join(vsDir, PROJ_NAME)
+    os.makedirs(setupDir)
+    with open(os.path.join(setupDir, PROJ_NAME + ".dtb"), "w") as f:
+        f.write("s_dbType\nmol\n")
+
+    env = dict(os.environ)
+    env["ICMHOME"] = icmHome
+
+    return env
+
+
+def runScript(args, vsDir, env, answer=None):
+    """
+    Run a script of the repository in the VS directory, with the answer
+    given to its prompt, and exit if it fails
+    """
+
+    command = [sys.executable, os.path.join(BENCH_DIR, "..", args[0])] + \
+        args[1:]
+    print("\t" + " ".join(args))
+    proc = subprocess.run(command, cwd=vsDir, env=env, input=answer,
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                          universal_newlines=True)
+    if proc.returncode != 0:
+        print(proc.stdout)
+        print("\nERROR: " + args[0] + " exited with code " +
+              str(proc.returncode))
+        sys.exit(1)
+
+
+def readStatus(vsDir):
+    """
+    Read the exit codes and run times of the slices run by vs_submit.py
+    """
+
+    with open(os.path.join(vsDir, "local_status.json"), "r") as f:
+        return json.load(f)
+
+
+def missingIDs(vsDir, repeat, ligNum):
+    """
+    Return the IDs of the ligands of the library that are not docked in
+    the .ou files of a repeat
+    """
+
+    processed = set()
+    for ouFilePath in vs_results.listOuFiles(os.path.join(vsDir,
+                                                          str(repeat))):
+        processed.update(vs_results.processedIDs(ouFilePath).tolist())
+
+    return sorted(set(range(1, ligNum + 1)) - processed)
+
+
+def resultIDs(resultsPath):
+    """
+    Return the sorted ligand IDs of a results .csv file
+    """
+
+    with open(resultsPath, "r") as f:
+        return sorted([int(line.split(",")[0]) for line in f.readlines()[1:]])
+
+
+def check(errors, condition, message):
+    """
+    Record the error message if the condition is not met
+    """
+
+    if not condition:
+        errors.append(message)
+
+
+if __name__ == "__main__":
+    main()
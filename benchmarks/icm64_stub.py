@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+# Stand-in for the ICM executable, run by the slice scripts as
+# $ICMHOME/icm64 -vlscluster $ICMHOME/_dockScan <proj> thorough=<t>
+# from=<first> to=<last>. It writes to standard output the lines ICM writes
+# to an .ou file for each ligand of the range: a few Info> lines and a
+# SCORES> record with scores derived from the ligand ID and repeat. When the
+# ICM_STUB_FAIL environment variable holds the last ligand ID of the range,
+# it stops half way through the range and exits with an error instead.
+#
+# https://github.com/thomas-coudrat/toolbx_vs
+# Thomas Coudrat <thomas.coudrat@gmail.com>
+
+import os
+import sys
+import random
+
+
+# Text written by ICM before each docked ligand
+FILLER = "".join(["  Info> ligand {0} conformation of the stack, " +
+                  "energy minimization done\n"] * 3)
+# SCORES> record of a docked ligand
+RECORD = "SCORES> 1 {0} Nat= {1} Nva= {2} dEhb= {3:.2f} dEgrid= {4:.2f}" \
+    " dEin= {5:.2f} dEsurf= {6:.2f} dEel= {7:.2f} dEhp= {8:.2f}" \
+    " Score= {9:.2f} mfScore= {10:.2f} Name= lig_{0}\n"
+
+
+def main():
+    """
+    Run script
+    """
+
+    params = dict([arg.split("=", 1) for arg in sys.argv[1:] if "=" in arg])
+    first = int(params["from"])
+    last = int(params["to"])
+    repeat = os.path.basename(os.getcwd())
+
+    failed = os.environ.get("ICM_STUB_FAIL") == str(last)
+    if failed:
+        last = (first + last) // 2
+
+    for ligID in range(first, last + 1):
+        rand = random.Random(repeat + "_" + str(ligID))
+        sys.stdout.write(FILLER.format(ligID))
+        sys.stdout.write(RECORD.format(
+            ligID, rand.randint(20, 60), rand.randint(2, 10),
+            *[rand.uniform(-30, 10) for i in range(6)] +
+            [rand.uniform(-45, -10), rand.uniform(-120, -20)]))
+
+    if failed:
+        sys.stdout.write("Error> stub failure requested for ligand " +
+                         params["to"] + "\n")
+        sys.exit(3)
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,7 @@ import numpy as np
 import json
 from sklearn.metrics import roc_curve, auc
 import random
+import vs_results
 
 # Get matplotlib to save SVG text as text, not paths
 mpl.rcParams['svg.fonttype'] = 'none'
@@ -124,9 +125,10 @@ class plotting:
 
         return refDict
 
-    def intersectResults(self, vsPaths, libraryIDlist):
+    def intersectResults(self, vsPaths, libraryIDlist, resultsDb=False):
         """
-        Read in the results provided in .csv format, and figure out the
+        Read in the results provided in .csv format (or query their results
+        database, with resultsDb), and figure out the
         intersect between each of those results set based on the ligIDs.
         Also check that the truePositive and falsePositive sets (if provided)
         are fully present in the intersect set: send a WARNING if they are not
@@ -141,49 +143,42 @@ class plotting:
 
         # Read results and populate vsResult
         for resultPath in vsPaths:
-            resultFile = open(resultPath, 'r')
-            resultLines = resultFile.readlines()
-            resultFile.close()
-
-            vsResult = []
-            ligIDs = []
-
-            # loop over the vs result lines omitting the first row
-            # print resultPath, len(resultLines)
-            for line in resultLines[1:]:
-                ligInfo = line.strip().split(",")
-                vsResult.append(ligInfo)
-                ligIDs.append(int(ligInfo[0]))
+            vsResult, ligIDs = self.readResults(resultPath, resultsDb)
 
             allVsResults.append(vsResult)
-            allLigIDs.append(set(ligIDs))
+            allLigIDs.append(ligIDs)
 
         # Get the intersection set
-        ligIDintersectSet = set.intersection(*allLigIDs)
+        ligIDintersect = allLigIDs[0]
+        for ligIDs in allLigIDs[1:]:
+            ligIDintersect = np.intersect1d(ligIDintersect, ligIDs)
+        ligIDintersectSet = set(ligIDintersect.tolist())
 
         # Loop over vsResults and keep only the ones present in the
         # intersection. Also identify which binding pocket does not have which
         # docked ligand information
+        libraryIDs = np.array(libraryIDlist, dtype=np.int64)
         vsIntersects = []
         for resultPath, vsResult, ligIDs in zip(vsPaths,
                                                 allVsResults,
                                                 allLigIDs):
-            vsResultIntersect = []
-            for ligInfo in vsResult:
-                ligID = int(ligInfo[0])
-                # Get only ligands that were docked in all binding pockets, and
-                # also part of the library ID list provided
-                if ligID in ligIDintersectSet and ligID in libraryIDlist:
-                    vsResultIntersect.append(ligInfo)
+            # Get only ligands that were docked in all binding pockets, and
+            # also part of the library ID list provided
+            keep = np.isin(ligIDs, ligIDintersect) & \
+                np.isin(ligIDs, libraryIDs)
+            if isinstance(vsResult, list):
+                vsResultIntersect = [ligInfo for ligInfo, k in
+                                     zip(vsResult, keep) if k]
+            else:
+                vsResultIntersect = vsResult[keep]
             # Complete docking data for each pocket
             vsIntersects.append(vsResultIntersect)
 
             # Identify which of the binding pocket is missing which ligand
             # print resultPath
-            libraryIDset = set(libraryIDlist)
             # Get the set of ligIDs found in the total library ID set, but not
             # in the current binding pocket docked data
-            notDockedLigIDlist = sorted(list(libraryIDset.difference(ligIDs)))
+            notDockedLigIDlist = np.setdiff1d(libraryIDs, ligIDs).tolist()
             # Print the binding pocket name, along with the IDs not docked
             bpName = os.path.basename(resultPath)
             if len(notDockedLigIDlist) > 0:
@@ -197,6 +192,45 @@ class plotting:
         # Return the intersect VS data and intersect ligand ID set
         return vsIntersects, ligIDintersectSet
 
+    def readResults(self, resultPath, resultsDb=False):
+        """
+        Read the VS results of a results .csv file, and return them along
+        with the array of their ligand IDs. With resultsDb, the ranked results
+        are queried from the results database written by vs_results.py -db,
+        into a list of ligInfo lists. Otherwise the binary copy of the results
+        written by vs_results.py is memory-mapped when it is present and up to
+        date, returning a structured array, or the .csv is parsed into a list
+        of ligInfo lists
+        """
+
+        if resultsDb:
+            resultDb = vs_results.connectResultsDb(resultPath)
+            if resultDb is None:
+                print(col.FAIL + "No results database up to date with " +
+                      resultPath + ", run vs_results.py with -db" + col.end)
+                sys.exit()
+            vsResult = resultDb.execute("SELECT No, Score, Name, Run FROM "
+                                        "results ORDER BY Rank").fetchall()
+            resultDb.close()
+            ligIDs = np.array([ligInfo[0] for ligInfo in vsResult],
+                              dtype=np.int64)
+            return [list(ligInfo) for ligInfo in vsResult], ligIDs
+
+        vsResult = vs_results.loadResultsCache(resultPath)
+        if vsResult is not None:
+            return vsResult, vsResult["No"]
+
+        resultFile = open(resultPath, 'r')
+        resultLines = resultFile.readlines()
+        resultFile.close()
+
+        # loop over the vs result lines omitting the first row
+        vsResult = [line.strip().split(",") for line in resultLines[1:]]
+        ligIDs = np.array([int(ligInfo[0]) for ligInfo in vsResult],
+                          dtype=np.int64)
+
+        return vsResult, ligIDs
+
     def updatedLigCounts(self, ligIDintersectSet, ligIDlist, lig_type):
         """
         Get list of docked ligands kept for analysis (intersection of all
@@ -16,6 +16,10 @@ import socket
 import json
 import datetime
 import time
+import numpy as np
+import vs_queue
+import vs_report
+import vs_results
 
 def main():
     """
@@ -24,7 +28,8 @@ def main():
 
     # Getting all the args
     libStart, libEnd, sliceSize, repeatNum, thor, \
-        walltime, setupDir, projName, queue = parsing()
+        walltime, setupDir, projName, queue, array, throttle, pack, \
+        pull, chunkTime, lease, resume = parsing()
 
     # Get the path from the Json file
     icmHome = getPath()
@@ -36,9 +41,14 @@ def main():
     # Get current working directory
     workDir = os.getcwd()
 
-    # Clean files present in the current repeat directories, if any
-    for repeatDir in glob.glob(workDir + "/[0-9]*"):
-        cleanRepeatDir(repeatDir)
+    # Clean files present in the current repeat directories, if any. A
+    # resume build keeps the .ou files, and only moves the scripts of the
+    # previous build to a backup directory
+    if resume:
+        backupScripts(workDir)
+    else:
+        for repeatDir in glob.glob(workDir + "/[0-9]*"):
+            cleanRepeatDir(repeatDir)
 
     reportLines.append("\nPARAMETERS:\n")
     reportLines.append("\t libStart: " + str(libStart))
@@ -49,6 +59,24 @@ def main():
     reportLines.append("\t thoroughness: " + thor)
     reportLines.append("\t setupDir: " + setupDir)
     reportLines.append("\t projName: " + projName)
+    if array:
+        reportLines.append("\t array: " + array)
+        reportLines.append("\t throttle: " + str(throttle))
+    if pack:
+        reportLines.append("\t pack: " + str(pack) + " nodes")
+    if pull:
+        reportLines.append("\t pull: " + str(pull) + " workers")
+        reportLines.append("\t chunkTime: " + str(chunkTime) + " minutes")
+        reportLines.append("\t lease: " + str(lease) + " seconds")
+    if resume:
+        # The range of the VS, read back by vs_report.py to count the .ou
+        # files kept toward the progress of the repeats
+        reportLines.append("\t resume: ligands missing from the .ou files of"
+                           " project=" + projName +
+                           " from=" + str(libStart) +
+                           " to=" + str(libEnd) +
+                           " size=" + str(sliceSize) +
+                           " repeats=1-" + str(repeatNum))
     reportLines.append("\n")
 
     # grep the parameters to lookout for in the .dtb file, and print them out
@@ -61,9 +89,28 @@ def main():
 
     reportLines.append("\n***********************\n")
 
-    # Create the .slurm slices
-    reportLines = createSlices(libStart, libEnd, sliceSize, walltime, thor,
-                               projName, repeatNum, queue, reportLines, icmHome)
+    if resume:
+        # Create slices for the ligands missing from the .ou files only
+        reportLines = createResumeSlices(libStart, libEnd, sliceSize,
+                                         walltime, thor, projName, repeatNum,
+                                         queue, reportLines, icmHome, pack)
+    elif pull:
+        # Create the chunk queue, and the job array of the workers pulling
+        # the chunks from it
+        reportLines = createQueue(libStart, libEnd, sliceSize, walltime,
+                                  thor, projName, repeatNum, queue,
+                                  reportLines, icmHome, pull, chunkTime,
+                                  lease)
+    elif array:
+        # Create the job array scripts, one per repeat or for all repeats
+        reportLines = createArrays(libStart, libEnd, sliceSize, walltime,
+                                   thor, projName, repeatNum, queue,
+                                   reportLines, icmHome, array, throttle)
+    else:
+        # Create the .slurm slices
+        reportLines = createSlices(libStart, libEnd, sliceSize, walltime,
+                                   thor, projName, repeatNum, queue,
+                                   reportLines, icmHome, pack)
 
     reportLines.append("\n")
 
@@ -83,9 +130,39 @@ def parsing():
     descr_sliceSize = "Size of the slices"
     descr_repeatNum = "Number of repeats"
     descr_thor = "Thoroughness of the docking (format: 5.)"
-    descr_walltime = "Walltime for a single slice (format: 1-24:00:00)"
+    descr_walltime = "Walltime for a single slice (format: 1-24:00:00)," \
+        " not used by the local option"
     descr_setupDir = "Name of the directory containing setup files"
-    descr_queue = "Queuing system to be used (sge/slurm/slurm-srun)"
+    descr_queue = "Queuing system to be used (sge/slurm/slurm-srun), or" \
+        " local to run the slices on this machine with vs_submit.py"
+    descr_array = "Write job arrays instead of one script per slice, the" \
+        " ligand range of a slice being derived from the array task ID:" \
+        " one array per repeat (repeat), or a single array for all the" \
+        " repeats (campaign). Only with sge and slurm"
+    descr_throttle = "Maximum number of tasks of a job array running at" \
+        " the same time. Default is no limit"
+    descr_pack = "With slurm-srun, allocate this number of whole nodes per" \
+        " repeat instead of one task per slice, each node running one ICM" \
+        " process per core that pulls the next slice not yet started until" \
+        " all are done. The walltime must then cover the slices run one" \
+        " after the other by a core"
+    descr_pull = "Write a queue of chunks of sliceSize ligands in the VS" \
+        " directory, and a job array of this number of identical workers" \
+        " (vs_queue.py) that claim the next chunk not yet docked until" \
+        " none is left, instead of static slices. More workers can be" \
+        " submitted at any time. Only with sge and slurm. The walltime is" \
+        " then the walltime of a worker"
+    descr_chunkTime = "With --pull, maximum number of minutes a chunk takes" \
+        " to dock. The workers stop claiming chunks this long (plus 5" \
+        " minutes) before their walltime, so that they are not killed" \
+        " while docking a chunk"
+    descr_lease = "With --pull, number of seconds after which the claim of" \
+        " a worker that stopped is reissued. Default is 600"
+    descr_resume = "Keep the .ou files of the repeats, and create slices" \
+        " only for the ligands between libStart and libEnd that have no" \
+        " SCORES> or Skipping record in them, packed into slices of up to" \
+        " sliceSize ligands. The scripts of the previous build and the" \
+        " .out files of their jobs are moved to a backup directory"
 
     # Defining the arguments
     parser = argparse.ArgumentParser(description=descr)
@@ -97,6 +174,14 @@ def parsing():
     parser.add_argument("walltime", help=descr_walltime)
     parser.add_argument("setupDir", help=descr_setupDir)
     parser.add_argument("queue", help=descr_queue)
+    parser.add_argument("--array", choices=["repeat", "campaign"],
+                        help=descr_array)
+    parser.add_argument("--throttle", type=int, help=descr_throttle)
+    parser.add_argument("--pack", type=int, help=descr_pack)
+    parser.add_argument("--pull", type=int, help=descr_pull)
+    parser.add_argument("--chunkTime", type=float, help=descr_chunkTime)
+    parser.add_argument("--lease", type=float, default=600, help=descr_lease)
+    parser.add_argument("-resume", action="store_true", help=descr_resume)
 
     # Parsing and storing into variables
     args = parser.parse_args()
@@ -110,17 +195,48 @@ def parsing():
     # VS params
     walltime = args.walltime
     queue = args.queue
+    array = args.array
+    throttle = args.throttle
+    pack = args.pack
+    pull = args.pull
+    chunkTime = args.chunkTime
+    lease = args.lease
+    resume = args.resume
     # Project info
     setupDir = args.setupDir
     dtbFileName = glob.glob(setupDir + "/*.dtb")[0]
     projName = dtbFileName.replace(".dtb", "").split("/")[1]
 
-    if queue not in ("sge", "slurm", "slurm-srun"):
-        print("'sge', 'slurm' and 'slurm-srun' are the queuing system options")
+    if queue not in ("sge", "slurm", "slurm-srun", "local"):
+        print("'sge', 'slurm', 'slurm-srun' and 'local' are the queuing " +
+              "system options")
+        sys.exit()
+
+    if array and queue not in ("sge", "slurm"):
+        print("Job arrays are only written for the 'sge' and 'slurm' options")
+        sys.exit()
+
+    if pack and queue != "slurm-srun":
+        print("Node packing is only available with the 'slurm-srun' option")
+        sys.exit()
+
+    if pull and (array or queue not in ("sge", "slurm")):
+        print("The chunk queue is only available with the 'sge' and 'slurm'" +
+              " options, without --array")
+        sys.exit()
+
+    if pull and workerTime(walltime, queue, chunkTime) is None:
+        print("With --pull, --chunkTime is needed and must be shorter than" +
+              " the walltime by more than 5 minutes")
+        sys.exit()
+
+    if resume and (array or pull):
+        print("Resume builds write slices, without --array or --pull")
         sys.exit()
 
     return libStart, libEnd, sliceSize, repeatNum, thor, walltime, setupDir, \
-        projName, queue
+        projName, queue, array, throttle, pack, pull, chunkTime, lease, \
+        resume
 
 
 def getPath():
@@ -188,6 +304,35 @@ def cleanRepeatDir(repeatDir):
             sys.exit()
 
 
+def backupScripts(workDir):
+    """
+    Move the scripts of the previous build and the .out files of their
+    jobs, in the VS directory and in the repeat directories, to a
+    timestamped backup directory in each, so that the scripts are not
+    submitted again and vs_report.py does not classify the old .out files.
+    The .ou files are left in place
+    """
+
+    t = time.time()
+    humanTime = datetime.datetime.fromtimestamp(int(t)).strftime('%Y-%m-%d_%H:%M:%S')
+
+    dirPaths = [workDir] + glob.glob(workDir + "/[0-9]*")
+    for dirPath in dirPaths:
+        scriptPaths = []
+        for pattern in ["*.slurm", "*.sge", "*.local", "slice_*.sh",
+                        "pack_*.sh", "slice_*.sh.claim", "*.out"]:
+            scriptPaths += glob.glob(dirPath + "/" + pattern)
+        if not scriptPaths:
+            continue
+
+        print("BACKING UP SCRIPTS OF " + dirPath + "...")
+        backupDir = dirPath + "/backup_" + humanTime
+        if not os.path.exists(backupDir):
+            os.makedirs(backupDir)
+        for scriptPath in scriptPaths:
+            shutil.move(scriptPath, backupDir)
+
+
 def printParams(setupDir, reportLines):
     """
     Use the grep command to print out common parameters to check
@@ -245,7 +390,7 @@ def createRepeats(repeatNum, setupDir, reportLines):
 
 
 def createSlices(libStart, libEnd, sliceSize, walltime, thor, projName,
-                 repeatNum, queue, reportLines, icmHome):
+                 repeatNum, queue, reportLines, icmHome, pack=None):
     """
     Create the .slurm slices to split the VS job into portions for submission
     to the cluster
@@ -299,6 +444,10 @@ def createSlices(libStart, libEnd, sliceSize, walltime, thor, projName,
                 reportLines = slurmSlice(walltime, sliceName, projName, thor,
                                          lowerLimit, upperLimit, repeatDir,
                                          reportLines, icmHome)
+            elif queue == "local":
+                reportLines = localSlice(sliceName, projName, thor,
+                                         lowerLimit, upperLimit, repeatDir,
+                                         reportLines, icmHome)
 
             # Update upperLimit and sliceCount
             lowerLimit += sliceSize
@@ -308,14 +457,343 @@ def createSlices(libStart, libEnd, sliceSize, walltime, thor, projName,
         # Update the repeat number
         repeat += 1
 
-        # Combine these slices in a call srun
-        if queue == "slurm-srun":
+        # Combine these slices in a call srun, or in the worker pools of
+        # whole nodes
+        if queue == "slurm-srun" and pack:
+            slurmPack(projName, libStart, libEnd, walltime,
+                      repeatDir, repeat, pack)
+        elif queue == "slurm-srun":
             slurmSrun(projName, libStart, libEnd, walltime,
                       repeatDir, repeat, sliceCount - 1)
 
     return reportLines
 
 
+def createResumeSlices(libStart, libEnd, sliceSize, walltime, thor, projName,
+                       repeatNum, queue, reportLines, icmHome, pack=None):
+    """
+    Create the slices docking the ligands from libStart to libEnd missing
+    from the .ou files of each repeat: the gaps between the ligands docked
+    or skipped are packed into slices of up to sliceSize ligands, a slice
+    running one docking per gap it holds
+    """
+
+    cwd = os.getcwd()
+
+    for repeat in range(1, repeatNum + 1):
+        repeatDir = cwd + "/" + str(repeat) + "/"
+        gaps = repeatGaps(repeatDir, libStart, libEnd)
+        sliceRanges = packGaps(gaps, sliceSize)
+
+        # Update the report
+        reportLines.append("\n")
+        reportLines.append("REPEAT:" + repeatDir + "\n")
+        reportLines.append("\t missing: " +
+                           str(sum([last - first + 1 for first, last
+                                    in gaps])) +
+                           " ligands in " + str(len(gaps)) + " ranges")
+
+        for sliceCount, ranges in enumerate(sliceRanges, 1):
+            lowerLimit = ranges[0][0]
+            upperLimit = ranges[-1][1]
+            sliceName = projName + "_rep" + str(repeat) + \
+                "_sl" + str(lowerLimit) + "-" + str(upperLimit)
+
+            if queue == "slurm-srun":
+                reportLines = slurmSrunSlice(sliceCount, projName, thor,
+                                             lowerLimit, upperLimit,
+                                             libStart, libEnd,
+                                             repeatDir, reportLines, icmHome,
+                                             ranges)
+            elif queue == "sge":
+                reportLines = sgeSlice(walltime, sliceName, projName, thor,
+                                       lowerLimit, upperLimit, repeatDir,
+                                       reportLines, icmHome, ranges)
+            elif queue == "slurm":
+                reportLines = slurmSlice(walltime, sliceName, projName, thor,
+                                         lowerLimit, upperLimit, repeatDir,
+                                         reportLines, icmHome, ranges)
+            elif queue == "local":
+                reportLines = localSlice(sliceName, projName, thor,
+                                         lowerLimit, upperLimit, repeatDir,
+                                         reportLines, icmHome, ranges)
+
+        # Combine these slices in a call srun, or in the worker pools of
+        # whole nodes
+        if queue == "slurm-srun" and sliceRanges and pack:
+            slurmPack(projName, libStart, libEnd, walltime,
+                      repeatDir, repeat, pack)
+        elif queue == "slurm-srun" and sliceRanges:
+            slurmSrun(projName, libStart, libEnd, walltime,
+                      repeatDir, repeat, len(sliceRanges))
+
+    return reportLines
+
+
+def repeatGaps(repeatDir, libStart, libEnd):
+    """
+    Return the [first, last] ranges of the ligand IDs from libStart to
+    libEnd without a SCORES> or Skipping record in the .ou files of a repeat
+    directory
+    """
+
+    ligIDs = [vs_results.processedIDs(ouFilePath) for ouFilePath in
+              vs_results.listOuFiles(repeatDir)]
+    if ligIDs:
+        ligIDs = np.unique(np.concatenate(ligIDs))
+    else:
+        ligIDs = np.array([], dtype=np.int64)
+
+    return vs_results.gapRanges(ligIDs, libStart, libEnd)
+
+
+def packGaps(gaps, sliceSize):
+    """
+    Pack the ranges of missing ligand IDs, in order, into slices of up to
+    sliceSize ligands. Ranges larger than the room left in a slice are
+    split. Return the list of ranges of each slice
+    """
+
+    sliceRanges = []
+    ranges = []
+    size = 0
+
+    for first, last in gaps:
+        while first <= last:
+            if size == sliceSize:
+                sliceRanges.append(ranges)
+                ranges = []
+                size = 0
+            take = min(last - first + 1, sliceSize - size)
+            ranges.append([first, first + take - 1])
+            size += take
+            first += take
+
+    if ranges:
+        sliceRanges.append(ranges)
+
+    return sliceRanges
+
+
+def dockingLines(projName, thor, lowerLimit, upperLimit, icmHome,
+                 ranges=None):
+    """
+    Return the lines of a slice script docking its ligands, to an .ou file
+    named after the upper limit of the slice. The slices of a resume build
+    dock each of their ranges to an .ou file named after both its limits,
+    so as not to overwrite the .ou file of the slice the range is missing
+    from
+    """
+
+    if ranges is None:
+        ranges = [[lowerLimit, upperLimit]]
+        ouNames = [projName + "_" + str(upperLimit)]
+    else:
+        ouNames = [projName + "_" + str(first) + "-" + str(last)
+                   for first, last in ranges]
+
+    lines = []
+    lines.append("ICMHOME=" + icmHome)
+    for (first, last), ouName in zip(ranges, ouNames):
+        # Node running the slice, read by vs_report.py
+        lines.append("hostname > " + ouName + ".host")
+        lines.append("$ICMHOME/icm64 -vlscluster $ICMHOME/_dockScan " +
+                     projName +
+                     " thorough=" + thor +
+                     " from=" + str(first) +
+                     " to=" + str(last) +
+                     " >& " + ouName + ".ou")
+
+    return lines
+
+
+def createArrays(libStart, libEnd, sliceSize, walltime, thor, projName,
+                 repeatNum, queue, reportLines, icmHome, array, throttle):
+    """
+    Create the job array scripts running the slices of the VS, one array per
+    repeat written in the repeat directory, or a single array for all the
+    repeats written in the VS directory
+    """
+
+    cwd = os.getcwd()
+
+    # Number of slices of a repeat, the last one may be shorter
+    sliceNum = (libEnd - libStart + sliceSize) // sliceSize
+
+    if array == "repeat":
+        for repeat in range(1, repeatNum + 1):
+            repeatDir = cwd + "/" + str(repeat) + "/"
+            reportLines.append("\n")
+            reportLines.append("REPEAT:" + repeatDir + "\n")
+            reportLines = arrayScript(walltime, projName + "_rep" +
+                                      str(repeat), projName, thor, libStart,
+                                      libEnd, sliceSize, sliceNum, repeat,
+                                      repeat, repeatDir, queue, throttle,
+                                      reportLines, icmHome)
+    else:
+        reportLines.append("\n")
+        reportLines.append("CAMPAIGN:" + cwd + "/\n")
+        reportLines = arrayScript(walltime, projName, projName, thor,
+                                  libStart, libEnd, sliceSize, sliceNum, 1,
+                                  repeatNum, cwd + "/", queue, throttle,
+                                  reportLines, icmHome)
+
+    return reportLines
+
+
+def workerTime(walltime, queue, chunkTime):
+    """
+    Return the number of minutes after which a worker of the chunk queue
+    stops claiming chunks: its walltime minus the time a chunk takes to
+    dock and a 5 minutes margin. None if the walltime cannot be read or is
+    too short
+    """
+
+    seconds = vs_report.parseWalltime(walltime, sge=queue == "sge")
+    if seconds is None or chunkTime is None:
+        return None
+    maxTime = seconds / 60. - chunkTime - 5
+    if maxTime <= 0:
+        return None
+
+    return maxTime
+
+
+def createQueue(libStart, libEnd, sliceSize, walltime, thor, projName,
+                repeatNum, queue, reportLines, icmHome, workerNum, chunkTime,
+                lease):
+    """
+    Create the chunk queue of the VS, and the SLURM or SGE job array of the
+    workers claiming its chunks, written in the VS directory. The workers
+    stop claiming chunks in time to finish the last one before walltime
+    """
+
+    cwd = os.getcwd()
+
+    vs_queue.writeQueue(cwd, {"projName": projName,
+                              "libStart": libStart,
+                              "libEnd": libEnd,
+                              "chunkSize": sliceSize,
+                              "repeatNum": repeatNum,
+                              "thor": thor,
+                              "icmHome": icmHome})
+    chunkNum = len(vs_queue.queueChunks(vs_queue.readQueue(cwd)))
+
+    jobName = projName + "_workers"
+    lines = []
+    if queue == "slurm":
+        lines.append("#!/bin/bash")
+        lines.append("#SBATCH --mem=1024")
+        lines.append("#SBATCH --time=" + walltime)
+        lines.append("#SBATCH --job-name=" + jobName)
+        lines.append("#SBATCH --array=1-" + str(workerNum))
+    elif queue == "sge":
+        lines.append("#!/bin/sh")
+        lines.append("#$ -S /bin/sh")
+        lines.append("#$ -l h_rt=" + walltime)
+        lines.append("#$ -l h_vmem=1G")
+        lines.append("#$ -q hqu9")
+        lines.append("#$ -l dpod=1")
+        lines.append("#$ -cwd")
+        lines.append("#$ -N " + jobName)
+        lines.append("#$ -t 1-" + str(workerNum))
+    lines.append("")
+    lines.append("python " +
+                 os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              "vs_queue.py") + " " + cwd +
+                 " --lease " + str(lease) +
+                 " --maxTime " + str(workerTime(walltime, queue, chunkTime)))
+
+    # WRITE WORKER LINES TO FILE
+    scriptName = jobName + "." + queue
+    with open(cwd + "/" + scriptName, "w") as f:
+        f.write("\n".join(lines))
+
+    # Update report
+    reportLines.append("\n")
+    reportLines.append("QUEUE:" + cwd + "/" + vs_queue.QUEUE_DIR + "\n")
+    reportLines.append("\t chunks:" + str(chunkNum))
+    reportLines.append("\t WORKERS:" + scriptName + ", tasks:" +
+                       str(workerNum))
+
+    return reportLines
+
+
+def arrayScript(walltime, jobName, projName, thor, libStart, libEnd,
+                sliceSize, sliceNum, firstRepeat, lastRepeat, scriptDir,
+                queue, throttle, reportLines, icmHome):
+    """
+    Create a SLURM or SGE job array running the slices of the repeats
+    firstRepeat to lastRepeat, one task per slice. The repeat directory and
+    ligand range of a task are derived from its task ID, and its .ou file is
+    named after the upper limit of the range as for the slice scripts
+    """
+
+    taskNum = sliceNum * (lastRepeat - firstRepeat + 1)
+
+    lines = []
+    if queue == "slurm":
+        taskRange = "1-" + str(taskNum)
+        if throttle:
+            taskRange += "%" + str(throttle)
+        lines.append("#!/bin/bash")
+        lines.append("#SBATCH --mem=1024")
+        lines.append("#SBATCH --time=" + walltime)
+        lines.append("#SBATCH --job-name=" + jobName)
+        lines.append("#SBATCH --array=" + taskRange)
+        taskID = "$SLURM_ARRAY_TASK_ID"
+    elif queue == "sge":
+        lines.append("#!/bin/sh")
+        lines.append("#$ -S /bin/sh")
+        lines.append("#$ -l h_rt=" + walltime)
+        lines.append("#$ -l h_vmem=1G")
+        lines.append("#$ -q hqu9")
+        lines.append("#$ -l dpod=1")
+        lines.append("#$ -cwd")
+        lines.append("#$ -N " + jobName)
+        lines.append("#$ -t 1-" + str(taskNum))
+        if throttle:
+            lines.append("#$ -tc " + str(throttle))
+        taskID = "$SGE_TASK_ID"
+    lines.append("")
+    # Slices of the array, read by vs_report.py
+    lines.append("# VS array: project=" + projName +
+                 " from=" + str(libStart) +
+                 " to=" + str(libEnd) +
+                 " size=" + str(sliceSize) +
+                 " repeats=" + str(firstRepeat) + "-" + str(lastRepeat))
+    lines.append("TASK=" + taskID)
+    if firstRepeat == lastRepeat:
+        lines.append("SLICE=$TASK")
+    else:
+        lines.append("REPEAT=$(( (TASK - 1) / " + str(sliceNum) + " + " +
+                     str(firstRepeat) + " ))")
+        lines.append("SLICE=$(( (TASK - 1) % " + str(sliceNum) + " + 1 ))")
+        lines.append("cd $REPEAT")
+    lines.append("FROM=$(( " + str(libStart) + " + (SLICE - 1) * " +
+                 str(sliceSize) + " ))")
+    lines.append("TO=$(( FROM + " + str(sliceSize - 1) + " ))")
+    lines.append("if [ $TO -gt " + str(libEnd) + " ]; then TO=" +
+                 str(libEnd) + "; fi")
+    lines.append("")
+    lines.append("ICMHOME=" + icmHome)
+    # Node running the slice, read by vs_report.py
+    lines.append("hostname > " + projName + "_$TO.host")
+    lines.append("$ICMHOME/icm64 -vlscluster $ICMHOME/_dockScan " + projName +
+                 " thorough=" + thor +
+                 " from=$FROM to=$TO >& " + projName + "_$TO.ou")
+
+    # WRITE ARRAY LINES TO FILE
+    scriptName = jobName + "_array." + queue
+    with open(scriptDir + scriptName, "w") as f:
+        f.write("\n".join(lines))
+
+    # Update report
+    reportLines.append("\t ARRAY:" + scriptName + ", tasks:" + str(taskNum))
+
+    return reportLines
+
+
 def slurmSrun(projName, libStart, libEnd,  walltime, repeatDir, repeat, sliceCount):
     """
     Create the srun SLURM script which will group all SLURM submissions together
@@ -344,8 +822,67 @@ def slurmSrun(projName, libStart, libEnd,  walltime, repeatDir, repeat, sliceCou
         f.write("\n".join(lines))
 
 
+def slurmPack(projName, libStart, libEnd, walltime, repeatDir, repeat,
+              nodeNum):
+    """
+    Create the srun SLURM script allocating whole nodes to the slices, and
+    the worker pool run on each node: one worker per core, each claiming
+    the next slice not yet claimed by a worker of any node until all are
+    done, so that the workers finishing early take the remaining slices
+    """
+
+    slurmName = projName + "_" + str(repeat)
+
+    libRange = str(libStart) + "-" + str(libEnd)
+
+    lines = []
+    lines.append("#!/bin/bash")
+    lines.append("#SBATCH -p main")
+    lines.append("#SBATCH --nodes=" + str(nodeNum))
+    lines.append("#SBATCH --exclusive")
+    lines.append("#SBATCH --mem=0")
+    lines.append("#SBATCH --time=" + walltime)
+    lines.append("#SBATCH --job-name=" + slurmName)
+    lines.append("")
+    # Claims of a previous submission
+    lines.append("rm -f slice_" + libRange + "_*.sh.claim")
+    # A single task per node, bound to all the CPUs of the node
+    lines.append("srun --nodes=$SLURM_JOB_NUM_NODES --ntasks-per-node=1 " +
+                 "--cpus-per-task=$SLURM_CPUS_ON_NODE " +
+                 "bash pack_" + libRange + ".sh")
+
+    with open(repeatDir + "srun_" + libRange + ".slurm", "w") as f:
+        f.write("\n".join(lines))
+
+    lines = []
+    lines.append("#!/bin/bash")
+    lines.append("")
+    lines.append("worker() {")
+    lines.append("\tfor slice in $(ls slice_" + libRange + "_*.sh | sort -V)")
+    lines.append("\tdo")
+    # Creating the claim file fails if it exists, a single worker runs each
+    # slice
+    lines.append("\t\tif (set -o noclobber; > $slice.claim) 2> /dev/null")
+    lines.append("\t\tthen")
+    lines.append("\t\t\tbash $slice")
+    lines.append("\t\tfi")
+    lines.append("\tdone")
+    lines.append("}")
+    lines.append("")
+    # One worker per CPU of the task
+    lines.append("for i in `seq 1 $SLURM_CPUS_PER_TASK`")
+    lines.append("do")
+    lines.append("\tworker &")
+    lines.append("done")
+    lines.append("wait")
+
+    with open(repeatDir + "pack_" + libRange + ".sh", "w") as f:
+        f.write("\n".join(lines))
+
+
 def slurmSrunSlice(sliceCount, projName, thor, lowerLimit, upperLimit,
-                   libStart, libEnd, repeatDir, reportLines, icmHome):
+                   libStart, libEnd, repeatDir, reportLines, icmHome,
+                   ranges=None):
     """
     Create a slurm slice that will be used as part of a bundled SRUN command
     and write to a file with the info provided
@@ -354,12 +891,8 @@ def slurmSrunSlice(sliceCount, projName, thor, lowerLimit, upperLimit,
     lines = []
     lines.append("#!/bin/bash")
     lines.append("")
-    lines.append("ICMHOME=" + icmHome)
-    lines.append("$ICMHOME/icm64 -vlscluster $ICMHOME/_dockScan " + projName +
-                 " thorough=" + thor +
-                 " from=" + str(lowerLimit) +
-                 " to=" + str(upperLimit) +
-                 " >& " + projName + "_" + str(upperLimit) + ".ou")
+    lines += dockingLines(projName, thor, lowerLimit, upperLimit, icmHome,
+                          ranges)
 
     # WRITE SLURM LINES TO FILE
     sliceName = str(libStart) + "-" + str(libEnd) + "_" + str(sliceCount)
@@ -375,7 +908,7 @@ def slurmSrunSlice(sliceCount, projName, thor, lowerLimit, upperLimit,
 
 
 def slurmSlice(walltime, sliceName, projName, thor, lowerLimit, upperLimit,
-               repeatDir, reportLines, icmHome):
+               repeatDir, reportLines, icmHome, ranges=None):
     """
     Create a slurm slice and write to a file with the info provided
     """
@@ -386,12 +919,8 @@ def slurmSlice(walltime, sliceName, projName, thor, lowerLimit, upperLimit,
     lines.append("#SBATCH --time=" + walltime)
     lines.append("#SBATCH --job-name=" + sliceName)
     lines.append("")
-    lines.append("ICMHOME=" + icmHome)
-    lines.append("$ICMHOME/icm64 -vlscluster $ICMHOME/_dockScan " + projName +
-                 " thorough=" + thor +
-                 " from=" + str(lowerLimit) +
-                 " to=" + str(upperLimit) +
-                 " >& " + projName + "_" + str(upperLimit) + ".ou")
+    lines += dockingLines(projName, thor, lowerLimit, upperLimit, icmHome,
+                          ranges)
 
     # WRITE SLURM LINES TO FILE
     with open(repeatDir + sliceName + ".slurm", "w") as f:
@@ -406,7 +935,7 @@ def slurmSlice(walltime, sliceName, projName, thor, lowerLimit, upperLimit,
 
 
 def sgeSlice(walltime, sliceName, projName, thor, lowerLimit, upperLimit,
-             repeatDir, reportLines, icmHome):
+             repeatDir, reportLines, icmHome, ranges=None):
     """
     Create a SGE slice given the info provided
     """
@@ -420,12 +949,8 @@ def sgeSlice(walltime, sliceName, projName, thor, lowerLimit, upperLimit,
     lines.append("#$ -cwd")
     lines.append("#$ -N " + str(sliceName))
     lines.append("")
-    lines.append("ICMHOME=" + icmHome)
-    lines.append("$ICMHOME/icm64 -vlscluster $ICMHOME/_dockScan " + projName +
-                 " thorough=" + thor +
-                 " from=" + str(lowerLimit) +
-                 " to=" + str(upperLimit) +
-                 " >& " + projName + "_" + str(upperLimit) + ".ou")
+    lines += dockingLines(projName, thor, lowerLimit, upperLimit, icmHome,
+                          ranges)
 
     # WRITE SLURM LINES TO FILE
     with open(repeatDir + sliceName + ".sge", "w") as f:
@@ -437,6 +962,28 @@ def sgeSlice(walltime, sliceName, projName, thor, lowerLimit, upperLimit,
     return reportLines
 
 
+def localSlice(sliceName, projName, thor, lowerLimit, upperLimit, repeatDir,
+               reportLines, icmHome, ranges=None):
+    """
+    Create a slice run on this machine by vs_submit.py, given the info
+    provided
+    """
+    lines = []
+    lines.append("#!/bin/bash")
+    lines.append("")
+    lines += dockingLines(projName, thor, lowerLimit, upperLimit, icmHome,
+                          ranges)
+
+    # WRITE SLICE LINES TO FILE
+    with open(repeatDir + sliceName + ".local", "w") as f:
+        f.write("\n".join(lines))
+
+    # Update report
+    reportLines.append("\t SLICE:" + sliceName + ".local")
+
+    return reportLines
+
+
 def printWriteReport(reportLines, workDir, projName):
     """
     Go through the report lines and print them to standard output and
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+
+# Compresses the .ou files of the finished slices of a VS, in parallel, to
+# save space on the shared filesystem. The compressed .ou files are read
+# transparently by vs_results.py and vs_report.py
+#
+# https://github.com/thomas-coudrat/toolbx_vs
+# Thomas Coudrat <thomas.coudrat@gmail.com>
+
+import os
+import time
+import shutil
+import argparse
+import multiprocessing
+import gzip
+import lzma
+import vs_results
+
+# Optional, to write .ou.zst files
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Number of bytes copied at once to the compressed file
+COPY_BLOCK = 16 * 1024 * 1024
+# Number of bytes read at the end of an .ou file to find the record of the
+# last ligand of its slice, or the marker written by ICM when it finishes
+TAIL_SIZE = 1024 * 1024
+FINISHED_MARKER = b"FINISHED"
+
+
+def main():
+    """
+    Run script
+    """
+
+    vsDir, fmt, level, age, jobs = parseArguments()
+
+    # Only the .ou files not modified for the given age are considered, a
+    # running docking writes to its .ou file after each ligand. A slice that
+    # stalled may not write for longer, so the last ligand of the slice must
+    # also be in the file
+    ouFiles = [ouFilePath for ouFilePath in
+               vs_results.listOuFiles(vsDir + "/*")
+               if not vs_results.isCompressed(ouFilePath) and
+               time.time() - os.path.getmtime(ouFilePath) >= age * 60]
+    unfinished = [ouFilePath for ouFilePath in ouFiles
+                  if not sliceFinished(ouFilePath)]
+    ouFiles = sorted(set(ouFiles) - set(unfinished),
+                     key=vs_results.sliceSortKey)
+
+    if unfinished:
+        print("\nNOT FINISHED:\n")
+        for ouFilePath in sorted(unfinished, key=vs_results.sliceSortKey):
+            print("\t" + ouFilePath)
+
+    print("\nCOMPRESSING:\n")
+
+    tasks = [[ouFilePath, fmt, level] for ouFilePath in ouFiles]
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        compressed = pool.imap_unordered(compressOuFile, tasks)
+    else:
+        pool = None
+        compressed = map(compressOuFile, tasks)
+
+    totalSize = 0
+    totalCompSize = 0
+    try:
+        for ouFilePath, size, compSize in compressed:
+            print("\t" + ouFilePath + "\t" + formatSize(size) + " -> " +
+                  formatSize(compSize))
+            totalSize += size
+            totalCompSize += compSize
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    print("\nSUMMARY:\n")
+    print("\t" + str(len(ouFiles)) + " .ou files compressed, " +
+          formatSize(totalSize) + " -> " + formatSize(totalCompSize))
+
+
+def parseArguments():
+
+    # Parsing description of arguments
+    descr = "Compress the .ou files of the finished slices of a VS"
+    descr_vsDir = "Directory of the VS to be compacted"
+    descr_format = "Compression format: gz, xz or zst (requires the" \
+        " zstandard module). Default is gz"
+    descr_level = "Compression level. Default is 6 for gz and xz, 3 for zst"
+    descr_age = "Minimum number of minutes since an .ou file was last" \
+        " modified for its slice to be considered finished, its last" \
+        " ligand being docked or skipped as well. Default is 60"
+    descr_jobs = "Number of .ou files compressed in parallel. Default is 1"
+
+    # Defining the arguments
+    parser = argparse.ArgumentParser(description=descr)
+    parser.add_argument("vsDir", help=descr_vsDir)
+    parser.add_argument("--format", default="gz",
+                        choices=["gz", "xz", "zst"], help=descr_format)
+    parser.add_argument("--level", type=int, help=descr_level)
+    parser.add_argument("--age", type=float, default=60, help=descr_age)
+    parser.add_argument("--jobs", type=int, default=1, help=descr_jobs)
+
+    # Parsing arguments
+    args = parser.parse_args()
+    vsDir = args.vsDir
+    fmt = args.format
+    level = args.level
+    age = args.age
+    jobs = max(1, args.jobs)
+
+    if fmt == "zst" and zstandard is None:
+        parser.error("the zstandard module is required for --format zst")
+
+    return vsDir, fmt, level, age, jobs
+
+
+def sliceFinished(ouFilePath):
+    """
+    Return True if the last ligand of the slice of an .ou file, found in
+    its name as the upper limit of its ligand range, was docked or skipped,
+    or if ICM wrote its FINISHED marker. Only the last TAIL_SIZE bytes of
+    the file are read, up to its last line break
+    """
+
+    upperLimit = vs_results.OU_NAME.search(os.path.basename(ouFilePath)) \
+        .group(1)
+
+    with open(ouFilePath, "rb") as f:
+        start = max(0, os.fstat(f.fileno()).st_size - TAIL_SIZE)
+        f.seek(start)
+        tail = f.read()
+    # The first line read may be incomplete, the last one still be written
+    if start:
+        tail = tail[tail.find(b"\n") + 1:]
+    tail = tail[:tail.rfind(b"\n") + 1]
+
+    if FINISHED_MARKER in tail:
+        return True
+    if not upperLimit:
+        return False
+
+    return any(int(docked or skipped) == int(upperLimit) for docked, skipped
+               in vs_results.PROCESSED_RECORD.findall(tail))
+
+
+def compressOuFile(task):
+    """
+    Compress an .ou file to .ou.<format>, and delete the .ou file. The
+    compressed file is written to a temporary file first, keeps the
+    modification time of the .ou file, and replaces it only once complete.
+    Return the path of the .ou file and its size before and after
+    compression
+    """
+
+    ouFilePath, fmt, level = task
+    compPath = ouFilePath + "." + fmt
+    stat = os.stat(ouFilePath)
+
+    with open(ouFilePath, "rb") as f, openCompressed(compPath + ".tmp", fmt,
+                                                     level) as c:
+        shutil.copyfileobj(f, c, COPY_BLOCK)
+
+    os.utime(compPath + ".tmp", ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(compPath + ".tmp", compPath)
+    os.remove(ouFilePath)
+
+    return ouFilePath, stat.st_size, os.path.getsize(compPath)
+
+
+def openCompressed(compPath, fmt, level):
+    """
+    Open a compressed file for writing in the format given, at the given
+    compression level (or the default level if None)
+    """
+
+    if fmt == "gz":
+        return gzip.open(compPath, "wb",
+                         compresslevel=6 if level is None else level)
+    if fmt == "xz":
+        return lzma.open(compPath, "wb", preset=6 if level is None else level)
+
+    compressor = zstandard.ZstdCompressor(level=3 if level is None else level)
+    return compressor.stream_writer(open(compPath, "wb"), closefd=True)
+
+
+def formatSize(size):
+    """
+    Format a number of bytes in the largest unit below it
+    """
+
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024:
+            break
+        size /= 1024.
+
+    return "{:.1f} {}".format(size, unit)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+
+# Consolidates the results of several VS of the same ligand library against
+# different receptors (or receptor conformations). Joins the best score of
+# each ligand in each VS into a ligand x receptor score matrix, and writes
+# consensus rankings from that matrix: best score, mean score, average rank,
+# and optionally the Pareto fronts of selectivity between named receptors.
+#
+# https://github.com/thomas-coudrat/toolbx_vs
+# Thomas Coudrat <thomas.coudrat@gmail.com>
+
+import os
+import argparse
+import bisect
+import numpy as np
+import vs_results
+
+
+# Number of lines formatted at once when writing a consensus file
+WRITE_CHUNK = 100000
+# Columns of the consensus rankings files
+CONSENSUS_HEADER = "No,best,bestReceptor,mean,rankAvg,receptorNum\n"
+
+
+def main():
+    """
+    Run script
+    """
+
+    vsDirs, outPrefix, minRec, selectivity, jobs = parseArguments()
+
+    # Read the best score of each ligand in each VS, receptors being named
+    # after their VS directory
+    print("\nREADING:\n")
+    recNames = []
+    recResults = []
+    for vsDir in vsDirs:
+        recName = os.path.basename(os.path.normpath(os.path.abspath(vsDir)))
+        ligIDs, scores = readReceptorScores(vsDir, recName, jobs)
+        print("\t" + recName + "\t" + str(len(ligIDs)) + " ligands")
+        recNames.append(recName)
+        recResults.append([ligIDs, scores])
+
+    # Join the scores of the receptors on ligand ID
+    ligIDs, matrix = joinScores(recResults)
+    ligIDs, matrix = filterLigands(ligIDs, matrix, minRec)
+
+    print("\nCONSENSUS:\n")
+    print("\t" + str(len(ligIDs)) + " ligands docked in at least " +
+          str(minRec) + " of " + str(len(recNames)) + " receptors")
+
+    best, bestRec, mean, rankAvg, recCount = consensusScores(matrix)
+
+    print("\nWRITING:\n")
+
+    writeMatrix(outPrefix, ligIDs, matrix, recNames)
+
+    # One file per consensus ranking, the best ligands first
+    recNames = np.array(recNames)
+    for method, values in [["best", best], ["mean", mean],
+                           ["rankavg", rankAvg]]:
+        order = np.lexsort((ligIDs, values))
+        writeConsensus(outPrefix + "_" + method + ".csv", order, ligIDs,
+                       best, recNames[bestRec], mean, rankAvg, recCount)
+
+    if selectivity:
+        targets, offTargets = selectivity
+        writeSelectivity(outPrefix + "_selectivity.csv", ligIDs, matrix,
+                         list(recNames), targets, offTargets)
+
+
+def parseArguments():
+
+    # Parsing description of arguments
+    descr = "Join the results of several VS against different receptors" \
+        " into a ligand x receptor score matrix, and write consensus" \
+        " rankings"
+    descr_vsDirs = "Directories of the VS to be consolidated. The results" \
+        " file written by vs_results.py is used when present, otherwise" \
+        " the results are extracted from the .ou files"
+    descr_out = "Prefix of the files written. Default is 'consensus'"
+    descr_minRec = "Minimum number of receptors a ligand must be docked in" \
+        " to be ranked. Default is all receptors"
+    descr_selectivity = "Rank the selectivity of the ligands for target" \
+        " receptors over off-target receptors, named after their VS" \
+        " directory (format: recA,recB:recC)"
+    descr_jobs = "Number of processes parsing the .ou files when results" \
+        " are extracted. Default is 1"
+
+    # Defining the arguments
+    parser = argparse.ArgumentParser(description=descr)
+    parser.add_argument("vsDirs", nargs="+", help=descr_vsDirs)
+    parser.add_argument("--out", default="consensus", help=descr_out)
+    parser.add_argument("--minRec", type=int, help=descr_minRec)
+    parser.add_argument("--selectivity", help=descr_selectivity)
+    parser.add_argument("--jobs", type=int, default=1, help=descr_jobs)
+
+    # Parsing arguments
+    args = parser.parse_args()
+    vsDirs = args.vsDirs
+    outPrefix = args.out
+    jobs = max(1, args.jobs)
+
+    if args.minRec:
+        minRec = min(args.minRec, len(vsDirs))
+    else:
+        minRec = len(vsDirs)
+
+    # Split the selectivity receptors into targets and off-targets
+    selectivity = None
+    if args.selectivity:
+        recNames = [os.path.basename(os.path.normpath(os.path.abspath(d)))
+                    for d in vsDirs]
+        if ":" not in args.selectivity:
+            parser.error("--selectivity format is targets:offTargets")
+        targets, offTargets = [names.split(",") for names in
+                               args.selectivity.split(":", 1)]
+        for recName in targets + offTargets:
+            if recName not in recNames:
+                parser.error("unknown receptor in --selectivity: " + recName)
+        selectivity = [targets, offTargets]
+
+    return vsDirs, outPrefix, minRec, selectivity, jobs
+
+
+def readReceptorScores(vsDir, recName, jobs):
+    """
+    Return the ligand IDs and best scores of a VS. Read from the binary copy
+    of its results file, from the .csv results file, or extracted from its
+    .ou files when vs_results.py was not run
+    """
+
+    resultsCsv = os.path.join(vsDir, "results_" + recName + ".csv")
+
+    resCache = vs_results.loadResultsCache(resultsCsv)
+    if resCache is not None:
+        return np.array(resCache["No"]), np.array(resCache["Score"])
+
+    if os.path.exists(resultsCsv):
+        table = np.loadtxt(resultsCsv, delimiter=",", skiprows=1,
+                           usecols=(0, 9), ndmin=2)
+        return table[:, 0].astype(np.int64), table[:, 1]
+
+    print("\t" + resultsCsv + " not found, extracting results")
+    results, totalRepeatNum = vs_results.collectScoreData(vsDir, jobs)
+    results = vs_results.removeFailed(results, totalRepeatNum,
+                                      totalRepeatNum)
+    bestIndex, stats = vs_results.sortRepeats(results)
+
+    return results["No"][bestIndex], results["Score"][bestIndex]
+
+
+def joinScores(recResults):
+    """
+    Join the scores of each receptor on ligand ID into a matrix with one row
+    per ligand ID (sorted) and one column per receptor. Ligands not docked in
+    a receptor have a NaN score
+    """
+
+    ligIDs = np.unique(np.concatenate([recIDs for recIDs, scores in
+                                       recResults]))
+
+    # Single precision is enough for docking scores, and halves the size of
+    # the matrix
+    matrix = np.full((len(ligIDs), len(recResults)), np.nan,
+                     dtype=np.float32)
+    for i, (recIDs, scores) in enumerate(recResults):
+        matrix[np.searchsorted(ligIDs, recIDs), i] = scores
+
+    return ligIDs, matrix
+
+
+def filterLigands(ligIDs, matrix, minRec):
+    """
+    Keep the ligands docked in at least minRec receptors
+    """
+
+    keep = np.count_nonzero(~np.isnan(matrix), axis=1) >= minRec
+
+    return ligIDs[keep], matrix[keep]
+
+
+def consensusScores(matrix):
+    """
+    Compute for each ligand its best score and the index of the receptor
+    giving it, its mean score, its average rank amongst the receptors it was
+    docked in (rank 1 being the best score of a receptor), and the number of
+    those receptors
+    """
+
+    docked = ~np.isnan(matrix)
+    recCount = np.count_nonzero(docked, axis=1)
+
+    # NaN scores are replaced by +inf to be ignored by the minimum
+    filled = np.where(docked, matrix, np.inf)
+    bestRec = np.argmin(filled, axis=1)
+    best = filled[np.arange(len(matrix)), bestRec].astype(np.float64)
+    mean = np.where(docked, matrix, 0).sum(axis=1, dtype=np.float64) / \
+        np.maximum(recCount, 1)
+    del filled
+
+    # Rank the ligands of each receptor one column at a time, summing ranks
+    rankSum = np.zeros(len(matrix))
+    for i in range(matrix.shape[1]):
+        column = matrix[:, i]
+        order = np.argsort(np.where(np.isnan(column), np.inf, column),
+                           kind="stable")
+        ranks = np.empty(len(column))
+        ranks[order] = np.arange(1, len(column) + 1)
+        rankSum += np.where(np.isnan(column), 0, ranks)
+    rankAvg = rankSum / np.maximum(recCount, 1)
+
+    # Ligands docked in none of the receptors
+    best[recCount == 0] = np.nan
+    mean[recCount == 0] = np.nan
+    rankAvg[recCount == 0] = np.nan
+
+    return best, bestRec, mean, rankAvg, recCount
+
+
+def writeMatrix(outPrefix, ligIDs, matrix, recNames):
+    """
+    Write the ligand x receptor score matrix as a .csv file, with empty
+    values for ligands not docked in a receptor, and as a NumPy .npz file
+    """
+
+    matrixCsv = outPrefix + "_matrix.csv"
+    print("\t" + matrixCsv)
+    with open(matrixCsv, "w") as f:
+        f.write(",".join(["No"] + recNames) + "\n")
+        for start in range(0, len(ligIDs), WRITE_CHUNK):
+            rows = zip(ligIDs[start:start + WRITE_CHUNK].tolist(),
+                       matrix[start:start + WRITE_CHUNK].tolist())
+            f.write("".join([str(ligID) + "," +
+                             ",".join([formatScore(score) for score in row]) +
+                             "\n" for ligID, row in rows]))
+
+    print("\t" + outPrefix + "_matrix.npz")
+    np.savez(outPrefix + "_matrix.npz", No=ligIDs, scores=matrix,
+             receptors=np.array(recNames))
+
+
+def formatScore(score):
+    """
+    Format a single precision score, or an empty string for NaN
+    """
+
+    if score != score:
+        return ""
+
+    return "%.7g" % score
+
+
+def writeConsensus(consensusCsv, order, ligIDs, best, bestRecNames, mean,
+                   rankAvg, recCount):
+    """
+    Write a consensus rankings file, with the ligands in the order given
+    """
+
+    print("\t" + consensusCsv)
+    with open(consensusCsv, "w") as f:
+        f.write(CONSENSUS_HEADER)
+        for start in range(0, len(order), WRITE_CHUNK):
+            index = order[start:start + WRITE_CHUNK]
+            rows = zip(ligIDs[index].tolist(), best[index].tolist(),
+                       bestRecNames[index].tolist(), mean[index].tolist(),
+                       rankAvg[index].tolist(), recCount[index].tolist())
+            f.write("".join(["%d,%s,%s,%s,%s,%d\n" %
+                             (ligID, formatScore(b), recName,
+                              formatScore(m), formatScore(r), count)
+                             for ligID, b, recName, m, r, count in rows]))
+
+
+def writeSelectivity(selectivityCsv, ligIDs, matrix, recNames, targets,
+                     offTargets):
+    """
+    Rank the ligands on their selectivity for the target receptors over the
+    off-target receptors. The target score of a ligand is its best score
+    amongst targets, its off-target score its best score amongst
+    off-targets. A ligand dominates another when its target score is at
+    least as low and its off-target score at least as high, one of them
+    strictly. Ligands are ranked by Pareto front (front 1 is dominated by
+    no ligand), then by the difference between target and off-target scores
+    """
+
+    targetIdx = [recNames.index(recName) for recName in targets]
+    offIdx = [recNames.index(recName) for recName in offTargets]
+
+    # Ligands docked in at least one target and one off-target
+    targetScore = np.nanmin(np.where(np.isnan(matrix[:, targetIdx]), np.inf,
+                                     matrix[:, targetIdx]), axis=1)
+    offScore = np.nanmin(np.where(np.isnan(matrix[:, offIdx]), np.inf,
+                                  matrix[:, offIdx]), axis=1)
+    keep = np.isfinite(targetScore) & np.isfinite(offScore)
+    ligIDs = ligIDs[keep]
+    targetScore = targetScore[keep].astype(np.float64)
+    offScore = offScore[keep].astype(np.float64)
+
+    fronts = paretoFronts(targetScore, -offScore)
+    delta = targetScore - offScore
+    order = np.lexsort((ligIDs, delta, fronts))
+
+    print("\t" + selectivityCsv)
+    with open(selectivityCsv, "w") as f:
+        f.write("No,target,offTarget,delta,front\n")
+        for start in range(0, len(order), WRITE_CHUNK):
+            index = order[start:start + WRITE_CHUNK]
+            rows = zip(ligIDs[index].tolist(), targetScore[index].tolist(),
+                       offScore[index].tolist(), delta[index].tolist(),
+                       fronts[index].tolist())
+            f.write("".join(["%d,%s,%s,%s,%d\n" %
+                             (ligID, formatScore(t), formatScore(o),
+                              formatScore(d), front)
+                             for ligID, t, o, d, front in rows]))
+
+
+def paretoFronts(x, y):
+    """
+    Return the Pareto front number (starting at 1) of each point when
+    minimizing both x and y. Points are visited by increasing x, each front
+    keeping the lowest y of the points it holds, which increases with the
+    front number: a point goes to the first front whose lowest y is above
+    its own (found by bisection), and identical points share a front
+    """
+
+    fronts = np.empty(len(x), dtype=np.int64)
+    frontMinY = []
+    previous = None
+
+    order = np.lexsort((y, x))
+    for i, xi, yi in zip(order.tolist(), x[order].tolist(),
+                         y[order].tolist()):
+        if previous is not None and previous[0] == (xi, yi):
+            front = previous[1]
+        else:
+            front = bisect.bisect_right(frontMinY, yi)
+            if front == len(frontMinY):
+                frontMinY.append(yi)
+            else:
+                frontMinY[front] = yi
+        fronts[i] = front + 1
+        previous = [(xi, yi), front]
+
+    return fronts
+
+
+if __name__ == "__main__":
+    main()
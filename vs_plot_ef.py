@@ -18,7 +18,7 @@ def main():
 
     title, vsLegends, vsPaths, vsColors, \
         truePosIDstr, falsePosIDstr, ligLibsJson, \
-        ref, gui, labelBars, customEFs = parseArgs()
+        ref, gui, labelBars, customEFs, resultsDb = parseArgs()
 
     # Define mode
     mode = "EF"
@@ -62,7 +62,8 @@ def main():
     # Read the results of each VS and keep only the ligIDs that are common
     # to all of them
     vsIntersects, ligIDintersectSet = p.intersectResults(vsPaths,
-                                                         libraryIDlist)
+                                                         libraryIDlist,
+                                                         resultsDb)
 
     # Get updated true positive, true negative and library counts given the
     # intersect results
@@ -165,6 +166,9 @@ def parseArgs():
     descr_labelBars = "Use this flag to add labels at the top of each bar"
     descr_customEFs = "Define custom EF cutoffs. Submit three numbers " \
         "separated by commas e.g. '1,2,5'. Default is 1,5,10"
+    descr_db = "Query the results database written by vs_results.py -db" \
+        " next to each results file, instead of reading the results file or" \
+        " its binary copy"
 
     # adding arguments to the parser
     parser = argparse.ArgumentParser(description=descr)
@@ -178,6 +182,7 @@ def parseArgs():
     parser.add_argument("-labelBars", action="store_true",
                         help=descr_labelBars)
     parser.add_argument("--customEFs", help=descr_customEFs)
+    parser.add_argument("-db", action="store_true", help=descr_db)
 
     # parsing args
     args = parser.parse_args()
@@ -190,6 +195,7 @@ def parseArgs():
     gui = args.gui
     labelBars = args.labelBars
     customEFs = args.customEFs
+    resultsDb = args.db
 
     # Extrac the VS results paths and legends
     vsPaths = []
@@ -204,7 +210,7 @@ def parseArgs():
 
     return title, vsLegends, vsPaths, vsColors, \
         truePosIDstr, falsePosIDstr, ligLibsJson, \
-        ref, gui, labelBars, customEFs
+        ref, gui, labelBars, customEFs, resultsDb
 
 if __name__ == "__main__":
     main()
@@ -20,7 +20,8 @@ def main():
     """
 
     title, vsLegends, vsPaths, \
-        libraryIDstr, truePosIDstr, ref, zoom, gui, showAUC = parseArgs()
+        libraryIDstr, truePosIDstr, ref, zoom, gui, showAUC, resultsDb = \
+        parseArgs()
 
     # Define mode
     mode = "enrich"
@@ -54,7 +55,8 @@ def main():
 
     # Read the results of each VS and keep only the ligIDs that are common
     # to all of them (create an interesect result list)
-    vsIntersects, ligIDintersectSet = p.intersectResults(vsPaths, libraryIDlist)
+    vsIntersects, ligIDintersectSet = p.intersectResults(vsPaths, libraryIDlist,
+                                                         resultsDb)
 
     # Get updated true positive, true negative and library counts given the
     # intersect results
@@ -123,6 +125,9 @@ def parseArgs():
     descr_zoom = "X-axis percentage to be displayed in the zoomed subplot"
     descr_gui = "Use this flag to display plot: saves to .png by the default"
     descr_showAUC = "Use this flag to display calculated NSQ-AUC in the inset"
+    descr_db = "Query the results database written by vs_results.py -db" \
+        " next to each results file, instead of reading the results file or" \
+        " its binary copy"
 
     # adding arguments to the parser
     parser = argparse.ArgumentParser(description=descr)
@@ -134,6 +139,7 @@ def parseArgs():
     parser.add_argument("--zoom", help=descr_zoom)
     parser.add_argument("-gui", action="store_true", help=descr_gui)
     parser.add_argument("-showAUC", action="store_true", help=descr_showAUC)
+    parser.add_argument("-db", action="store_true", help=descr_db)
 
     # parsing args
     args = parser.parse_args()
@@ -145,6 +151,7 @@ def parseArgs():
     zoom = args.zoom
     gui = args.gui
     showAUC = args.showAUC
+    resultsDb = args.db
 
     # Extrac the VS results paths and legends
     vsPaths = []
@@ -156,7 +163,7 @@ def parseArgs():
         i += 2
 
     return title, vsLegends, vsPaths, \
-        libraryIDstr, truePosIDstr, ref, zoom, gui, showAUC
+        libraryIDstr, truePosIDstr, ref, zoom, gui, showAUC, resultsDb
 
 if __name__ == "__main__":
     main()
@@ -18,7 +18,7 @@ def main():
 
     title, vsLegends, vsPaths, vsColors, vsLines, \
         truePosIDstr, falsePosIDstr, xAxisName, yAxisName, \
-        ref, gui, log, showAUC = parseArgs()
+        ref, gui, log, showAUC, resultsDb = parseArgs()
 
     # Define mode
     mode = "ROC"
@@ -49,7 +49,8 @@ def main():
     # Read the results of each VS and keep only the ligIDs that are common
     # to all of them
     vsIntersects, ligIDintersectSet = p.intersectResults(vsPaths,
-                                                         libraryIDlist)
+                                                         libraryIDlist,
+                                                         resultsDb)
 
     # Get updated true positive, true negative and library counts given the
     # intersect results
@@ -122,6 +123,9 @@ def parseArgs():
     descr_gui = "Use this flag to display plot: saves to .png by the default"
     descr_log = "Display with X-axis in log scale"
     descr_showAUC = "Use this flag to display calculated NSQ-AUC in the inset"
+    descr_db = "Query the results database written by vs_results.py -db" \
+        " next to each results file, instead of reading the results file or" \
+        " its binary copy"
 
     # adding arguments to the parser
     parser = argparse.ArgumentParser(description=descr)
@@ -135,6 +139,7 @@ def parseArgs():
     parser.add_argument("-log", action="store_true", help=descr_log)
     parser.add_argument("--ref", help=descr_ref)
     parser.add_argument("-showAUC", action="store_true", help=descr_showAUC)
+    parser.add_argument("-db", action="store_true", help=descr_db)
 
     # parsing args
     args = parser.parse_args()
@@ -148,6 +153,7 @@ def parseArgs():
     gui = args.gui
     log = args.log
     showAUC = args.showAUC
+    resultsDb = args.db
 
     # Extrac the VS results paths and legends
     vsPaths = []
@@ -164,7 +170,7 @@ def parseArgs():
 
     return title, vsLegends, vsPaths, vsColors, vsLines, \
         truePosIDstr, falsePosIDstr, xAxisName, yAxisName, \
-        ref, gui, log, showAUC
+        ref, gui, log, showAUC, resultsDb
 
 
 if __name__ == "__main__":
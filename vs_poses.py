@@ -17,6 +17,8 @@ import argparse
 import socket
 from subprocess import check_output, STDOUT, CalledProcessError
 import json
+import numpy as np
+import vs_results
 
 
 def main():
@@ -25,7 +27,8 @@ def main():
     """
 
     # Get the arguments and paths
-    resultsPath, ligs_from_A, ligs_to_B, ligIDs, label = parseArgs()
+    resultsPath, ligs_from_A, ligs_to_B, ligIDs, label, resultsDb = \
+        parseArgs()
     icm = getPath()
 
     # Fix paths
@@ -34,11 +37,27 @@ def main():
     #projName = os.path.basename(os.path.dirname(cwd + "/" + resultsPath))
     projName = os.path.basename(glob.glob(cwd + "/*.log")[0]).replace(".log", "")
 
-    # Parse the VS results
-    resDataAll = parseResultsCsv(resultsPath)
-
-    # Select results, the X docked poses and/or optionally specific ligIDs
-    resDataSel = selectResults(resDataAll, ligs_from_A, ligs_to_B, ligIDs)
+    # Parse the VS results, and select results, the X docked poses and/or
+    # optionally specific ligIDs. The results database written by
+    # vs_results.py -db is queried if requested, otherwise the binary copy
+    # of the results is used when up to date
+    resCache = None
+    if not resultsDb:
+        resCache = vs_results.loadResultsCache(resultsPath)
+    if resultsDb:
+        resDb = vs_results.connectResultsDb(resultsPath)
+        if resDb is None:
+            print("No results database up to date with " + resultsPath +
+                  ", run vs_results.py with -db. Exiting.")
+            sys.exit()
+        resDataSel = selectDbResults(resDb, ligs_from_A, ligs_to_B, ligIDs)
+        resDb.close()
+    elif resCache is not None:
+        resDataSel = selectCachedResults(resCache, ligs_from_A, ligs_to_B,
+                                         ligIDs)
+    else:
+        resDataAll = parseResultsCsv(resultsPath)
+        resDataSel = selectResults(resDataAll, ligs_from_A, ligs_to_B, ligIDs)
 
     # Print the selected results
     printResults(resDataSel)
@@ -64,6 +83,9 @@ def parseArgs():
     descr_ligIDs = "Optional ligIDs docking poses to be extracted. Format " \
         "e.g. 1-10,133,217-301"
     descr_label = "Add a label suffix to all poses generated"
+    descr_db = "Query the results database written by vs_results.py -db" \
+        " next to the results file, instead of reading the results file or" \
+        " its binary copy"
 
     # Define arguments
     parser = argparse.ArgumentParser(description=descr)
@@ -72,6 +94,7 @@ def parseArgs():
     parser.add_argument("to_B", help=descr_to_B)
     parser.add_argument("--ligIDs", help=descr_ligIDs)
     parser.add_argument("--label", help=descr_label)
+    parser.add_argument("-db", action="store_true", help=descr_db)
 
     # Parse arguments
     args = parser.parse_args()
@@ -79,6 +102,7 @@ def parseArgs():
     from_A = int(args.from_A)
     to_B = int(args.to_B)
     ligIDs = args.ligIDs
+    resultsDb = args.db
 
     if args.label:
         label = args.label
@@ -89,7 +113,7 @@ def parseArgs():
     if ligIDs:
         ligIDs = makeIDlist(ligIDs)
 
-    return resultsPath, from_A, to_B, ligIDs, label
+    return resultsPath, from_A, to_B, ligIDs, label, resultsDb
 
 
 def makeIDlist(stringID):
@@ -164,7 +188,7 @@ def parseResultsCsv(resPath):
     # ICM score [9],
     # repeat directory [12]
     # note: skip the first line of the CSV file resData (header)
-    return [[ID, eval(row[0]), row[11], eval(row[9]), row[12]] for row, ID in
+    return [[ID, int(row[0]), row[11], float(row[9]), row[12]] for row, ID in
             zip(resData[1:], range(1, resLen))]
 
 
@@ -189,6 +213,53 @@ def selectResults(resDataAll, ligs_from_A, ligs_to_B, ligIDs):
         return resDataSel
 
 
+def selectCachedResults(resCache, ligs_from_A, ligs_to_B, ligIDs):
+    """
+    Same as selectResults, reading only the rows selected from the
+    memory-mapped binary copy of the VS results
+    """
+
+    # Overall rank (ID) of the X ligands, and of the rows of the optional
+    # ligIDs
+    ranks = np.arange(len(resCache))[ligs_from_A:ligs_to_B]
+    if ligIDs:
+        ranks = np.concatenate([ranks,
+                                np.flatnonzero(np.isin(resCache["No"],
+                                                       ligIDs))])
+
+    rows = resCache[ranks]
+
+    return [[rank + 1, ligID, name.decode(), score, str(repeat)]
+            for rank, ligID, name, score, repeat in
+            zip(ranks.tolist(), rows["No"].tolist(), rows["Name"].tolist(),
+                rows["Score"].tolist(), rows["Run"].tolist())]
+
+
+def selectDbResults(resDb, ligs_from_A, ligs_to_B, ligIDs):
+    """
+    Same as selectResults, querying the results table of the VS results
+    database
+    """
+
+    query = "SELECT Rank, No, Name, Score, Run FROM results "
+
+    # First select X ligands, ranks start at 1
+    rows = resDb.execute(query + "WHERE Rank > ? AND Rank <= ? ORDER BY Rank",
+                         (ligs_from_A, ligs_to_B)).fetchall()
+
+    # Then the optional ligIDs, by batches below the SQLite limit of
+    # parameters per query
+    if ligIDs:
+        for start in range(0, len(ligIDs), 500):
+            batch = ligIDs[start:start + 500]
+            rows += resDb.execute(query + "WHERE No IN (" +
+                                  ",".join(["?"] * len(batch)) +
+                                  ") ORDER BY Rank", batch).fetchall()
+
+    return [[rank, ligID, name, score, str(repeat)]
+            for rank, ligID, name, score, repeat in rows]
+
+
 def printResults(resData):
     """
     Takes in results and prints them out
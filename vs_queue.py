@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+
+# Worker of the chunk queue of a VS built by vs_build.py --pull. Every worker
+# job repeatedly claims the next ligand range (chunk) not yet docked, of any
+# repeat, and docks it. The queue only needs the shared filesystem: a chunk
+# is claimed by creating its claim file, which the worker touches while it
+# docks. The claims of workers that stopped touching them (killed jobs,
+# failed nodes) expire, and the next worker takes them over with a claim of
+# the next generation. Workers only exit once every chunk is done or failed
+# out, waiting for the chunks claimed by others until then
+#
+# https://github.com/thomas-coudrat/toolbx_vs
+# Thomas Coudrat <thomas.coudrat@gmail.com>
+
+import os
+import sys
+import time
+import json
+import socket
+import shutil
+import argparse
+import itertools
+import subprocess
+
+
+# Directory created in the VS directory, containing the queue parameters and
+# the claim, done and failed files of the chunks
+QUEUE_DIR = ".vs_queue"
+# Number of times a chunk that failed is reissued before giving up on it
+MAX_ATTEMPTS = 3
+
+
+def main():
+    """
+    Run script
+    """
+
+    vsDir, lease, maxTime = parseArguments()
+
+    queue = readQueue(vsDir)
+    queueDir = os.path.join(vsDir, QUEUE_DIR)
+    chunks = queueChunks(queue)
+    workerID = socket.gethostname() + "." + str(os.getpid())
+    workerStart = time.time()
+
+    print("\nWORKER " + workerID + ":\n")
+
+    chunkNum = 0
+    cursor = 0
+    waiting = False
+    while True:
+        # Stop claiming chunks when out of time
+        if maxTime and time.time() - workerStart > maxTime * 60:
+            print("\tmaximum time reached")
+            break
+
+        # Resume the scan after the last chunk claimed by any worker
+        cursor = max(cursor, readCursor(queueDir))
+        chunk, gen, cursor, pending = claimChunk(queueDir, chunks, workerID,
+                                                 lease, cursor)
+        if chunk is None and not pending:
+            print("\tno chunk left to claim")
+            break
+        # The chunks claimed by other workers are not done yet: wait for
+        # them, to take their claims over if the workers stop
+        if chunk is None:
+            if not waiting:
+                print("\twaiting for the chunks claimed by other workers")
+                sys.stdout.flush()
+                waiting = True
+            time.sleep(lease / 4.)
+            continue
+        waiting = False
+
+        repeat, lowerLimit, upperLimit = chunk
+        print("\trepeat " + str(repeat) + ", ligands " + str(lowerLimit) +
+              "-" + str(upperLimit))
+        sys.stdout.flush()
+        runChunk(vsDir, queueDir, queue, chunk, gen, workerID, lease)
+        chunkNum += 1
+
+    print("\n\t" + str(chunkNum) + " chunks claimed\n")
+
+
+def parseArguments():
+
+    # Parsing description of arguments
+    descr = "Claim and dock the chunks of the queue of a VS built with" \
+        " vs_build.py --pull, until none is left"
+    descr_vsDir = "Directory of the VS"
+    descr_lease = "Number of seconds after which the claim of a worker that" \
+        " stopped updating it expires, and its chunk is reissued. Default" \
+        " is 600"
+    descr_maxTime = "Number of minutes after which no more chunks are" \
+        " claimed, to finish before the walltime of the worker job"
+
+    # Defining the arguments
+    parser = argparse.ArgumentParser(description=descr)
+    parser.add_argument("vsDir", help=descr_vsDir)
+    parser.add_argument("--lease", type=float, default=600, help=descr_lease)
+    parser.add_argument("--maxTime", type=float, help=descr_maxTime)
+
+    # Parsing arguments
+    args = parser.parse_args()
+    vsDir = args.vsDir
+    lease = args.lease
+    maxTime = args.maxTime
+
+    return vsDir, lease, maxTime
+
+
+def writeQueue(vsDir, queue):
+    """
+    Create the queue of a VS, with its parameters: project name, ligand
+    range, chunk size, number of repeats, thoroughness and ICMHOME. The
+    claims of a previous queue are removed
+    """
+
+    queueDir = os.path.join(vsDir, QUEUE_DIR)
+    if os.path.exists(queueDir):
+        shutil.rmtree(queueDir)
+    os.makedirs(queueDir)
+
+    with open(os.path.join(queueDir, "queue.json"), "w") as f:
+        json.dump(queue, f, indent=1)
+
+
+def readQueue(vsDir):
+    """
+    Read the parameters of the queue of a VS
+    """
+
+    with open(os.path.join(vsDir, QUEUE_DIR, "queue.json"), "r") as f:
+        return json.load(f)
+
+
+def queueChunks(queue):
+    """
+    Return the chunks of the queue, [repeat, from, to], repeat by repeat
+    """
+
+    chunks = []
+    for repeat in range(1, queue["repeatNum"] + 1):
+        for lowerLimit in range(queue["libStart"], queue["libEnd"] + 1,
+                                queue["chunkSize"]):
+            upperLimit = min(lowerLimit + queue["chunkSize"] - 1,
+                             queue["libEnd"])
+            chunks.append([repeat, lowerLimit, upperLimit])
+
+    return chunks
+
+
+def chunkName(chunk):
+    """
+    Name of the claim, done and failed files of a chunk
+    """
+
+    return str(chunk[0]) + "_" + str(chunk[2])
+
+
+def claimChunk(queueDir, chunks, workerID, lease, cursor):
+    """
+    Claim the first chunk from the cursor on that is not done and either
+    not claimed, or whose claim expired and that did not fail MAX_ATTEMPTS
+    times. The chunks before the cursor are only checked again when none is
+    left after it, to reissue the expired claims, so that a claim costs a
+    few file operations while the queue is drained. Return the chunk, the
+    generation of its claim, the cursor following it (written as the hint
+    for all workers) and True. If there is none to claim, return None,
+    None, cursor and whether chunks are still pending: neither done nor
+    failed MAX_ATTEMPTS times, their claims held by other workers
+    """
+
+    for index in itertools.chain(range(cursor, len(chunks)),
+                                 range(min(cursor, len(chunks)))):
+        gen = claimGeneration(queueDir, chunkName(chunks[index]), workerID,
+                              lease)
+        if gen is not None:
+            writeCursor(queueDir, index + 1, workerID)
+            return chunks[index], gen, index + 1, True
+
+    pending = any(chunkPending(queueDir, chunkName(chunk))
+                  for chunk in chunks)
+
+    return None, None, cursor, pending
+
+
+def chunkPending(queueDir, name):
+    """
+    Return True if a chunk is neither done nor failed MAX_ATTEMPTS times
+    """
+
+    if os.path.exists(os.path.join(queueDir, name + ".done")):
+        return False
+
+    return not os.path.exists(os.path.join(queueDir, name + ".failed")) or \
+        failedAttempts(queueDir, name) < MAX_ATTEMPTS
+
+
+def readCursor(queueDir):
+    """
+    Return the index following the last chunk claimed by a worker, or 0
+    """
+
+    try:
+        with open(os.path.join(queueDir, "cursor"), "r") as f:
+            return int(f.read())
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def writeCursor(queueDir, cursor, workerID):
+    """
+    Write the index following the last chunk claimed. Only a hint for the
+    other workers, so concurrent writes may leave an older value
+    """
+
+    cursorPath = os.path.join(queueDir, "cursor")
+    with open(cursorPath + "." + workerID, "w") as f:
+        f.write(str(cursor))
+    os.replace(cursorPath + "." + workerID, cursorPath)
+
+
+def claimGeneration(queueDir, name, workerID, lease):
+    """
+    Claim a chunk, and return the generation of the claim, or None if it
+    cannot be claimed. The claims of a chunk are numbered: the first one is
+    <name>.claim.0, and an expired claim of generation n is taken over by
+    creating the claim of generation n + 1. A claim file is created only if
+    it does not exist, so that a single worker gets each generation, and
+    the claims are never renamed or removed by other workers
+    """
+
+    if os.path.exists(os.path.join(queueDir, name + ".done")):
+        return None
+
+    # Latest claim of the chunk
+    gen = 0
+    while os.path.exists(claimPath(queueDir, name, gen)):
+        gen += 1
+    if gen == 0:
+        return 0 if createClaim(queueDir, name, 0, workerID) else None
+
+    try:
+        age = time.time() - os.path.getmtime(claimPath(queueDir, name,
+                                                       gen - 1))
+    except FileNotFoundError:
+        return None
+    if age < lease:
+        return None
+    if os.path.exists(os.path.join(queueDir, name + ".failed")) and \
+            failedAttempts(queueDir, name) >= MAX_ATTEMPTS:
+        return None
+
+    # Take the expired claim over
+    if not createClaim(queueDir, name, gen, workerID):
+        return None
+    print("\tclaim of " + name + " expired, reissued")
+
+    return gen
+
+
+def claimPath(queueDir, name, gen):
+    """
+    Path of the claim file of a chunk, of the given generation
+    """
+
+    return os.path.join(queueDir, name + ".claim." + str(gen))
+
+
+def createClaim(queueDir, name, gen, workerID):
+    """
+    Create the claim file of a chunk with the ID of this worker, and return
+    True, or False if it exists already
+    """
+
+    try:
+        fd = os.open(claimPath(queueDir, name, gen),
+                     os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    os.write(fd, workerID.encode())
+    os.close(fd)
+
+    return True
+
+
+def failedAttempts(queueDir, name):
+    """
+    Number of times a chunk failed
+    """
+
+    with open(os.path.join(queueDir, name + ".failed"), "r") as f:
+        return len(f.readlines())
+
+
+def runChunk(vsDir, queueDir, queue, chunk, gen, workerID, lease):
+    """
+    Dock a chunk claimed by this worker in its repeat directory, writing
+    its .ou file as the slice scripts do, and touch its claim file while
+    docking. If the claim expired and was taken over meanwhile, the docking
+    is stopped and left to the new claim. Otherwise mark the chunk done, or
+    failed and its claim expired so that it is reissued
+    """
+
+    repeat, lowerLimit, upperLimit = chunk
+    name = chunkName(chunk)
+    ownClaim = claimPath(queueDir, name, gen)
+    nextClaim = claimPath(queueDir, name, gen + 1)
+    repeatDir = os.path.join(vsDir, str(repeat))
+    ouName = queue["projName"] + "_" + str(upperLimit)
+    ouPath = os.path.join(repeatDir, ouName + ".ou")
+
+    # Node running the chunk, read by vs_report.py
+    with open(os.path.join(repeatDir, ouName + ".host"), "w") as f:
+        f.write(socket.gethostname() + "\n")
+
+    # A previous claim of the chunk may still be writing to its .ou file
+    # until it notices it was taken over: write to a new file
+    if os.path.exists(ouPath):
+        os.remove(ouPath)
+
+    icmHome = queue["icmHome"]
+    command = [icmHome + "/icm64", "-vlscluster", icmHome + "/_dockScan",
+               queue["projName"], "thorough=" + queue["thor"],
+               "from=" + str(lowerLimit), "to=" + str(upperLimit)]
+    superseded = False
+    with open(ouPath, "w") as ouFile:
+        proc = subprocess.Popen(command, cwd=repeatDir, stdout=ouFile,
+                                stderr=subprocess.STDOUT)
+        while True:
+            try:
+                returnCode = proc.wait(timeout=lease / 4.)
+                break
+            except subprocess.TimeoutExpired:
+                if os.path.exists(nextClaim):
+                    superseded = True
+                    proc.kill()
+                    proc.wait()
+                    break
+                os.utime(ownClaim)
+
+    if superseded or os.path.exists(nextClaim):
+        print("\tclaim of " + name + " taken over, docking stopped")
+    elif returnCode == 0:
+        with open(os.path.join(queueDir, name + ".done"), "w") as f:
+            f.write(workerID + "\n")
+    else:
+        print("\t" + name + " failed with exit code " + str(returnCode))
+        with open(os.path.join(queueDir, name + ".failed"), "a") as f:
+            f.write(workerID + " " + str(returnCode) + "\n")
+        # Expire the claim, for the chunk to be reissued right away
+        os.utime(ownClaim, (0, 0))
+
+
+if __name__ == "__main__":
+    main()
@@ -9,7 +9,57 @@
 
 import glob
 import os
+import io
+import re
+import json
+import time
 import argparse
+import multiprocessing
+import vs_results
+import vs_queue
+
+
+# Directory created in the VS directory, containing the counters of each .ou
+# file read by the previous report
+CACHE_DIR = ".vs_report"
+# Version of the counters cache format, caches of other versions are ignored
+CACHE_VERSION = 1
+# Slice scripts written by vs_build.py, and the fields read from them
+SLICE_SCRIPTS = ["*.slurm", "*.sge", "slice_*.sh", "*.local"]
+SLICE_RANGE = re.compile(r"from=([0-9]+)\s+to=([0-9]+)\s+>&\s+(\S+\.ou)")
+# Slices of the job arrays written by vs_build.py --array
+SLICE_ARRAY = re.compile(r"^# VS array: project=(\S+) from=([0-9]+) "
+                         r"to=([0-9]+) size=([0-9]+) repeats=([0-9]+)-([0-9]+)$",
+                         re.MULTILINE)
+# Range of a resume build, in the log written by vs_build.py in the VS
+# directory
+RESUME_BUILD = re.compile(r"^\t resume: .*project=(\S+) from=([0-9]+) "
+                          r"to=([0-9]+) size=([0-9]+) "
+                          r"repeats=([0-9]+)-([0-9]+)$", re.MULTILINE)
+# SLURM (first group) or SGE (second group) walltime
+SLICE_WALLTIME = re.compile(r"^#(?:SBATCH\s+--time=(\S+)|"
+                            r"\$\s+-l\s+h_rt=(\S+))", re.MULTILINE)
+# Robust z-score (from the median and median absolute deviation of the
+# docking rates) below which a slice, or a node, is flagged as slow
+STRAGGLER_Z = 3.
+# Prefix of the metrics written in the Prometheus text exposition format
+METRIC_PREFIX = "vs_"
+# Bytes read at the end of each scheduler .out file to classify its error
+OUT_TAIL = 16384
+# Error signatures of the .out files, the first one found in the tail of a
+# file is kept. The scheduler messages also contain "error", so the generic
+# ICM error comes last
+ERROR_SIGNATURES = [
+    ("licence", re.compile(r"licen[cs]e|FLEXlm|lmgrd", re.IGNORECASE)),
+    ("OOM", re.compile(r"out of memory|oom[-_ ]kill|memory limit|"
+                       r"cannot allocate memory|bad_alloc", re.IGNORECASE)),
+    ("walltime", re.compile(r"time limit|walltime|h_rt", re.IGNORECASE)),
+    ("segfault", re.compile(r"segmentation fault|SIGSEGV|signal 11|"
+                            r"core dumped", re.IGNORECASE)),
+    ("ICM error", re.compile(r"error", re.IGNORECASE))]
+# Number of example .out files printed per error signature
+ERROR_EXAMPLES = 3
+
 
 def main():
     """
@@ -18,61 +68,296 @@ def main():
 
     # Setting up variables
     workDir = os.getcwd()
+    useCache, allSlices, jsonPath, promPath, jobs, allErrors = \
+        parseArguments()
 
     print("\n************************\n")
 
-    specs, skipCount = loopOverRepeats(workDir)
+    specs, skipCount, fileCounters, repeatScores = \
+        loopOverRepeats(workDir, useCache)
 
     # Print the skipped ligands data
     printSkipped(specs, skipCount)
 
-    # Print out the content of the slurm files, which
-    # will have ERROR information, or will be blank
-    # if no Error
-    printSlurmOuts(workDir)
+    # Print the progress of each repeat, from the ranges of the slices
+    slices = sliceProgress(workDir, readSlices(workDir), fileCounters,
+                           time.time())
+    printProgress(slices, allSlices)
+
+    # Print the slices and nodes with a docking rate well below the others
+    printStragglers(slices)
+
+    # Classify the errors found at the end of the slurm files, which
+    # will be blank if no Error
+    slurmOuts = classifySlurmOuts(workDir, jobs)
+    printSlurmOuts(slurmOuts, allErrors)
+
+    # Write the figures of this report for monitoring systems
+    if jsonPath or promPath:
+        metrics = reportMetrics(workDir, repeatScores, specs, skipCount,
+                                slices, slurmOuts)
+        if jsonPath:
+            writeMetricsJson(jsonPath, metrics)
+        if promPath:
+            writeMetricsProm(promPath, metrics)
+
 
+def parseArguments():
 
-def loopOverRepeats(workDir):
+    # Parsing description of arguments
+    descr = "Print a report on the progress of the VS in the current" \
+        " directory"
+    descr_noCache = "Read the .ou files in full, without using or updating" \
+        " the counters cached by the previous report in " + CACHE_DIR + \
+        ". The docking rates are measured between reports from the cache"
+    descr_allSlices = "Print the progress of every slice, instead of only" \
+        " the slices expected to overrun their walltime"
+    descr_json = "Also write the docked and skipped counts, error counts" \
+        " and docking rates of the report to this JSON file"
+    descr_prom = "Also write the docked and skipped counts, error counts" \
+        " and docking rates of the report to this file, in the Prometheus" \
+        " text exposition format (e.g. for the textfile collector of the" \
+        " node exporter)"
+    descr_jobs = "Number of processes reading the scheduler .out files in" \
+        " parallel. Default is 1"
+    descr_allErrors = "Print the full content of every scheduler .out file" \
+        " with errors, instead of the error signatures found at their end"
+
+    # Defining the arguments
+    parser = argparse.ArgumentParser(description=descr)
+    parser.add_argument("-noCache", action="store_true", help=descr_noCache)
+    parser.add_argument("-allSlices", action="store_true",
+                        help=descr_allSlices)
+    parser.add_argument("--json", help=descr_json)
+    parser.add_argument("--prom", help=descr_prom)
+    parser.add_argument("--jobs", type=int, default=1, help=descr_jobs)
+    parser.add_argument("-allErrors", action="store_true",
+                        help=descr_allErrors)
+
+    # Parsing arguments
+    args = parser.parse_args()
+    useCache = not args.noCache
+    allSlices = args.allSlices
+    jsonPath = args.json
+    promPath = args.prom
+    jobs = max(1, args.jobs)
+    allErrors = args.allErrors
+
+    return useCache, allSlices, jsonPath, promPath, jobs, allErrors
+
+
+def loopOverRepeats(workDir, useCache=False):
     """
     Loop over the repeats in this VS directory, gathering
-    information about the VS status
+    information about the VS status. With useCache, the counters of each
+    .ou file are read back from the cache of the previous report, and only
+    the bytes appended to the .ou files since then are read. Also return the
+    counters of each .ou file, by path relative to the VS directory without
+    its compression extension, and the score count of each repeat
     """
 
     # Dictionary containing specs as keys, and [MIN,MAX,COUNT] as values
     specs = {}
     skipCount = 0
 
+    cacheDir = os.path.join(workDir, CACHE_DIR)
+    cache = readCache(cacheDir) if useCache else {}
+    newCache = {}
+    fileCounters = {}
+    repeatScores = {}
+
     # Loop through the directories in this VS
     for subDir in os.listdir(workDir):
         # Check only repeat directories
         if subDir.isdigit():
             dirPath = os.path.join(workDir, subDir)
 
-            # Get all the *.ou files in this dir
-            ouFiles = glob.glob(dirPath + "/*.ou")
+            # Get all the *.ou files in this dir, compressed or not
+            ouFiles = vs_results.listOuFiles(dirPath)
 
             scoreCount = 0
             # Looping over .ou files in the current dir
             for file in ouFiles:
+                relPath = os.path.relpath(file, workDir)
+                entry, counters = countOuFile(file, cache.get(relPath))
+                newCache[relPath] = entry
+                if vs_results.isCompressed(relPath):
+                    relPath = os.path.splitext(relPath)[0]
+                fileCounters[relPath] = counters
 
-                # Read all lines of that .ou file
-                f = open(file, "r")
-                lines = f.readlines()
-                f.close()
-
-                # Loop through the lines in that file,
-                # and collect both the SCORE count and
-                # the Skipped information
-                for line in lines:
-                    # Update "SCORE" count
-                    if "SCORE" in line:
-                        scoreCount +=1
-                    # Update "Skipping" count
-                    specs, skipCount = countSkipped(line, specs, skipCount)
+                scoreCount += counters["scores"]
+                skipCount += counters["skipped"]
+                mergeSpecs(specs, counters["specs"])
 
             printCompleted(subDir, scoreCount)
+            repeatScores[subDir] = scoreCount
 
-    return specs, skipCount
+    if useCache:
+        writeCache(cacheDir, newCache)
+
+    return specs, skipCount, fileCounters, repeatScores
+
+
+def countOuFile(ouFilePath, entry):
+    """
+    Count the SCORE lines and the Skipping lines by criterion of an .ou
+    file, starting from the counters of its cache entry and reading the
+    lines written after the offset recorded in it. A file that is shorter
+    than that offset, or whose fingerprint changed, was rewritten and is
+    read again from the start. A trailing line still being written
+    is counted, but not cached. The modification time and number of
+    ligands processed (docked or skipped) when the file was first read are
+    kept to measure its docking rate. Return the updated cache entry and
+    the counters of the file
+    """
+
+    stat = os.stat(ouFilePath)
+    size = stat.st_size
+    compressed = vs_results.isCompressed(ouFilePath)
+
+    # Check that the cache entry still matches the .ou file. Compressed
+    # files are read again whenever they change
+    if entry is not None:
+        if size == entry["size"] and stat.st_mtime_ns == entry["mtime"]:
+            pass
+        elif compressed or size < entry["offset"] or \
+                vs_results.fingerprint(ouFilePath,
+                                       entry["offset"]) != entry["tail"]:
+            entry = None
+
+    if entry is None:
+        entry = {"offset": 0, "scores": 0, "skipped": 0, "specs": {}}
+
+    if compressed:
+        lineEnd = size
+    else:
+        lineEnd = vs_results.completeLinesEnd(ouFilePath, entry["offset"],
+                                              size)
+
+    # Count the complete lines written after the offset
+    if lineEnd > entry["offset"]:
+        if compressed:
+            with vs_results.openOuFile(ouFilePath) as f:
+                countStream(f, None, entry)
+        else:
+            with open(ouFilePath, "rb") as f:
+                f.seek(entry["offset"])
+                countStream(f, lineEnd - entry["offset"], entry)
+
+    entry["size"] = size
+    entry["mtime"] = stat.st_mtime_ns
+    entry["offset"] = lineEnd
+    entry["tail"] = vs_results.fingerprint(ouFilePath, lineEnd)
+    if "start" not in entry:
+        entry["start"] = [stat.st_mtime, entry["scores"] + entry["skipped"]]
+
+    # Count the trailing line on a copy of the counters
+    counters = entry
+    if size > lineEnd:
+        counters = json.loads(json.dumps(entry))
+        with open(ouFilePath, "rb") as f:
+            f.seek(lineEnd)
+            countLines(f.read(), counters)
+
+    return entry, counters
+
+
+def countStream(f, size, counters):
+    """
+    Update the counters with the lines of the file object given, read up to
+    size bytes (or to its end if None) by blocks of vs_results.STREAM_BLOCK
+    bytes. The last line of a block, which may be incomplete, is carried
+    over to the next block
+    """
+
+    carry = b""
+    while True:
+        blockSize = vs_results.STREAM_BLOCK
+        if size is not None:
+            blockSize = min(blockSize, size)
+        block = f.read(blockSize)
+        if not block:
+            break
+        if size is not None:
+            size -= len(block)
+        data = carry + block
+        lineEnd = data.rfind(b"\n") + 1
+        countLines(data[:lineEnd], counters)
+        carry = data[lineEnd:]
+
+    countLines(carry, counters)
+
+
+def countLines(data, counters):
+    """
+    Update the counters with the lines of the bytes given, split as lines of
+    text are when reading a file
+    """
+
+    specs = counters["specs"]
+    skipCount = counters["skipped"]
+
+    text = data.decode("utf-8", "replace")
+    for line in io.StringIO(text, newline=None):
+        # Update "SCORE" count
+        if "SCORE" in line:
+            counters["scores"] += 1
+        # Update "Skipping" count
+        specs, skipCount = countSkipped(line, specs, skipCount)
+
+    counters["specs"] = specs
+    counters["skipped"] = skipCount
+
+
+def mergeSpecs(specs, fileSpecs):
+    """
+    Merge the [MIN,MAX,COUNT] of each criterion of an .ou file into specs.
+    countSkipped counts a criterion from 0 on its first occurrence, so the
+    COUNT of a criterion found in several files is one less than the sum
+    of their occurrences
+    """
+
+    for spec, (specMin, specMax, count) in fileSpecs.items():
+        if spec not in specs:
+            specs[spec] = [specMin, specMax, count]
+        else:
+            specs[spec][0] = min(specs[spec][0], specMin)
+            specs[spec][1] = max(specs[spec][1], specMax)
+            specs[spec][2] += count + 1
+
+
+def readCache(cacheDir):
+    """
+    Read the counters of the .ou files cached by the previous report. A
+    cache written in another format version is ignored
+    """
+
+    cachePath = os.path.join(cacheDir, "counters.json")
+    if not os.path.exists(cachePath):
+        return {}
+
+    with open(cachePath, "r") as f:
+        cache = json.load(f)
+
+    if cache.get("version") != CACHE_VERSION:
+        return {}
+
+    return cache["files"]
+
+
+def writeCache(cacheDir, cache):
+    """
+    Write the counters of the .ou files read, replacing the previous cache
+    only once fully written
+    """
+
+    if not os.path.exists(cacheDir):
+        os.makedirs(cacheDir)
+
+    cachePath = os.path.join(cacheDir, "counters.json")
+    with open(cachePath + ".tmp", "w") as f:
+        json.dump({"version": CACHE_VERSION, "files": cache}, f)
+    os.replace(cachePath + ".tmp", cachePath)
 
 
 def printCompleted(subDir, scoreCount):
@@ -144,14 +429,467 @@ def printSkipped(specs, skipCount):
         #print key, "| MIN:", [0], ", MAX:", specs[key][1], ", COUNT:", specs[key][2]
     print("\n")
 
-def printSlurmOuts(workDir):
+def readSlices(workDir):
+    """
+    Read the slice scripts of each repeat directory, and return a list of
+    slices: repeat, ligand range, path of the .ou file (relative to the VS
+    directory), walltime in seconds (None if not found) and the node it ran
+    on (None if not known). The walltime of the slice_*.sh scripts of
+    slurm-srun is the walltime of the srun script. The node is read from the
+    .host file written next to the .ou file by the slice scripts. The job
+    arrays, written in the repeat directories or in the VS directory, and
+    the chunk queue are expanded to their slices. After a resume build, the
+    .ou files kept from the previous builds are added as slices
+    """
+
+    slices = queueSlices(workDir)
+
+    for pattern in SLICE_SCRIPTS:
+        for scriptPath in glob.glob(workDir + "/" + pattern):
+            with open(scriptPath, "r") as f:
+                slices += arraySlices(f.read(), scriptPath, workDir)
+
+    for subDir in os.listdir(workDir):
+        if not subDir.isdigit():
+            continue
+        dirPath = os.path.join(workDir, subDir)
+
+        srunWalltime = None
+        for srunPath in glob.glob(dirPath + "/srun_*.slurm"):
+            with open(srunPath, "r") as f:
+                srunWalltime = scriptWalltime(f.read())
+
+        for pattern in SLICE_SCRIPTS:
+            for scriptPath in glob.glob(dirPath + "/" + pattern):
+                with open(scriptPath, "r") as f:
+                    script = f.read()
+                # The slices of resume builds dock several ranges
+                matches = list(SLICE_RANGE.finditer(script))
+                if not matches:
+                    slices += arraySlices(script, scriptPath, workDir)
+                    continue
+                walltime = scriptWalltime(script)
+                if walltime is None:
+                    walltime = srunWalltime
+
+                for match in matches:
+                    slices.append({"repeat": subDir,
+                                   "script": os.path.relpath(scriptPath,
+                                                             workDir),
+                                   "from": int(match.group(1)),
+                                   "to": int(match.group(2)),
+                                   "ouFile": os.path.join(subDir,
+                                                          match.group(3)),
+                                   "walltime": walltime,
+                                   "host": readHost(os.path.join(
+                                       dirPath,
+                                       match.group(3)[:-3] + ".host"))})
+
+    slices += previousSlices(workDir, slices)
+
+    slices.sort(key=lambda sl: (int(sl["repeat"]), sl["from"]))
+
+    return slices
+
+
+def arraySlices(script, scriptPath, workDir):
+    """
+    Return the slices of a job array script, in the same format as readSlices,
+    or an empty list if the script is not a job array. A slice is named
+    after the script and its task ID
+    """
+
+    match = SLICE_ARRAY.search(script)
+    if match is None:
+        return []
+
+    projName = match.group(1)
+    libStart, libEnd, sliceSize, firstRepeat, lastRepeat = \
+        [int(group) for group in match.groups()[1:]]
+    walltime = scriptWalltime(script)
+    scriptName = os.path.relpath(scriptPath, workDir)
+
+    slices = []
+    task = 1
+    for repeat in range(firstRepeat, lastRepeat + 1):
+        for lowerLimit in range(libStart, libEnd + 1, sliceSize):
+            upperLimit = min(lowerLimit + sliceSize - 1, libEnd)
+            ouName = projName + "_" + str(upperLimit) + ".ou"
+            slices.append({"repeat": str(repeat),
+                           "script": scriptName + "[" + str(task) + "]",
+                           "from": lowerLimit,
+                           "to": upperLimit,
+                           "ouFile": os.path.join(str(repeat), ouName),
+                           "walltime": walltime,
+                           "host": readHost(os.path.join(
+                               workDir, str(repeat), ouName[:-3] + ".host"))})
+            task += 1
+
+    return slices
+
+
+def previousSlices(workDir, slices):
+    """
+    Return the .ou files kept by the latest resume build (read from the log
+    written by vs_build.py) as slices in the same format as readSlices, so
+    that the progress of each repeat covers the whole range of the VS and
+    not only the ligands missing from those files. The .ou files of the
+    slices given are left out. The range of an .ou file is read from its
+    name: the range of a gap docked by a resume build, or the upper limit of
+    a slice of the original build. A slice is named after its .ou file
+    """
+
+    builds = []
+    for logPath in glob.glob(workDir + "/*.log"):
+        with open(logPath, "r") as f:
+            builds += RESUME_BUILD.findall(f.read())
+
+    sliceOuFiles = set([sl["ouFile"] for sl in slices])
+    previous = []
+    for build in builds:
+        projName = build[0]
+        libStart, libEnd, sliceSize, firstRepeat, lastRepeat = \
+            [int(group) for group in build[1:]]
+        ouName = re.compile(re.escape(projName) +
+                            r"_(?:([0-9]+)-)?([0-9]+)\.ou$")
+
+        for repeat in range(firstRepeat, lastRepeat + 1):
+            dirPath = os.path.join(workDir, str(repeat))
+            for ouFilePath in vs_results.listOuFiles(dirPath):
+                relPath = os.path.relpath(ouFilePath, workDir)
+                if vs_results.isCompressed(relPath):
+                    relPath = os.path.splitext(relPath)[0]
+                match = ouName.match(os.path.basename(relPath))
+                if relPath in sliceOuFiles or match is None:
+                    continue
+                upperLimit = int(match.group(2))
+                if match.group(1):
+                    lowerLimit = int(match.group(1))
+                else:
+                    lowerLimit = libStart + \
+                        (upperLimit - libStart) // sliceSize * sliceSize
+                if lowerLimit < libStart or upperLimit > libEnd or \
+                        lowerLimit > upperLimit:
+                    continue
+
+                previous.append({"repeat": str(repeat),
+                                 "script": relPath,
+                                 "from": lowerLimit,
+                                 "to": upperLimit,
+                                 "ouFile": relPath,
+                                 "walltime": None,
+                                 "host": readHost(os.path.join(
+                                     workDir, relPath[:-3] + ".host")),
+                                 "previous": True})
+
+    return previous
+
+
+def queueSlices(workDir):
     """
-    Go through the repeats directories and print out their content,
-    they contain errors that might have occured
+    Return the chunks of the queue of the VS, if any, as slices in the same
+    format as readSlices. A chunk is named after its queue files
+    """
+
+    if not os.path.exists(os.path.join(workDir, vs_queue.QUEUE_DIR)):
+        return []
+
+    queue = vs_queue.readQueue(workDir)
+    slices = []
+    for chunk in vs_queue.queueChunks(queue):
+        repeat, lowerLimit, upperLimit = chunk
+        ouName = queue["projName"] + "_" + str(upperLimit) + ".ou"
+        slices.append({"repeat": str(repeat),
+                       "script": os.path.join(vs_queue.QUEUE_DIR,
+                                              vs_queue.chunkName(chunk)),
+                       "from": lowerLimit,
+                       "to": upperLimit,
+                       "ouFile": os.path.join(str(repeat), ouName),
+                       "walltime": None,
+                       "host": readHost(os.path.join(
+                           workDir, str(repeat), ouName[:-3] + ".host"))})
+
+    return slices
+
+
+def readHost(hostPath):
+    """
+    Return the node name written to a .host file, or None
+    """
+
+    if not os.path.exists(hostPath):
+        return None
+
+    with open(hostPath, "r") as f:
+        host = f.read().strip()
+
+    return host or None
+
+
+def scriptWalltime(script):
+    """
+    Return the walltime in seconds requested by a SLURM or SGE script, or
+    None if not found
+    """
+
+    match = SLICE_WALLTIME.search(script)
+    if match is None:
+        return None
+    if match.group(1):
+        return parseWalltime(match.group(1))
+
+    return parseWalltime(match.group(2), sge=True)
+
+
+def parseWalltime(walltime, sge=False):
+    """
+    Convert a SLURM (days-hours:minutes:seconds, and shorter forms) or SGE
+    (hours:minutes:seconds, or seconds) walltime to seconds. Return None if
+    it cannot be read
+    """
+
+    try:
+        days = 0
+        if "-" in walltime:
+            days, walltime = walltime.split("-", 1)
+            # days-hours, days-hours:minutes and days-hours:minutes:seconds
+            parts = [int(part) for part in walltime.split(":")]
+            parts += [0] * (3 - len(parts))
+        else:
+            parts = [int(part) for part in walltime.split(":")]
+            if len(parts) == 1:
+                # SGE seconds, SLURM minutes
+                parts = [0, 0, parts[0]] if sge else [0, parts[0], 0]
+            elif len(parts) == 2:
+                # SLURM minutes:seconds
+                parts = [0] + parts
+        hours, minutes, seconds = parts
+        return ((int(days) * 24 + hours) * 60 + minutes) * 60 + seconds
+    except ValueError:
+        return None
+
+
+def sliceProgress(workDir, slices, fileCounters, now):
+    """
+    Add to each slice its number of ligands processed (docked or skipped)
+    and its size, its docking rate in ligands per hour, the hours left
+    (ETA) and whether it is expected to overrun its walltime. The rate of a
+    slice is measured from the growth of its .ou file since it was first
+    read by a report or, when it did not grow since (first report, or
+    -noCache), since the slice started: the modification time of its .host
+    file. Running slices without a rate yet get the average rate of the
+    running slices of their repeat (the rates of the finished slices are
+    only compared by findStragglers). The .ou files kept by a resume build
+    are finished slices of the ligands they processed, the others being
+    docked by the resume slices; those with none are left out
+    """
+
+    for sl in slices:
+        counters = fileCounters.get(sl["ouFile"])
+        sl["total"] = sl["to"] - sl["from"] + 1
+        sl["done"] = 0
+        sl["rate"] = None
+        sl["started"] = counters is not None
+        if counters is None:
+            continue
+
+        sl["done"] = min(sl["total"],
+                         counters["scores"] + counters["skipped"])
+        if sl.get("previous"):
+            sl["total"] = sl["done"]
+        if "start" in counters:
+            startTime, startDone = counters["start"]
+            hours = (counters["mtime"] / 1e9 - startTime) / 3600.
+            if hours > 0 and sl["done"] > startDone:
+                sl["rate"] = (sl["done"] - startDone) / hours
+
+        # The .host file is written by the slice before docking
+        hostPath = os.path.join(workDir, sl["ouFile"][:-3] + ".host")
+        if sl["rate"] is None and sl["done"] > 0 and \
+                os.path.exists(hostPath):
+            hours = (counters["mtime"] / 1e9 -
+                     os.path.getmtime(hostPath)) / 3600.
+            if hours > 0:
+                sl["rate"] = sl["done"] / hours
+
+    # Average rate of the running slices of each repeat
+    repeatRates = {}
+    for sl in runningSlices(slices):
+        if sl["rate"] is not None:
+            repeatRates.setdefault(sl["repeat"], []).append(sl["rate"])
+
+    for sl in slices:
+        sl["eta"] = None
+        sl["overrun"] = False
+        rate = sl["rate"]
+        if rate is None and sl["repeat"] in repeatRates:
+            rate = sum(repeatRates[sl["repeat"]]) / \
+                len(repeatRates[sl["repeat"]])
+        if sl["done"] >= sl["total"]:
+            sl["eta"] = 0.
+        elif rate:
+            sl["eta"] = (sl["total"] - sl["done"]) / rate
+            # Time needed by the whole slice at that rate
+            if sl["walltime"] and sl["started"] and \
+                    sl["total"] / rate * 3600. > sl["walltime"]:
+                sl["overrun"] = True
+
+    return [sl for sl in slices if sl["total"] > 0]
+
+
+def runningSlices(slices):
+    """
+    Return the slices started and not finished
+    """
+
+    return [sl for sl in slices if sl["started"] and sl["done"] < sl["total"]]
+
+
+def printProgress(slices, allSlices):
+    """
+    Print the progress, docking rate and ETA of each repeat, and of the
+    slices expected to overrun their walltime (or of all slices)
     """
 
     print("\n************************")
-    print("ERRORS?\n")
+    print("PROGRESS:\n")
+
+    if not slices:
+        print("No slice scripts found\n")
+        return
+
+    repeats = []
+    for sl in slices:
+        if sl["repeat"] not in repeats:
+            repeats.append(sl["repeat"])
+
+    for repeat in repeats:
+        repSlices = [sl for sl in slices if sl["repeat"] == repeat]
+        done = sum([sl["done"] for sl in repSlices])
+        total = sum([sl["total"] for sl in repSlices])
+        running = runningSlices(repSlices)
+        rates = [sl["rate"] for sl in running if sl["rate"]]
+        etas = [sl["eta"] for sl in repSlices]
+
+        line = "REPEAT " + repeat + ": {:.1f}% ({}/{} ligands), {} " \
+            "running slices".format(100. * done / total, done, total,
+                                    len(running))
+        if rates:
+            line += ", {:.1f} ligands/h".format(sum(rates))
+        if None not in etas:
+            line += ", ETA {:.1f} h".format(max(etas))
+        print(line)
+
+    flagged = [sl for sl in slices if allSlices or sl["overrun"]]
+    if flagged:
+        print("\n{:<40}{:>20}{:>8}{:>14}{:>10}".format("SLICE", "LIGANDS",
+                                                      "DONE", "LIGANDS/H",
+                                                      "ETA (H)"))
+    for sl in flagged:
+        line = "{:<40}{:>20}{:>7.1f}%{:>14}{:>10}".format(
+            sl["script"], "{}-{}".format(sl["from"], sl["to"]),
+            100. * sl["done"] / sl["total"],
+            "-" if sl["rate"] is None else "{:.1f}".format(sl["rate"]),
+            "-" if sl["eta"] is None else "{:.1f}".format(sl["eta"]))
+        if sl["overrun"]:
+            line += "  OVERRUN (walltime {:.1f} h)".format(
+                sl["walltime"] / 3600.)
+        print(line)
+    print("\n")
+
+
+def findStragglers(slices):
+    """
+    Compare the docking rate of each slice with a rate to the distribution
+    of the rates of the campaign, and return the median rate, the slices
+    with a robust z-score below -STRAGGLER_Z, and the rates of the slices
+    grouped by node: [node, slice count, median rate, flagged]. A node is
+    flagged when the median rate of its slices is below the same threshold
+    """
+
+    rates = sorted([sl["rate"] for sl in slices if sl["rate"]])
+    if not rates:
+        return None, [], []
+
+    median = medianOf(rates)
+    # Scaled to the standard deviation of normally distributed rates
+    spread = 1.4826 * medianOf(sorted([abs(rate - median)
+                                       for rate in rates]))
+    if spread > 0:
+        threshold = median - STRAGGLER_Z * spread
+    else:
+        threshold = None
+
+    stragglers = [sl for sl in slices if sl["rate"] and
+                  threshold is not None and sl["rate"] < threshold]
+
+    nodeRates = {}
+    for sl in slices:
+        if sl["rate"] and sl["host"]:
+            nodeRates.setdefault(sl["host"], []).append(sl["rate"])
+    nodes = []
+    for host in sorted(nodeRates):
+        nodeMedian = medianOf(sorted(nodeRates[host]))
+        nodes.append([host, len(nodeRates[host]), nodeMedian,
+                      threshold is not None and nodeMedian < threshold])
+
+    return median, stragglers, nodes
+
+
+def medianOf(values):
+    """
+    Return the median of a sorted list of values
+    """
+
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+
+    return (values[middle - 1] + values[middle]) / 2.
+
+
+def printStragglers(slices):
+    """
+    Print the slices with a docking rate well below the rest of the
+    campaign, and the docking rate of each node
+    """
+
+    median, stragglers, nodes = findStragglers(slices)
+    if median is None:
+        return
+
+    print("************************")
+    print("STRAGGLERS:\n")
+    print("Median docking rate: {:.1f} ligands/h\n".format(median))
+
+    for sl in stragglers:
+        print("{:<40}{:>12.1f} ligands/h ({:.0f}% of median){}".format(
+            sl["script"], sl["rate"], 100. * sl["rate"] / median,
+            "" if sl["host"] is None else ", node " + sl["host"]))
+    if not stragglers:
+        print("No slow slices")
+
+    if nodes:
+        print("\n{:<30}{:>8}{:>14}{:>12}".format("NODE", "SLICES",
+                                                "LIGANDS/H", "OF MEDIAN"))
+    for host, sliceNum, nodeMedian, flagged in nodes:
+        print("{:<30}{:>8}{:>14.1f}{:>11.0f}%{}".format(
+            host, sliceNum, nodeMedian, 100. * nodeMedian / median,
+            "  SLOW" if flagged else ""))
+    print("\n")
+
+
+def classifySlurmOuts(workDir, jobs=1):
+    """
+    Go through the repeats directories and classify the .out files of the
+    scheduler, they contain errors that might have occured. Only the end of
+    each file is read, with jobs processes. Return the repeat, path, error
+    signature and error line of the files that are not empty
+    """
+
+    # The tasks of a job array running all the repeats write their .out
+    # files in the VS directory
+    slurmOutPaths = sorted(glob.glob(workDir + "/*.out"))
 
     # Loop through the directories in this VS
     for subDir in os.listdir(workDir):
@@ -159,20 +897,213 @@ def printSlurmOuts(workDir):
         if subDir.isdigit():
             dirPath = os.path.join(workDir, subDir)
 
-            # Get all the *.ou files in this dir
-            slurmOutPaths = glob.glob(dirPath + "/*.out")
+            # Get all the *.out files in this dir
+            slurmOutPaths += sorted(glob.glob(dirPath + "/*.out"))
+
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        classified = pool.imap(classifySlurmOut, slurmOutPaths,
+                               chunksize=64)
+    else:
+        pool = None
+        classified = map(classifySlurmOut, slurmOutPaths)
+
+    slurmOuts = []
+    try:
+        for slurmOutPath, signature, errorLine in classified:
+            if signature is not None:
+                subDir = os.path.basename(os.path.dirname(slurmOutPath))
+                slurmOuts.append([subDir, slurmOutPath, signature,
+                                  errorLine])
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    return slurmOuts
+
+
+def classifySlurmOut(slurmOutPath):
+    """
+    Read the last OUT_TAIL bytes of a .out file, and return its path, the
+    first of the ERROR_SIGNATURES found there, and the last line matching
+    it. Files that are empty get no signature, files without a known
+    signature are "other", with their last line
+    """
 
-            for slurmOutPath in slurmOutPaths:
-                slurmOutFile = open(slurmOutPath, "r")
-                slurmLines = slurmOutFile.readlines()
-                slurmOutFile.close()
+    with open(slurmOutPath, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - OUT_TAIL))
+        data = f.read()
 
-                if len(slurmLines) > 0:
-                    print(slurmOutPath)
-                    for line in slurmLines:
-                        print(line)
+    lines = [line.strip() for line in
+             data.decode("utf-8", "replace").splitlines()]
+    # The first line read may be cut
+    if size > OUT_TAIL:
+        lines = lines[1:]
+    lines = [line for line in lines if line]
+    if not lines:
+        return slurmOutPath, None, None
+
+    for signature, pattern in ERROR_SIGNATURES:
+        for line in reversed(lines):
+            if pattern.search(line):
+                return slurmOutPath, signature, line
+
+    return slurmOutPath, "other", lines[-1]
+
+
+def printSlurmOuts(slurmOuts, allErrors=False):
+    """
+    Print the number of .out files with each error signature, with an
+    example error line and example files, or the full content of the .out
+    files with errors
+    """
+
+    print("\n************************")
+    print("ERRORS?\n")
+
+    if allErrors:
+        for subDir, slurmOutPath, signature, errorLine in slurmOuts:
+            print(slurmOutPath)
+            with open(slurmOutPath, "r", errors="replace") as f:
+                for line in f:
+                    print(line)
+        print("\n")
+        return
+
+    signatures = {}
+    for subDir, slurmOutPath, signature, errorLine in slurmOuts:
+        signatures.setdefault(signature, []).append([slurmOutPath,
+                                                     errorLine])
+
+    # Most frequent signatures first
+    for signature in sorted(signatures, key=lambda sig:
+                            -len(signatures[sig])):
+        examples = signatures[signature]
+        print("{}: {} .out files".format(signature.upper(), len(examples)))
+        print("\t" + examples[0][1])
+        for slurmOutPath, errorLine in examples[:ERROR_EXAMPLES]:
+            print("\t" + slurmOutPath)
+        if len(examples) > ERROR_EXAMPLES:
+            print("\t...")
+        print("")
+    if not slurmOuts:
+        print("No errors")
     print("\n")
 
 
+def reportMetrics(workDir, repeatScores, specs, skipCount, slices,
+                  slurmOuts):
+    """
+    Gather the figures of the report: per repeat, the ligands docked,
+    processed (docked or skipped) and to be processed, the docking rate of
+    the running slices in ligands per hour and the number of .out files
+    with errors, and the
+    number of ligands skipped by criterion and of .out files by error
+    signature. The COUNT of specs is one less than the occurrences of a
+    criterion, the actual occurrences are kept
+    """
+
+    repeats = {}
+    for repeat in sorted(repeatScores, key=int):
+        repSlices = [sl for sl in slices if sl["repeat"] == repeat]
+        repeats[repeat] = {
+            "docked": repeatScores[repeat],
+            "processed": sum([sl["done"] for sl in repSlices]),
+            "ligands": sum([sl["total"] for sl in repSlices]),
+            "rate": sum([sl["rate"] for sl in runningSlices(repSlices)
+                         if sl["rate"]]),
+            "runningSlices": len(runningSlices(repSlices)),
+            "errors": len([out for out in slurmOuts if out[0] == repeat])}
+
+    criteria = {}
+    for spec in sorted(specs):
+        specMin, specMax, count = specs[spec]
+        criteria[spec] = {"min": specMin, "max": specMax, "count": count + 1}
+
+    signatures = {}
+    for out in slurmOuts:
+        signatures[out[2]] = signatures.get(out[2], 0) + 1
+
+    return {"project": os.path.basename(workDir),
+            "time": time.time(),
+            "repeats": repeats,
+            "skipped": skipCount,
+            "criteria": criteria,
+            "errors": len(slurmOuts),
+            "signatures": signatures,
+            "rate": sum([rep["rate"] for rep in repeats.values()])}
+
+
+def writeMetricsJson(jsonPath, metrics):
+    """
+    Write the figures of the report to a JSON file, replacing the previous
+    one only once fully written
+    """
+
+    with open(jsonPath + ".tmp", "w") as f:
+        json.dump(metrics, f, indent=1)
+    os.replace(jsonPath + ".tmp", jsonPath)
+
+
+def writeMetricsProm(promPath, metrics):
+    """
+    Write the figures of the report in the Prometheus text exposition
+    format, labelled by project, repeat and skipping criterion. The file is
+    replaced only once fully written, as collectors may read it any time
+    """
+
+    project = promLabel(metrics["project"])
+    lines = []
+
+    def addMetric(name, descr, samples):
+        lines.append("# HELP " + METRIC_PREFIX + name + " " + descr)
+        lines.append("# TYPE " + METRIC_PREFIX + name + " gauge")
+        for labels, value in samples:
+            labels = ",".join(['project="' + project + '"'] +
+                              [key + '="' + promLabel(val) + '"'
+                               for key, val in labels])
+            lines.append(METRIC_PREFIX + name + "{" + labels + "} " +
+                         repr(float(value)))
+
+    repeats = sorted(metrics["repeats"].items(), key=lambda rep: int(rep[0]))
+    for name, key, descr in [
+            ("docked_ligands", "docked", "Ligands docked (SCORES lines)"),
+            ("processed_ligands", "processed",
+             "Ligands docked or skipped by the slices"),
+            ("slice_ligands", "ligands", "Ligands in the slices"),
+            ("docking_rate_ligands_per_hour", "rate",
+             "Docking rate of the running slices, in ligands per hour"),
+            ("running_slices", "runningSlices", "Slices running"),
+            ("error_logs", "errors", "Scheduler .out files with errors")]:
+        addMetric(name, descr, [([("repeat", repeat)], values[key])
+                               for repeat, values in repeats])
+
+    addMetric("skipped_ligands", "Ligands skipped, by criterion",
+              [([("criterion", spec)], values["count"])
+               for spec, values in sorted(metrics["criteria"].items())])
+    addMetric("error_signature_logs",
+              "Scheduler .out files with errors, by error signature",
+              [([("signature", signature)], count)
+               for signature, count in sorted(metrics["signatures"].items())])
+    addMetric("report_timestamp_seconds", "Time of the report",
+              [([], metrics["time"])])
+
+    with open(promPath + ".tmp", "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(promPath + ".tmp", promPath)
+
+
+def promLabel(value):
+    """
+    Escape a label value of the Prometheus text exposition format
+    """
+
+    return str(value).replace("\\", "\\\\").replace('"', '\\"') \
+        .replace("\n", "\\n")
+
+
 if __name__ == "__main__":
     main()
@@ -10,7 +10,121 @@
 
 import glob
 import os
+import re
+import mmap
 import argparse
+import multiprocessing
+import io
+import json
+import collections
+import pickle
+import hashlib
+import heapq
+import sqlite3
+import gzip
+import lzma
+import time
+import shutil
+import tempfile
+import resource
+import numpy as np
+
+# Optional, to read .ou.zst files
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Energy terms found on a SCORES> record, in the order they are written to the
+# results files (the "No" column is the ligand ID, "Name" and "Run#" follow)
+SCORE_FIELDS = ["Nat", "Nva", "dEhb", "dEgrid", "dEin", "dEsurf", "dEel",
+                "dEhp", "Score", "mfScore"]
+# Columns of the results, and their NumPy type. The ligand name is stored as
+# UTF-8 encoded bytes, with a width set by the longest name
+RESULT_COLUMNS = ["No"] + SCORE_FIELDS + ["Name", "Run"]
+INT_COLUMNS = ["No", "Nat", "Nva", "Run"]
+RESULT_HEADER = "No,Nat,Nva,dEhb,dEgrid,dEin,dEsurf,dEel,dEhp,Score," \
+    "mfScore,Name,Run#\n"
+# Format of a results line, with the name written as text. The energy terms
+# and mfScore are written with the number of decimals of their column in the
+# .ou files (see columnDecimals), and the Score as a float, as in the results
+# files of the original line by line parser. Values that could not be read
+# are written as nan
+RESULT_LINE = "%d,%d,%d,{dEhb},{dEgrid},{dEin},{dEsurf},{dEel},{dEhp},%r," \
+    "{mfScore},%s,%d\n"
+DECIMAL_COLUMNS = ["dEhb", "dEgrid", "dEin", "dEsurf", "dEel", "dEhp",
+                   "mfScore"]
+# Largest number of decimals of a column, above which its values are written
+# as floats
+MAX_DECIMALS = 6
+# Optional columns of the score statistics of each ligand across repeats,
+# appended to the results file
+STATS_COLUMNS = ["ScoreMean", "ScoreMedian", "ScoreStd", "ScoreRange",
+                 "Repeats"]
+STATS_LINE = ",%r,%r,%r,%r,%d\n"
+# Number of results lines formatted at once when writing a results file
+WRITE_CHUNK = 100000
+# Extension of the binary copy of a results file, holding a NumPy structured
+# array with one field per results column, that can be memory-mapped
+CACHE_EXT = ".npy"
+# Extension of the SQLite database of all dockings, written next to the
+# results .csv file
+DB_EXT = ".db"
+
+
+def compileScoreRecord():
+    """
+    Build the regular expression matching well formed "SCORES>" lines: the
+    ligand ID, followed by each of the SCORE_FIELDS tags and their numeric
+    value, and optionally the ligand name. Lines that do not follow that
+    layout are left to the token based parser
+    """
+
+    pattern = r"(?m)^[ \t]*SCORES>[ \t]+(?![^\s=]*(?:completed|FINISHED))" \
+        r"[!-<>-~]+[ \t]+([0-9]+)"
+    for field in SCORE_FIELDS:
+        pattern += r"[ \t]+" + field + r"=[ \t]+([-+.0-9]+)"
+    pattern += r"(?:[ \t]+Name=[ \t]+([!-~]+)(?:[ \t][^\r\n]*)?|[ \t]*)$"
+
+    return re.compile(pattern)
+
+
+SCORE_RECORD = compileScoreRecord()
+# Index of the Score value amongst the SCORE_RECORD groups
+SCORE_GROUP = SCORE_FIELDS.index("Score") + 1
+
+# Extensions of the compressed .ou files read by streaming decompression
+OU_COMPRESSED_EXTS = [".gz", ".xz", ".zst"]
+# Slice upper limit found at the end of the name of an .ou file
+OU_NAME = re.compile(r"([0-9]*)\.ou(?:" +
+                     "|".join([re.escape(ext) for ext in OU_COMPRESSED_EXTS]) +
+                     ")?$")
+# Number of decompressed bytes read at once from a compressed .ou file
+STREAM_BLOCK = 16 * 1024 * 1024
+# Ligand ID of the "SCORES>" lines, or of the lines of the skipped ligands
+PROCESSED_RECORD = re.compile(rb"(?m)^[ \t]*SCORES>[ \t]+\S+[ \t]+([0-9]+)|"
+                              rb"Skipping ligand[ \t]+([0-9]+)")
+
+# Number of chunks per job parsed ahead of the chunk being consumed, which
+# bounds the results waiting in the parent process
+QUEUED_CHUNKS = 2
+
+# Number of ligands of the --watch leaderboard when --top is not given
+WATCH_TOP = 20
+
+# Fraction of the --memory budget filled with records before they are
+# sorted and spilled to a run, leaving room for the sort
+RUN_FRACTION = 3
+
+# Directory created in the VS directory by -incremental runs, containing the
+# manifest of the .ou files parsed and the store of their records
+CHECKPOINT_DIR = ".vs_results"
+# Version of the records store format, stores of other versions are rebuilt
+CHECKPOINT_VERSION = 2
+# Number of bytes at the start of an .ou file, and preceding its last parsed
+# offset, that are hashed to detect files rewritten since they were parsed
+FINGERPRINT_SIZE = 4096
 
 
 def main():
@@ -19,7 +133,8 @@ def main():
     """
 
     # Get arguments
-    vsDir, minRep, allRep = parseArguments()
+    vsDir, minRep, allRep, jobs, incremental, topNum, repStats, resultsDb, \
+        watch, memory, tmpDir, profile, profileJson = parseArguments()
 
     # Get the project name out of the vsDir
     projName = os.path.basename(os.path.normpath(vsDir))
@@ -27,39 +142,182 @@ def main():
     if projName == ".":
         projName = os.path.basename(os.getcwd())
 
-    # Create the dictionary storing ligand info
-    # based on ligandID: for each ligandID key there
-    # is a number of ligangInfo lists equal to the
-    # number of repeats
-    ligDict = {}
+    # Follow the .ou files while the VS is running, until interrupted
+    if watch:
+        watchScoreData(vsDir, topNum or WATCH_TOP, watch)
+        return
+
+    # Wall time, records processed and peak memory of each stage
+    stages = []
+
+    if memory:
+        # Sort the dockings out of core, in runs spilled to disk, when a
+        # memory budget is given
+        externalSortResults(vsDir, projName, jobs, incremental, minRep,
+                            memory * 1024 * 1024, tmpDir, stages)
+    elif topNum:
+        # Stream the dockings through a bounded heap when only the top
+        # ligands are wanted
+        stageStart = startStage()
+        results, bestIndex = collectTopScoreData(vsDir, jobs, incremental,
+                                                 topNum, minRep)
+        recordStage(stages, "collect", stageStart, len(bestIndex), jobs)
+
+        stageStart = startStage()
+        writeResultFiles(results, bestIndex, projName, vsDir,
+                         "top{}_".format(topNum))
+        recordStage(stages, "write", stageStart, len(bestIndex))
+    else:
+        collectResults(vsDir, projName, jobs, incremental, minRep, allRep,
+                       repStats, resultsDb, stages)
 
-    # Goes through repeat directories to gather the score data
-    # Returns ligDict (VS results) total number of repeats
-    ligDict, totalRepeatNum = collectScoreData(vsDir, ligDict)
+    if profile:
+        printProfile(stages)
+    if profileJson:
+        writeProfile(vsDir + "/profile_" + projName + ".json", stages, jobs)
 
-    # Getting rid of the ligands that were not docking in all repeats attempted
-    ligDict = removeFailed(ligDict, totalRepeatNum, minRep)
 
-    # Sort each ligand docking amongst repeats
-    ligDict = sortRepeats(ligDict)
+def collectResults(vsDir, projName, jobs, incremental, minRep, allRep,
+                   repStats, resultsDb, stages):
+    """
+    Collect the results of the VS, and write the results files requested,
+    recording each stage in the stages list
+    """
+
+    # Goes through repeat directories to gather the score data
+    # Returns the results (one NumPy column per field of the dockings, with
+    # as many rows per ligand ID as there are repeats) and the total number
+    # of repeats
+    # The .ou file and number of dockings of each part of the results are
+    # kept for the database
+    sources = [] if resultsDb else None
+    stageStart = startStage()
+    results, totalRepeatNum = collectScoreData(vsDir, jobs, incremental,
+                                               sources)
+    allResults = results
+    decimals = resultsDecimals(allResults)
+    recordStage(stages, "collect", stageStart, resultsLength(results), jobs)
+
+    # Getting rid of the ligands that were not docking in all repeats
+    # attempted, and write the IDs missing from the results to file
+    stageStart = startStage()
+    results = removeFailed(results, totalRepeatNum, minRep,
+                           vsDir + "/missing_" + projName + ".json")
+    recordStage(stages, "filter", stageStart, resultsLength(allResults))
+
+    # Get the docking of each ligand with the best score amongst repeats,
+    # and the statistics of its scores across repeats if requested
+    stageStart = startStage()
+    bestIndex, stats = sortRepeats(results, repStats)
+    recordStage(stages, "sort", stageStart, resultsLength(results))
 
     # Write the results in a .csv file
-    writeResultFiles(ligDict, projName, vsDir)
+    stageStart = startStage()
+    writeResultFiles(results, bestIndex, projName, vsDir, stats=stats,
+                     decimals=decimals)
+    recordStage(stages, "write", stageStart, len(bestIndex))
+
+    # Load every docking and the ranked results into the SQLite database
+    if resultsDb:
+        stageStart = startStage()
+        writeResultsDb(allResults, sources, results, bestIndex, vsDir,
+                       vsDir + "/results_" + projName + ".csv")
+        recordStage(stages, "db", stageStart, resultsLength(allResults))
 
     # Write out individual results files for each repeat, if requested
     if allRep:
-        # For each repeat,
-        for repeat in range(1, totalRepeatNum + 1):
-            # Initialise a results text file
-            repFileName = "repeat{}_results_{}.csv".format(repeat, projName)
-            print("\t" + repFileName)
-            repFile = open(vsDir + "/" + repFileName, "w")
-            repFile.write("No,Nat,Nva,dEhb,dEgrid,dEin,dEsurf" +
-                          ",dEel,dEhp,Score,mfScore,Name,Run#\n")
+        stageStart = startStage()
+        writeRepeatFiles(results, totalRepeatNum, projName, vsDir, decimals)
+        recordStage(stages, "allRep", stageStart, resultsLength(results))
 
-            # Then, extract ligDict data corresponding to that repeat, sort,
-            # and write to text file
-            writeRepeatFile(repFile, repeat, ligDict)
+
+def startStage():
+    """
+    Start a stage: reset the peak memory (resident set size) of this
+    process, so that the peak of the stage alone is recorded, and return
+    the start time and the peak memory of the finished child processes so
+    far, to be passed to recordStage
+    """
+
+    # Resetting the peak is only possible on Linux. Elsewhere, the peak of
+    # the process so far is recorded
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+    return time.time(), \
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+
+def recordStage(stages, stage, stageStart, recordNum, processNum=1):
+    """
+    Append to the stages list the wall time of a stage started by
+    startStage, the number of records it processed, the peak memory
+    (resident set size) of the largest process during the stage, in MB, and
+    the number of processes of the stage. The peak is that of this process,
+    or of the largest child process that finished during the stage if
+    higher: with a pool of processNum processes, the memory used by the
+    stage as a whole is up to processNum times that peak
+    """
+
+    startTime, childrenStartRss = stageStart
+
+    # ru_maxrss and VmHWM are in KB
+    peakRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    peakRss = int(line.split()[1])
+    except OSError:
+        pass
+    # The child processes of a stage (the pool parsing the .ou files) only
+    # count if their peak is above the peak of the previous ones
+    childrenRss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if childrenRss > childrenStartRss:
+        peakRss = max(peakRss, childrenRss)
+
+    stages.append({"stage": stage,
+                   "time": time.time() - startTime,
+                   "records": int(recordNum),
+                   "peakRss": peakRss / 1024.,
+                   "processes": processNum})
+
+
+def printProfile(stages):
+    """
+    Print the summary table of the stages recorded
+    """
+
+    print("\nPROFILE:\n")
+
+    print("\t{:<10}{:>12}{:>14}{:>14}{:>22}{:>7}".format(
+        "stage", "time (s)", "records", "records/s", "peak RSS/proc (MB)",
+        "procs"))
+    for stage in stages:
+        rate = stage["records"] / stage["time"] if stage["time"] else 0
+        print("\t{:<10}{:>12.2f}{:>14d}{:>14.0f}{:>22.1f}{:>7d}".format(
+            stage["stage"], stage["time"], stage["records"], rate,
+            stage["peakRss"], stage["processes"]))
+    print("\t{:<10}{:>12.2f}".format("total",
+                                     sum([stage["time"] for stage in
+                                          stages])))
+
+
+def writeProfile(profilePath, stages, jobs):
+    """
+    Write the stages recorded to a JSON file
+    """
+
+    print("\n\tprofile written to " + os.path.basename(profilePath))
+
+    profile = {"jobs": jobs,
+               "total": sum([stage["time"] for stage in stages]),
+               "stages": stages}
+    with open(profilePath, "w") as f:
+        json.dump(profile, f, indent=1)
 
 
 def parseArguments():
@@ -71,18 +329,85 @@ def parseArguments():
         " the results. Default is max number of repeats"
     descr_allRep = "Print out all results from each repeat in a different" \
         " text file"
+    descr_jobs = "Number of processes parsing the .ou files in parallel." \
+        " Default is 1"
+    descr_incremental = "Keep a checkpoint of the records parsed from each" \
+        " .ou file in the VS directory, and parse only what was added to" \
+        " the .ou files since the previous -incremental run"
+    descr_top = "Only write the N ligands with the best scores, to" \
+        " top<N>_results_<proj>.csv. The dockings are streamed instead of" \
+        " being all held in memory. Not compatible with -allRep"
+    descr_repStats = "Add the mean, median, standard deviation and range" \
+        " of the scores of each ligand across repeats, and its number of" \
+        " repeats, to the results file. Not compatible with --top"
+    descr_db = "Load every docking record and the ranked results into an" \
+        " indexed SQLite database, results_<proj>.db. Not compatible with" \
+        " --top"
+    descr_watch = "Follow the .ou files of a running VS, and print the top" \
+        " ligands (--top, default 20) and the number of ligands docked in" \
+        " each repeat every WATCH seconds. Only the lines added to the .ou" \
+        " files are parsed. No results file is written"
+    descr_memory = "Memory budget in MB. The dockings are sorted out of" \
+        " core, spilling sorted runs to disk, for VS too large to be held" \
+        " in memory. Only compatible with --minRep, --jobs and -incremental"
+    descr_tmpDir = "Directory of the runs written with --memory. Default is" \
+        " the system temporary directory"
+    descr_profile = "Print the wall time, records processed, peak memory" \
+        " of the largest process and number of processes of each stage of" \
+        " the run"
+    descr_profileJson = "Write the wall time, records processed, peak" \
+        " memory of the largest process and number of processes of each" \
+        " stage of the run to profile_<proj>.json"
 
     # Defining the arguments
     parser = argparse.ArgumentParser(description=descr)
     parser.add_argument("vsDir", help=descr_vsDir)
     parser.add_argument("--minRep", help=descr_minRep)
     parser.add_argument("-allRep", action="store_true", help=descr_allRep)
+    parser.add_argument("--jobs", type=int, default=1, help=descr_jobs)
+    parser.add_argument("-incremental", action="store_true",
+                        help=descr_incremental)
+    parser.add_argument("--top", type=int, help=descr_top)
+    parser.add_argument("-repStats", action="store_true",
+                        help=descr_repStats)
+    parser.add_argument("-db", action="store_true", help=descr_db)
+    parser.add_argument("--watch", type=float, help=descr_watch)
+    parser.add_argument("--memory", type=int, help=descr_memory)
+    parser.add_argument("--tmpDir", help=descr_tmpDir)
+    parser.add_argument("-profile", action="store_true", help=descr_profile)
+    parser.add_argument("-profileJson", action="store_true",
+                        help=descr_profileJson)
 
     # Parsing arguments
     args = parser.parse_args()
     vsDir = args.vsDir
     minRep = args.minRep
     allRep = args.allRep
+    jobs = max(1, args.jobs)
+    incremental = args.incremental
+    topNum = args.top
+    repStats = args.repStats
+    resultsDb = args.db
+    watch = args.watch
+    memory = args.memory
+    tmpDir = args.tmpDir
+    profile = args.profile
+    profileJson = args.profileJson
+
+    if topNum is not None and (topNum < 1 or allRep or repStats or
+                               resultsDb):
+        parser.error("--top requires a positive number of ligands, and is "
+                     "not compatible with -allRep, -repStats and -db")
+    if watch is not None and (watch <= 0 or allRep or repStats or
+                              resultsDb or incremental):
+        parser.error("--watch requires a positive number of seconds, and is "
+                     "not compatible with -allRep, -repStats, -db and "
+                     "-incremental")
+    if memory is not None and (memory < 1 or allRep or topNum or repStats or
+                               resultsDb or watch):
+        parser.error("--memory requires a positive number of MB, and is not "
+                     "compatible with -allRep, --top, -repStats, -db and "
+                     "--watch")
 
     # Deal with minRep in case the option was not used in which case use a very
     # large int number. Otherwise make the minRep an int.
@@ -93,12 +418,20 @@ def parseArguments():
         # the repeat number be that high)
         minRep = 999999999999999999999
 
-    return vsDir, minRep, allRep
+    return vsDir, minRep, allRep, jobs, incremental, topNum, repStats, \
+        resultsDb, watch, memory, tmpDir, profile, profileJson
 
 
-def collectScoreData(vsDir, ligDict):
+def collectScoreData(vsDir, jobs=1, incremental=False, sources=None):
     """
-    Go through the repeat directories and collect the score data
+    Go through the repeat directories and collect the score data. With more
+    than one job, contiguous chunks of the .ou files are parsed in separate
+    processes, and their partial results are concatenated in the order of the
+    chunks, giving the same results as a serial run.
+    In incremental mode, the records of each .ou file are read back from the
+    checkpoint store and only the bytes added since the previous run are
+    parsed. The sources list, if given, is extended with the path and number
+    of dockings of each .ou file, in the order of the results
     """
 
     print("\nPARSING:\n")
@@ -106,40 +439,1141 @@ def collectScoreData(vsDir, ligDict):
     maxRepeatNum = -1
 
     # Get all .ou files in each repeat directory
-    ouFiles = glob.glob(vsDir + "/*/*.ou")
-    # Loop through them and look for the 'SCORES' line
-    for ouFilePath in ouFiles:
-        # Open file containing text result of the VLS
-        file = open(ouFilePath, "r")
-        lines = file.readlines()
-        file.close()
+    ouFiles = listOuFiles(vsDir + "/*")
 
-        vs_dir = os.path.dirname(os.path.dirname(ouFilePath))
-        repeatNum = os.path.dirname(ouFilePath).replace(vs_dir + "/", "")
-        # print ouFilePath
-        # print repeatNum
+    allResults = []
+    for chunk, fileCounts in iterScoreData(vsDir, ouFiles, jobs, incremental):
+        allResults.append(chunk)
+        maxRepeatNum = printFileCounts(fileCounts, maxRepeatNum)
+        if sources is not None:
+            sources.extend([[ouFilePath, ligDockedNum] for ouFilePath,
+                            repeatNum, ligDockedNum, entry in fileCounts])
+
+    return concatResults(allResults), maxRepeatNum
+
+
+def iterScoreData(vsDir, ouFiles, jobs=1, incremental=False, chunkNum=None):
+    """
+    Parse the .ou files given by contiguous chunks (by default four per job,
+    so that a chunk of large files does not keep the other processes
+    waiting), and yield the results and file counts of each chunk in order.
+    With several jobs, at most QUEUED_CHUNKS chunks per job are parsed ahead
+    of the chunk consumed. The manifest of an incremental run is written
+    once all chunks are parsed
+    """
+
+    # Each .ou file is parsed along with its checkpoint: the path of its
+    # records store and its manifest entry from the previous run
+    checkpointDir = os.path.join(vsDir, CHECKPOINT_DIR)
+    if incremental:
+        manifest = readManifest(checkpointDir)
+        tasks = []
+        for ouFilePath in ouFiles:
+            relPath = os.path.relpath(ouFilePath, vsDir)
+            storePath = os.path.join(checkpointDir, relPath + ".pkl")
+            tasks.append([ouFilePath, [storePath, manifest.get(relPath)]])
+    else:
+        tasks = [[ouFilePath, None] for ouFilePath in ouFiles]
+
+    if chunkNum is None:
+        chunkNum = jobs * 4
+    chunkNum = max(1, min(len(tasks), chunkNum))
+    chunks = [tasks[len(tasks) * i // chunkNum:
+                    len(tasks) * (i + 1) // chunkNum]
+              for i in range(chunkNum)]
+
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        chunkResults = queuedResults(pool, collectChunk, chunks,
+                                     jobs * QUEUED_CHUNKS)
+    else:
+        pool = None
+        chunkResults = map(collectChunk, chunks)
+
+    newManifest = {}
+    try:
+        for chunk, fileCounts in chunkResults:
+            for ouFilePath, repeatNum, ligDockedNum, entry in fileCounts:
+                if entry is not None:
+                    relPath = os.path.relpath(ouFilePath, vsDir)
+                    newManifest[relPath] = dict([(key, entry[key]) for key
+                                                 in entry if key != "status"])
+            yield chunk, fileCounts
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    if incremental:
+        writeManifest(checkpointDir, newManifest)
+
+
+def queuedResults(pool, function, items, queuedNum):
+    """
+    Yield the results of the function applied to the items by the pool, in
+    order, submitting an item only when fewer than queuedNum results are
+    pending, unlike Pool.imap which submits all of them at once
+    """
+
+    pending = collections.deque()
+    for item in items:
+        if len(pending) == queuedNum:
+            result = pending.popleft().get()
+            pending.append(pool.apply_async(function, (item,)))
+            yield result
+        else:
+            pending.append(pool.apply_async(function, (item,)))
+
+    while pending:
+        yield pending.popleft().get()
 
-        # Loop through each line of the file
-        ligDockedNum = 0
-        for line in lines:
-            # We take only the lines that contain "SCORE>"
-            if "SCORES>" in line:
-                ligDockedNum += 1
-                ligDict = parseScoreLine(ligDict, line, repeatNum)
 
-        print("\t" + ouFilePath + "\t" + str(ligDockedNum) + " ligands")
+def printFileCounts(fileCounts, maxRepeatNum):
+    """
+    Print the number of ligands docked found in each .ou file of a chunk, and
+    return the max repeat number updated with their repeat numbers
+    """
+
+    for ouFilePath, repeatNum, ligDockedNum, entry in fileCounts:
+        if entry is None:
+            print("\t" + ouFilePath + "\t" + str(ligDockedNum) + " ligands")
+        else:
+            print("\t" + ouFilePath + "\t" + str(ligDockedNum) +
+                  " ligands (" + entry["status"] + ")")
 
         # Update the repeat number in order to grab the max repeat number
         if maxRepeatNum < int(repeatNum):
             maxRepeatNum = int(repeatNum)
 
-    return ligDict, maxRepeatNum
+    return maxRepeatNum
+
+
+def collectTopScoreData(vsDir, jobs, incremental, topNum, minRepeatNum):
+    """
+    Stream the dockings of the .ou files through a heap holding the topNum
+    ligands with the best scores, and return their results along with the
+    index ranking them. Only the ligands whose repeats were not all parsed
+    yet are tracked: the .ou files are parsed slice by slice across the
+    repeat directories, and a ligand found in every repeat is moved from the
+    tracked ligands to the heap. The ligands not found in every repeat are
+    filtered according to the minimum repeat number once all files are
+    parsed. Ligands and repeats with equal scores are ranked in the order of
+    the .ou files listed in the VS directory, giving the top of the full
+    results file
+    """
+
+    print("\nPARSING:\n")
+
+    # Get all .ou files in each repeat directory, and the total number of
+    # repeats from their directories
+    ouFiles = listOuFiles(vsDir + "/*")
+    fileIndex = dict([(ouFilePath, i) for i, ouFilePath in
+                      enumerate(ouFiles)])
+    repeatDirs = set([os.path.dirname(ouFilePath) for ouFilePath in ouFiles])
+    totalRepeatNum = max([int(os.path.basename(repeatDir))
+                          for repeatDir in repeatDirs] + [-1])
+    minRepeatNum = min(totalRepeatNum, minRepeatNum)
+
+    # The tracked ligands, by ligand ID: [best score, parse order of the best
+    # score, parse order of the first docking, docking count, best docking]
+    # where the parse order is the index of the .ou file and of the docking
+    tracked = {}
+    # The top ligands, the worst of them first: [(-score, -parse order of
+    # the first docking), ligand ID, best docking]
+    top = []
+    includedNum = 0
+    scoreIndex = RESULT_COLUMNS.index("Score")
+
+    maxRepeatNum = -1
+    chunks = iterScoreData(vsDir, sorted(ouFiles, key=sliceSortKey), jobs,
+                           incremental, len(ouFiles))
+    for chunk, fileCounts in chunks:
+        maxRepeatNum = printFileCounts(fileCounts, maxRepeatNum)
+
+        rows = zip(*[chunk[column].tolist() for column in RESULT_COLUMNS])
+        for ouFilePath, repeatNum, ligDockedNum, entry in fileCounts:
+            fileNum = fileIndex[ouFilePath]
+            for i in range(ligDockedNum):
+                row = next(rows)
+                ligID = row[0]
+                score = row[scoreIndex]
+                order = (fileNum, i)
+
+                ligState = tracked.get(ligID)
+                if ligState is None:
+                    ligState = [score, order, order, 1, row]
+                    tracked[ligID] = ligState
+                else:
+                    ligState[3] += 1
+                    if score < ligState[0] or \
+                            (score == ligState[0] and order < ligState[1]):
+                        ligState[0:2] = [score, order]
+                        ligState[4] = row
+                    if order < ligState[2]:
+                        ligState[2] = order
+
+                # All repeats of this ligand were parsed
+                if ligState[3] == totalRepeatNum:
+                    includedNum += pushTop(top, topNum, minRepeatNum, ligID,
+                                           tracked.pop(ligID))
+
+    print("\nINCOMPLETE DOCKINGS:\n")
+
+    # Ligands not found in every repeat, by number of successful repeats
+    incomplete = {}
+    for ligID, ligState in tracked.items():
+        incomplete.setdefault(ligState[3], []).append(ligID)
+        includedNum += pushTop(top, topNum, minRepeatNum, ligID, ligState)
+    for count in sorted(incomplete.keys()):
+        status = "included" if count >= minRepeatNum else "deleted"
+        printRanges("# of successful repeats: " + str(count) +
+                    " (" + status + ")",
+                    idRanges(np.unique(incomplete[count])))
+
+    print("\nSUMMARY:\n")
+
+    print("\tTotal ligands docked:" + str(includedNum))
+
+    # Rank the top ligands, best first
+    top = sorted(top, reverse=True)
+    if len(top):
+        results = dict([(column, np.array(values)) for column, values in
+                        zip(RESULT_COLUMNS,
+                            zip(*[entry[2] for entry in top]))])
+    else:
+        results = emptyResults()
+
+    return results, np.arange(len(top))
+
+
+def externalSortResults(vsDir, projName, jobs, incremental, minRepeatNum,
+                        budget, tmpDir, stages):
+    """
+    Write the results file of a VS too large to be held in memory, within a
+    memory budget in bytes. The dockings parsed are spilled to disk in runs
+    sorted by ligand ID, which are merged to pick the best repeat of each
+    ligand. Those are spilled in runs sorted by score, merged to write the
+    ranked results. Each docking carries its parse order, giving the same
+    results as the in-memory sort. Each pass is recorded in the stages list
+    """
+
+    runDir = tempfile.mkdtemp(prefix="vs_results_", dir=tmpDir)
+    try:
+        stageStart = startStage()
+        ligRuns, totalRepeatNum, parsedNum, decimals = \
+            spillScoreData(vsDir, jobs, incremental, budget, runDir)
+        recordStage(stages, "collect", stageStart, parsedNum, jobs)
+
+        stageStart = startStage()
+        scoreRuns, ligNum = spillBestRepeats(ligRuns, totalRepeatNum,
+                                             minRepeatNum, budget, runDir)
+        recordStage(stages, "filter", stageStart, parsedNum)
+
+        stageStart = startStage()
+        writeExternalResults(scoreRuns, ligNum, projName, vsDir, budget,
+                             decimals)
+        recordStage(stages, "write", stageStart, ligNum)
+    finally:
+        shutil.rmtree(runDir)
+
+
+def spillScoreData(vsDir, jobs, incremental, budget, runDir):
+    """
+    Parse the .ou files of the VS, spilling the dockings to runs sorted by
+    ligand ID, then score and parse order, each time the records held reach
+    a fraction of the memory budget. With several jobs, that fraction
+    includes the chunks parsed ahead, each counted as the largest chunk
+    parsed so far. Return the paths of the runs, the total number of
+    repeats, the number of dockings parsed and the number of decimals of
+    the DECIMAL_COLUMNS
+    """
+
+    print("\nPARSING:\n")
+
+    maxRepeatNum = -1
+    ouFiles = listOuFiles(vsDir + "/*")
+
+    runPaths = []
+    buffered = []
+    bufferSize = 0
+    parsedNum = 0
+    queuedNum = jobs * QUEUED_CHUNKS if jobs > 1 else 0
+    chunkSize = 0
+    decimals = dict([(column, 0) for column in DECIMAL_COLUMNS])
+    # One .ou file per chunk, so that a chunk fits in the budget
+    chunks = iterScoreData(vsDir, ouFiles, jobs, incremental, len(ouFiles))
+    for chunk, fileCounts in chunks:
+        maxRepeatNum = printFileCounts(fileCounts, maxRepeatNum)
+        chunkDecimals = resultsDecimals(chunk)
+        for column in DECIMAL_COLUMNS:
+            decimals[column] = max(decimals[column], chunkDecimals[column])
+
+        # The parse order of each docking, to break ties as the in-memory
+        # sort does
+        table = resultsTable(chunk)
+        table["Order"] = np.arange(parsedNum, parsedNum + len(table))
+        parsedNum += len(table)
+
+        buffered.append(table)
+        bufferSize += table.nbytes
+        chunkSize = max(chunkSize, table.nbytes)
+        if bufferSize + queuedNum * chunkSize >= budget // RUN_FRACTION:
+            runPaths.append(spillRun(buffered, ["Order", "Score", "No"],
+                                     runDir))
+            buffered = []
+            bufferSize = 0
+
+    if buffered or not runPaths:
+        runPaths.append(spillRun(buffered, ["Order", "Score", "No"], runDir))
+
+    return runPaths, maxRepeatNum, parsedNum, decimals
+
+
+def spillBestRepeats(ligRuns, totalRepeatNum, minRepeatNum, budget, runDir):
+    """
+    Merge the runs sorted by ligand ID, keep the best repeat of each ligand
+    docked in enough repeats, and spill those to runs sorted by score, then
+    the parse order of the first docking of the ligand. Return the paths of
+    the runs and the number of ligands included
+    """
+
+    minRepeatNum = min(totalRepeatNum, minRepeatNum)
+
+    runPaths = []
+    buffered = []
+    bufferSize = 0
+    ligNum = 0
+    repeatCounts = {}
+
+    for table in mergeRuns(ligRuns, "No", budget):
+        table = table[np.lexsort((table["Order"], table["Score"],
+                                  table["No"]))]
+        groupStarts = np.flatnonzero(np.r_[True, table["No"][1:] !=
+                                           table["No"][:-1]])
+        counts = np.diff(np.r_[groupStarts, len(table)])
+
+        for count, num in zip(*np.unique(counts, return_counts=True)):
+            repeatCounts[count] = repeatCounts.get(count, 0) + num
+
+        # The first docking of each ligand has its best score, the order of
+        # the ligand is the order of its first docking
+        best = table[groupStarts]
+        best["Order"] = np.minimum.reduceat(table["Order"], groupStarts)
+        best = best[counts >= minRepeatNum]
+        ligNum += len(best)
+
+        buffered.append(best)
+        bufferSize += best.nbytes
+        if bufferSize >= budget // RUN_FRACTION:
+            runPaths.append(spillRun(buffered, ["Order", "Score"], runDir))
+            buffered = []
+            bufferSize = 0
+
+    if buffered or not runPaths:
+        runPaths.append(spillRun(buffered, ["Order", "Score"], runDir))
+
+    print("\nINCOMPLETE DOCKINGS:\n")
+
+    for count in sorted(repeatCounts):
+        if count != totalRepeatNum:
+            status = "included" if count >= minRepeatNum else "deleted"
+            print("\t# of successful repeats: " + str(count) + " (" +
+                  status + "), " + str(repeatCounts[count]) + " ids")
+
+    print("\nSUMMARY:\n")
+
+    print("\tTotal ligands docked:" + str(ligNum))
+
+    return runPaths, ligNum
+
+
+def writeExternalResults(scoreRuns, ligNum, projName, vsDir, budget,
+                         decimals):
+    """
+    Merge the runs of best repeats sorted by score, and write them to the
+    results file, with the number of decimals given for the DECIMAL_COLUMNS,
+    and its binary copy
+    """
+
+    print("\nWRITING:\n")
+
+    resultsCsv = vsDir + "/results_" + projName + ".csv"
+    cachePath = resultsCachePath(resultsCsv)
+    print("\t" + os.path.basename(resultsCsv))
+    print("\t" + os.path.basename(cachePath))
+
+    cache = None
+    written = 0
+    with open(resultsCsv, "w") as fileResult:
+        fileResult.write(RESULT_HEADER)
+        for table in mergeRuns(scoreRuns, "Score", budget):
+            table = table[np.lexsort((table["Order"], table["Score"]))]
+            results = dict([(column, table[column])
+                            for column in RESULT_COLUMNS])
+            writeResultLines(results, np.arange(len(table)), fileResult,
+                             decimals=decimals)
+
+            # The binary copy is written in place, its Name width being
+            # known once the runs are merged
+            if cache is None:
+                dtype = [(column, table.dtype[column])
+                         for column in RESULT_COLUMNS]
+                cache = np.lib.format.open_memmap(cachePath + ".tmp", "w+",
+                                                  dtype, (ligNum,))
+            for column in RESULT_COLUMNS:
+                cache[column][written:written + len(table)] = table[column]
+            written += len(table)
+
+    if cache is not None:
+        cache.flush()
+        del cache
+        os.replace(cachePath + ".tmp", cachePath)
+    elif os.path.exists(cachePath):
+        os.remove(cachePath)
+
+
+def resultsTable(results):
+    """
+    Return the results as a structured array, with an extra "Order" field
+    """
+
+    dtype = [(column, results[column].dtype) for column in RESULT_COLUMNS]
+    table = np.empty(resultsLength(results), dtype=dtype + [("Order",
+                                                              np.int64)])
+    for column in RESULT_COLUMNS:
+        table[column] = results[column]
+
+    return table
+
+
+def spillRun(tables, keys, runDir):
+    """
+    Sort the structured arrays given on the keys (last key first) and write
+    them to a new run in the run directory. Return the path of the run
+    """
+
+    if tables:
+        dtype = commonNameWidth(tables)
+        table = np.concatenate([table.astype(dtype) for table in tables])
+    else:
+        table = resultsTable(emptyResults())
+    table = table[np.lexsort([table[key] for key in keys])]
+
+    runPath = os.path.join(runDir, "run{}.npy".format(len(os.listdir(runDir))))
+    np.save(runPath, table)
+
+    return runPath
+
+
+def commonNameWidth(tables):
+    """
+    Return the dtype of the structured arrays given, with the largest Name
+    width amongst them
+    """
+
+    width = max([table.dtype["Name"].itemsize for table in tables])
+
+    return [(name, "S{}".format(width) if name == "Name" else
+             tables[0].dtype[name]) for name in tables[0].dtype.names]
+
+
+def mergeRuns(runPaths, key, budget):
+    """
+    Merge the runs given, sorted on the key field, by memory-mapping them and
+    yielding unsorted batches in which every record has a key below the
+    key of the records of the later batches. Each run contributes a window
+    of records per batch, sized to fit the memory budget: the batch holds the
+    records of the windows with a key below the smallest last key of the
+    windows not reaching the end of their run
+    """
+
+    runs = [np.load(runPath, mmap_mode="r") for runPath in runPaths]
+    runs = [run for run in runs if len(run)]
+    positions = [0] * len(runs)
+    if not runs:
+        return
+
+    # The batches hold the largest Name width amongst the runs
+    dtype = commonNameWidth(runs)
+
+    recordSize = max([run.dtype.itemsize for run in runs] + [1])
+    windowSize = max(1000, budget // RUN_FRACTION //
+                     (max(1, len(runs)) * recordSize))
+
+    while any([position < len(run) for position, run in
+               zip(positions, runs)]):
+        windows = [run[position:position + windowSize] for position, run in
+                   zip(positions, runs)]
+
+        # Records with a key equal to the bound may continue past a window
+        bounds = [window[key][-1] for window, position, run in
+                  zip(windows, positions, runs)
+                  if position + windowSize < len(run)]
+
+        if bounds:
+            ends = [np.searchsorted(window[key], min(bounds), side="left")
+                    for window in windows]
+        else:
+            ends = [len(window) for window in windows]
+
+        # A window holding the bound key only, the window is widened
+        if sum(ends) == 0:
+            windowSize *= 2
+            continue
+
+        yield np.concatenate([window[:end].astype(dtype) for window, end in
+                              zip(windows, ends)])
+        positions = [position + end for position, end in
+                     zip(positions, ends)]
+
+
+def watchScoreData(vsDir, topNum, interval):
+    """
+    Follow the .ou files of a running VS, parsing the complete lines written
+    to each file since its last offset every interval seconds, and print a
+    leaderboard of the topNum ligands with the best scores along with the
+    number of dockings of each repeat. A trailing line still being written
+    is parsed once it is complete. When an .ou file is rewritten (e.g. a
+    resubmitted slice), all .ou files are parsed again from the start
+    """
+
+    # Offset of the complete lines parsed, size and fingerprint of each .ou
+    # file followed
+    files = {}
+    # Best docking of the leaderboard ligands, by ligand ID
+    board = {}
+    counts = {}
+
+    try:
+        while True:
+            ouFiles = listOuFiles(vsDir + "/*")
+
+            # Start over if an .ou file was rewritten or deleted
+            rewritten = set(files) - set(ouFiles)
+            for ouFilePath in files:
+                if ouFilePath in rewritten or \
+                        os.path.getsize(ouFilePath) == files[ouFilePath][1]:
+                    continue
+                offset, size, tail = files[ouFilePath]
+                if isCompressed(ouFilePath) or \
+                        os.path.getsize(ouFilePath) < offset or \
+                        fingerprint(ouFilePath, offset) != tail:
+                    rewritten.add(ouFilePath)
+            if rewritten:
+                files = {}
+                board = {}
+                counts = {}
+
+            for ouFilePath in ouFiles:
+                offset = files.get(ouFilePath, [0])[0]
+                size = os.path.getsize(ouFilePath)
+                if ouFilePath in files and size == files[ouFilePath][1]:
+                    continue
+
+                # Compressed files are read whole, once
+                if isCompressed(ouFilePath):
+                    lineEnd = size
+                else:
+                    lineEnd = completeLinesEnd(ouFilePath, offset, size)
+                repeatNum = os.path.basename(os.path.dirname(ouFilePath))
+                results = scanOuFile(ouFilePath, repeatNum, offset, lineEnd)
+                files[ouFilePath] = [lineEnd, size,
+                                     fingerprint(ouFilePath, lineEnd)]
+
+                counts[repeatNum] = counts.get(repeatNum, 0) + \
+                    resultsLength(results)
+                updateBoard(board, topNum, results)
+
+            printBoard(vsDir, board, counts, len(files))
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print()
+
+
+def updateBoard(board, topNum, results):
+    """
+    Update the leaderboard of the topNum ligands with the best scores with
+    new dockings. A ligand leaves the leaderboard only for a ligand with a
+    better score, and scores only improve, so the ligands that left it
+    never need to be tracked again
+    """
+
+    # Only the dockings better than the worst of a full leaderboard can
+    # enter it
+    if len(board) >= topNum:
+        worst = max(board.values())[0]
+        results = takeResults(results,
+                              np.flatnonzero(results["Score"] < worst))
+
+    rows = zip(*[results[column].tolist() for column in RESULT_COLUMNS])
+    scoreIndex = RESULT_COLUMNS.index("Score")
+    for row in rows:
+        ligID = row[0]
+        entry = (row[scoreIndex], ligID, row)
+        if ligID in board:
+            board[ligID] = min(board[ligID], entry)
+        elif len(board) < topNum:
+            board[ligID] = entry
+        else:
+            worst = max(board.values())
+            if entry < worst:
+                del board[worst[1]]
+                board[ligID] = entry
+
+
+def printBoard(vsDir, board, counts, fileNum):
+    """
+    Clear the terminal and print the leaderboard, best ligand first, and the
+    number of dockings of each repeat
+    """
+
+    print("\033[2J\033[H", end="")
+    print(vsDir + "\t" + time.strftime("%Y-%m-%d %H:%M:%S") + "\t" +
+          str(fileNum) + " .ou files\n")
+
+    print("DOCKED:\n")
+    for repeatNum in sorted(counts, key=lambda r: (len(r), r)):
+        print("\trepeat " + repeatNum + "\t" + str(counts[repeatNum]))
+
+    print("\nTOP " + str(len(board)) + ":\n")
+    print("\tRank\tNo\tScore\tName\tRun#")
+    for rank, (score, ligID, row) in enumerate(sorted(board.values()), 1):
+        print("\t" + str(rank) + "\t" + str(ligID) + "\t" + repr(score) +
+              "\t" + row[-2].decode("utf-8", "replace") + "\t" +
+              str(row[-1]))
+
+
+def pushTop(top, topNum, minRepeatNum, ligID, ligState):
+    """
+    Push a ligand whose parsing is complete onto the heap of the topNum best
+    ligands, if it was docked in at least minRepeatNum repeats. Return 1 if
+    it is included in the results, 0 otherwise
+    """
+
+    if ligState[3] < minRepeatNum:
+        return 0
+
+    key = (-ligState[0], -ligState[2][0], -ligState[2][1])
+    if len(top) < topNum:
+        heapq.heappush(top, (key, ligID, ligState[4]))
+    elif key > top[0][0]:
+        heapq.heapreplace(top, (key, ligID, ligState[4]))
+
+    return 1
+
+
+def listOuFiles(repeatDirs):
+    """
+    Return the .ou files of the repeat directories matched by the glob
+    pattern given, compressed or not. When an .ou file and its compressed
+    copy are both found (compression in progress), only the .ou file is kept
+    """
+
+    ouFiles = glob.glob(repeatDirs + "/*.ou")
+    plainFiles = set(ouFiles)
+    for ext in OU_COMPRESSED_EXTS:
+        ouFiles += [ouFilePath for ouFilePath in
+                    glob.glob(repeatDirs + "/*.ou" + ext)
+                    if ouFilePath[:-len(ext)] not in plainFiles]
+
+    return ouFiles
+
+
+def isCompressed(ouFilePath):
+    """
+    Return True for an .ou file compressed with one of OU_COMPRESSED_EXTS
+    """
+
+    return os.path.splitext(ouFilePath)[1] in OU_COMPRESSED_EXTS
+
+
+def openOuFile(ouFilePath):
+    """
+    Open an .ou file for reading in binary mode. Compressed .ou files are
+    decompressed as they are read
+    """
+
+    ext = os.path.splitext(ouFilePath)[1]
+
+    if ext == ".gz":
+        return gzip.open(ouFilePath, "rb")
+    if ext == ".xz":
+        return lzma.open(ouFilePath, "rb")
+    if ext == ".zst":
+        if zstandard is None:
+            raise ImportError("the zstandard module is required to read " +
+                              ouFilePath)
+        return zstandard.ZstdDecompressor().stream_reader(
+            open(ouFilePath, "rb"), closefd=True)
+
+    return open(ouFilePath, "rb")
+
+
+def processedIDs(ouFilePath):
+    """
+    Return the sorted unique IDs of the ligands docked ("SCORES>" lines) or
+    skipped in an .ou file, compressed or not, read by blocks of
+    STREAM_BLOCK bytes. A last line still being written is ignored
+    """
+
+    ligIDs = []
+    carry = b""
+
+    with openOuFile(ouFilePath) as f:
+        while True:
+            block = f.read(STREAM_BLOCK)
+            if not block:
+                break
+            data = carry + block
+            lineEnd = data.rfind(b"\n") + 1
+            ligIDs += [int(docked or skipped) for docked, skipped in
+                       PROCESSED_RECORD.findall(data, 0, lineEnd)]
+            carry = data[lineEnd:]
+
+    return np.unique(np.array(ligIDs, dtype=np.int64))
+
+
+def sliceSortKey(ouFilePath):
+    """
+    Sort key of the .ou files by slice: the last ligand ID of the slice
+    found in the file name, then the name and the repeat directory
+    """
+
+    fileName = os.path.basename(ouFilePath)
+    upperLimit = OU_NAME.search(fileName).group(1)
+
+    return (int(upperLimit) if upperLimit else -1, fileName, ouFilePath)
+
+
+def collectChunk(tasks):
+    """
+    Parse a list of .ou files, and return the results they make along with
+    the repeat number, docked ligand count and updated manifest entry
+    (incremental mode only) of each file
+    """
+
+    allResults = []
+    fileCounts = []
+
+    # Loop through them and look for the 'SCORES' line
+    for ouFilePath, checkpoint in tasks:
+        vs_dir = os.path.dirname(os.path.dirname(ouFilePath))
+        repeatNum = os.path.dirname(ouFilePath).replace(vs_dir + "/", "")
+
+        # Extract the docking information of each "SCORES>" record
+        if checkpoint is None:
+            results = scanOuFile(ouFilePath, repeatNum)
+            entry = None
+        else:
+            storePath, entry = checkpoint
+            results, entry = scanOuFileFrom(ouFilePath, repeatNum,
+                                            storePath, entry)
+        allResults.append(results)
+
+        fileCounts.append([ouFilePath, repeatNum, resultsLength(results),
+                           entry])
+
+    return concatResults(allResults), fileCounts
+
+
+def scanOuFileFrom(ouFilePath, repeatNum, storePath, entry):
+    """
+    Return the results of an .ou file, reading the records parsed by
+    previous runs from its store, and parsing the file from the offset
+    recorded in its manifest entry. The store is extended with the records
+    of the complete lines parsed, and the updated manifest entry is
+    returned. A file that is shorter than that offset, or whose fingerprint
+    changed, was rewritten and is parsed again from the start. A last line
+    still being written is ignored, as by processedIDs
+    """
+
+    stat = os.stat(ouFilePath)
+    size = stat.st_size
+    compressed = isCompressed(ouFilePath)
+
+    # Check that the checkpoint still matches the .ou file and its store.
+    # Compressed files are parsed again whenever they change
+    if entry is not None:
+        if not os.path.exists(storePath) or \
+                os.path.getsize(storePath) < entry["store"]:
+            entry = None
+        elif size == entry["size"] and stat.st_mtime_ns == entry["mtime"]:
+            status = "unchanged"
+        elif compressed:
+            entry = None
+        elif size >= entry["offset"] and \
+                fingerprint(ouFilePath, entry["offset"]) == entry["tail"]:
+            status = "appended"
+        else:
+            entry = None
+
+    if entry is None:
+        status = "parsed"
+        offset = 0
+        storeSize = 0
+        allResults = []
+        # Several processes may create the same repeat directory
+        os.makedirs(os.path.dirname(storePath), exist_ok=True)
+    else:
+        offset = entry["offset"]
+        storeSize = entry["store"]
+        allResults = readStore(storePath, storeSize)
+
+    # Parse the complete lines written after the offset, and store them
+    if status == "unchanged":
+        lineEnd = offset
+    elif compressed:
+        lineEnd = size
+    else:
+        lineEnd = completeLinesEnd(ouFilePath, offset, size)
+    if lineEnd > offset or storeSize == 0:
+        results = scanOuFile(ouFilePath, repeatNum, offset, lineEnd)
+        with open(storePath, "r+b" if storeSize else "wb") as f:
+            f.truncate(storeSize)
+            f.seek(storeSize)
+            if resultsLength(results):
+                pickle.dump(results, f, pickle.HIGHEST_PROTOCOL)
+            storeSize = f.tell()
+        allResults.append(results)
+
+    entry = {"size": size,
+             "mtime": stat.st_mtime_ns,
+             "offset": lineEnd,
+             "tail": fingerprint(ouFilePath, lineEnd),
+             "store": storeSize,
+             "status": status}
+
+    return concatResults(allResults), entry
+
+
+def completeLinesEnd(ouFilePath, offset, size):
+    """
+    Return the offset following the last line break of an .ou file, or the
+    offset given if no line was completed after it
+    """
+
+    if size <= offset:
+        return offset
+
+    with open(ouFilePath, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return max(offset, data.rfind(b"\n", offset, size) + 1)
+    finally:
+        data.close()
+
+
+def fingerprint(ouFilePath, offset):
+    """
+    Hash the first bytes of an .ou file and the bytes preceding the offset
+    given, along with its inode, so that a file replaced or rewritten in
+    place since the offset was parsed does not pass for an appended one,
+    even when it is as large or larger
+    """
+
+    start = max(0, offset - FINGERPRINT_SIZE)
+    with open(ouFilePath, "rb") as f:
+        head = f.read(min(offset, FINGERPRINT_SIZE))
+        f.seek(start)
+        data = f.read(offset - start)
+        inode = os.fstat(f.fileno()).st_ino
+
+    return str(inode) + ":" + hashlib.sha1(head + data).hexdigest()
+
+
+def readStore(storePath, storeSize):
+    """
+    Read the results saved in the first storeSize bytes of a records store
+    (records written after that by an interrupted run are ignored)
+    """
+
+    allResults = []
+
+    with open(storePath, "rb") as f:
+        data = io.BytesIO(f.read(storeSize))
+
+    # The store is a sequence of pickled results, one per run
+    while data.tell() < storeSize:
+        allResults.append(pickle.load(data))
+
+    return allResults
+
+
+def readManifest(checkpointDir):
+    """
+    Read the manifest of the .ou files parsed by the previous incremental run.
+    A manifest written for another version of the records store is ignored
+    """
+
+    manifestPath = os.path.join(checkpointDir, "manifest.json")
+    if not os.path.exists(manifestPath):
+        return {}
+
+    with open(manifestPath, "r") as f:
+        manifest = json.load(f)
+
+    if manifest.get("version") != CHECKPOINT_VERSION:
+        return {}
+
+    return manifest["files"]
+
+
+def writeManifest(checkpointDir, manifest):
+    """
+    Write the manifest of the .ou files parsed, and delete the stores of the
+    .ou files that no longer exist
+    """
+
+    if not os.path.exists(checkpointDir):
+        os.makedirs(checkpointDir)
+
+    for storePath in glob.glob(checkpointDir + "/*/*.pkl"):
+        relPath = os.path.relpath(storePath, checkpointDir)[:-len(".pkl")]
+        if relPath not in manifest:
+            os.remove(storePath)
+
+    # Replace the manifest only once it is fully written
+    manifestPath = os.path.join(checkpointDir, "manifest.json")
+    with open(manifestPath + ".tmp", "w") as f:
+        json.dump({"version": CHECKPOINT_VERSION, "files": manifest}, f,
+                  indent=1, sort_keys=True)
+    os.replace(manifestPath + ".tmp", manifestPath)
+
+
+def scanOuFile(ouFilePath, repeatNum, start=0, end=None):
+    """
+    Return the results of each "SCORES>" record of an .ou file, or of the
+    lines found between the start and end offsets given. A last line still
+    being written is ignored, as by processedIDs, so that a ligand re-docked
+    by a resume build is not reported twice. The records are
+    located at the byte level in the memory-mapped file, then decoded all at
+    once with the precompiled SCORE_RECORD field map, and converted to
+    columns by NumPy. If any record does not follow the expected layout, the
+    records of that file are decoded one by one with decodeScoreLine instead
+    """
+
+    lines = findScoreLines(ouFilePath, start, end)
+    text = b"\n".join(lines).decode("utf-8", "replace")
+
+    records = SCORE_RECORD.findall(text)
+    if len(records) == len(lines):
+        return recordsResults(records, repeatNum)
+
+    ligInfos = []
+    for line in text.split("\n"):
+        # A carriage return is a line break when reading text
+        line = line.replace("\r\n", "\n").replace("\r", "\n")
+        for subLine in line.split("\n"):
+            if "SCORES>" in subLine:
+                ligInfos.append(decodeScoreLine(subLine, repeatNum))
+
+    return ligInfosResults(ligInfos)
+
+
+def findScoreLines(ouFilePath, start=0, end=None):
+    """
+    Memory-map an .ou file and return each line containing "SCORES>", only
+    looking at the bytes between the start and end offsets given (which
+    should be the start of a line and the end of a line), by default up to
+    the last line break. Compressed .ou files are decompressed by blocks and
+    always read whole
+    """
+
+    if isCompressed(ouFilePath):
+        return findStreamScoreLines(ouFilePath)
+
+    lines = []
+
+    with open(ouFilePath, "rb") as f:
+        # Empty files cannot be memory-mapped
+        if os.fstat(f.fileno()).st_size <= start:
+            return lines
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if end is None:
+        end = data.rfind(b"\n") + 1
+    end = min(end, len(data))
+
+    try:
+        findBlockScoreLines(data, start, end, lines)
+    finally:
+        data.close()
+
+    return lines
+
+
+def findStreamScoreLines(ouFilePath):
+    """
+    Return each line containing "SCORES>" of a compressed .ou file, reading
+    it by blocks of STREAM_BLOCK decompressed bytes. The last line of a
+    block, which may be incomplete, is carried over to the next block, and
+    the last line of the file is ignored if it has no line break
+    """
+
+    lines = []
+    carry = b""
+
+    with openOuFile(ouFilePath) as f:
+        while True:
+            block = f.read(STREAM_BLOCK)
+            if not block:
+                break
+            data = carry + block
+            lineEnd = data.rfind(b"\n") + 1
+            findBlockScoreLines(data, 0, lineEnd, lines)
+            carry = data[lineEnd:]
+
+    return lines
+
+
+def findBlockScoreLines(data, start, end, lines):
+    """
+    Append to lines each line containing "SCORES>" found in the bytes (or
+    memory map) given, between the start and end offsets
+    """
+
+    pos = data.find(b"SCORES>", start, end)
+    while pos != -1:
+        # Get the boundaries of the line containing that record
+        lineStart = data.rfind(b"\n", start, pos) + 1
+        lineStart = max(lineStart, start)
+        lineEnd = data.find(b"\n", pos, end)
+        if lineEnd == -1:
+            lineEnd = end
+        lines.append(data[lineStart:lineEnd])
+
+        pos = data.find(b"SCORES>", lineEnd, end)
+
+
+def recordsResults(records, repeatNum):
+    """
+    Convert the records matched by SCORE_RECORD (tuples of the ligand ID,
+    SCORE_FIELDS values and name) to results columns
+    """
+
+    if len(records) == 0:
+        return emptyResults()
+
+    values = list(zip(*records))
+
+    results = {}
+    for i, column in enumerate(RESULT_COLUMNS[:-2]):
+        results[column] = toColumn(values[i], column)
+    # The name is matched as ASCII text, "none" when it is not provided
+    results["Name"] = np.array([name or "none" for name in values[-1]],
+                               dtype=np.bytes_)
+    results["Run"] = np.full(len(records), int(repeatNum), dtype=np.int32)
+
+    return results
+
+
+def ligInfosResults(ligInfos):
+    """
+    Convert the ligInfo lists made by decodeScoreLine to results columns.
+    The values following the ligand ID are assigned to the SCORE_FIELDS in
+    the order they were found on the line
+    """
+
+    if len(ligInfos) == 0:
+        return emptyResults()
+
+    results = {"No": np.array([ligInfo[0] for ligInfo in ligInfos],
+                              dtype=np.int64)}
+    for i, column in enumerate(SCORE_FIELDS):
+        values = [ligInfo[i + 1] if i + 1 < len(ligInfo) - 2 else "nan"
+                  for ligInfo in ligInfos]
+        results[column] = toColumn(values, column)
+    results["Name"] = np.array([ligInfo[-2].encode() for ligInfo in ligInfos],
+                               dtype=np.bytes_)
+    results["Run"] = np.array([int(ligInfo[-1]) for ligInfo in ligInfos],
+                              dtype=np.int32)
+
+    return results
+
+
+def toColumn(values, column):
+    """
+    Convert a sequence of values read as text to the NumPy type of that
+    results column. Values that cannot be converted are stored as -1 in
+    integer columns, and NaN in the others
+    """
+
+    dtype = np.int64 if column in INT_COLUMNS else np.float64
+
+    try:
+        return np.array(values, dtype=dtype)
+    except ValueError:
+        pass
+
+    converted = []
+    for val in values:
+        try:
+            converted.append(float(val))
+        except ValueError:
+            converted.append(np.nan)
+    converted = np.array(converted)
+
+    if dtype is np.int64:
+        converted = np.where(np.isnan(converted), -1, converted)
+
+    return converted.astype(dtype)
+
+
+def emptyResults():
+    """
+    Return results columns holding no docking
+    """
+
+    results = {}
+    for column in RESULT_COLUMNS:
+        if column == "Name":
+            results[column] = np.array([], dtype="S1")
+        elif column == "Run":
+            results[column] = np.array([], dtype=np.int32)
+        else:
+            results[column] = toColumn([], column)
+
+    return results
+
+
+def concatResults(allResults):
+    """
+    Concatenate a list of results, in order
+    """
+
+    allResults = [results for results in allResults if resultsLength(results)]
+
+    if len(allResults) == 0:
+        return emptyResults()
+    if len(allResults) == 1:
+        return allResults[0]
+
+    return dict([(column, np.concatenate([results[column]
+                                          for results in allResults]))
+                 for column in RESULT_COLUMNS])
+
+
+def takeResults(results, index):
+    """
+    Return the rows of the results selected by an index or mask array
+    """
+
+    return dict([(column, results[column][index])
+                 for column in RESULT_COLUMNS])
+
+
+def resultsLength(results):
+    """
+    Return the number of dockings held in results
+    """
+
+    return len(results["No"])
 
 
-def parseScoreLine(ligDict, line, repeatNum):
+def decodeScoreLine(line, repeatNum):
     """
-    Populate the ligDict dictionary in the following manner:
-    ligDict{ligandID, [[ligInfo_rep1], [ligInfo_rep2], ...]}
+    Split a single "SCORES>" line into its tokens, and return the ligInfo list
+    of the values following each tag
     """
 
     ll = line.split()
@@ -179,159 +1613,522 @@ def parseScoreLine(ligDict, line, repeatNum):
     # Lastly adding the repeat number info
     ligInfo.append(repeatNum)
 
-    # Add that ligInfo to the ligDict, if it already exists
-    # just append to the list, otherwise create a new list
-    keys = ligDict.keys()
-    if ligID not in keys:
-        ligDict[ligID] = [ligInfo]
-    else:
-        ligDict[ligID].append(ligInfo)
-
-    return ligDict
+    return ligInfo
 
 
-def removeFailed(ligDict, totalRepeatNum, minRepeatNum):
+def removeFailed(results, totalRepeatNum, minRepeatNum, missingPath=None):
     """
-    Loop over all results and remove those not successful for all repeats
-    attempted. Print the information about the failed dockings.
+    Remove the ligands not successful for all repeats attempted, unless they
+    were docked in at least minRepeatNum repeats. Print the ranges of IDs of
+    the failed dockings, grouped by number of successful repeats, and write
+    them to the missingPath JSON file if given.
     """
 
-    # Get the max ligID of the docked ligands
-    ligIDs = sorted(ligDict.keys())
-    minLigID = ligIDs[0]
-    maxLigID = ligIDs[-1]
-    # Create a range list of IDs, stopping at the max
-    rangeIDs = range(minLigID, maxLigID + 1)
-    rangeFlag = dict([(ligID, False) for ligID in rangeIDs])
-    # print rangeFlag
+    # Count the dockings of each ligand ID
+    ligIDs, inverse, counts = np.unique(results["No"], return_inverse=True,
+                                        return_counts=True)
 
     print("\nINCOMPLETE DOCKINGS:\n")
 
-    # keys = ligDict.keys()
-    for key in ligIDs:
-        currRepeatNum = len(ligDict[key])
-
-        # When the number of repeats found is not equal to the max number of
-        # repeats expected
-        if currRepeatNum != totalRepeatNum:
-            print("\tid:" + str(key) + "# of sucessful repeats:" +
-                  str(currRepeatNum))
-            # For cases where a ligand was docked more than the defined repeat
-            # number (when there was mistake in the VS setup)
-            if currRepeatNum > totalRepeatNum:
-                print("\t\t(included)")
-            # For cases where the repeat number of a given ligand is above or
-            # equal to the user defined minimum repeat number
-            elif currRepeatNum >= minRepeatNum:
-                print("\t\t(included)")
-            # Otherwise delete the ligand's information from the list
-            else:
-                print("\t\t(deleted)")
-                del ligDict[key]
-
-        # Flag the current ligID when it is found
-        if key in rangeFlag.keys():
-            rangeFlag[key] = True
-
-    for key in rangeFlag.keys():
-        if rangeFlag[key] is False:
-            print("\tid:", key, "# of successful repeats: 0 (not included)")
+    # Ligands docked more than the defined repeat number (when there was a
+    # mistake in the VS setup) or at least the user defined minimum repeat
+    # number are included, the others are deleted
+    keepLig = counts >= min(totalRepeatNum, minRepeatNum)
+
+    for count in np.unique(counts[counts != totalRepeatNum]).tolist():
+        countIDs = ligIDs[counts == count]
+        status = "included" if count >= min(totalRepeatNum, minRepeatNum) \
+            else "deleted"
+        printRanges("# of successful repeats: " + str(count) +
+                    " (" + status + ")", idRanges(countIDs))
+
+    # The IDs between the min and max docked IDs which were not docked
+    if len(ligIDs):
+        missingRanges = gapRanges(ligIDs, ligIDs[0], ligIDs[-1])
+        printRanges("# of successful repeats: 0 (not included)",
+                    missingRanges)
+
+    if missingPath:
+        writeMissingFile(missingPath, results, ligIDs, counts, keepLig,
+                         totalRepeatNum)
+
+    results = takeResults(results, keepLig[inverse])
 
     print("\nSUMMARY:\n")
 
-    print("\tTotal ligands docked:" + str(len(ligDict.keys())))
+    print("\tTotal ligands docked:" + str(np.count_nonzero(keepLig)))
+
+    return results
 
-    return ligDict
 
+def idRanges(ligIDs):
+    """
+    Compress a sorted array of unique ligand IDs into a list of [first, last]
+    ranges of consecutive IDs
+    """
+
+    if len(ligIDs) == 0:
+        return []
+
+    breaks = np.flatnonzero(np.diff(ligIDs) != 1)
+    firsts = ligIDs[np.r_[0, breaks + 1]]
+    lasts = ligIDs[np.r_[breaks, len(ligIDs) - 1]]
 
-def sortRepeats(ligDict):
+    return [list(idRange) for idRange in zip(firsts.tolist(), lasts.tolist())]
+
+
+def gapRanges(ligIDs, firstID, lastID):
+    """
+    Return the list of [first, last] ranges of the IDs from firstID to lastID
+    that are not in the sorted array of unique ligand IDs given
+    """
+
+    ligIDs = ligIDs[(ligIDs >= firstID) & (ligIDs <= lastID)]
+    if len(ligIDs) == 0:
+        return [[int(firstID), int(lastID)]]
+
+    # IDs preceding and following each gap
+    bounds = np.r_[firstID - 1, ligIDs, lastID + 1]
+    gaps = np.flatnonzero(np.diff(bounds) > 1)
+
+    return [list(idRange) for idRange in zip((bounds[gaps] + 1).tolist(),
+                                             (bounds[gaps + 1] - 1).tolist())]
+
+
+def formatRanges(ranges):
+    """
+    Format a list of [first, last] ranges of IDs as text, e.g. 1200-1450,1890
+    """
+
+    return ",".join([str(first) if first == last else
+                     str(first) + "-" + str(last) for first, last in ranges])
+
+
+def printRanges(label, ranges, maxRanges=20):
+    """
+    Print the number of IDs and the first maxRanges ranges of IDs given
+    """
+
+    if len(ranges) == 0:
+        return
+
+    idCount = sum([last - first + 1 for first, last in ranges])
+    print("\t" + label + ", " + str(idCount) + " ids:")
+    print("\t\t" + formatRanges(ranges[:maxRanges]))
+    if len(ranges) > maxRanges:
+        print("\t\t... and " + str(len(ranges) - maxRanges) + " more ranges")
+
+
+def writeMissingFile(missingPath, results, ligIDs, counts, keepLig,
+                     totalRepeatNum):
+    """
+    Write the ranges of ligand IDs missing from the results to a JSON file:
+    the IDs between the min and max docked IDs never docked ("missing"),
+    docked in some of the repeats only ("incomplete"), or deleted from the
+    results because of that ("deleted"), and for each repeat the IDs it did
+    not dock ("repeats")
+    """
+
+    missing = {"totalRepeatNum": totalRepeatNum,
+               "missing": [],
+               "incomplete": idRanges(ligIDs[counts < totalRepeatNum]),
+               "deleted": idRanges(ligIDs[~keepLig]),
+               "repeats": {}}
+
+    if len(ligIDs):
+        missing["missing"] = gapRanges(ligIDs, ligIDs[0], ligIDs[-1])
+        for repeat in range(1, totalRepeatNum + 1):
+            repeatIDs = np.unique(results["No"][results["Run"] == repeat])
+            missing["repeats"][str(repeat)] = gapRanges(repeatIDs,
+                                                        ligIDs[0],
+                                                        ligIDs[-1])
+
+    print("\n\tmissing IDs written to " + os.path.basename(missingPath))
+    with open(missingPath, "w") as f:
+        json.dump(missing, f)
+
+
+def sortRepeats(results, repStats=False):
     """
     For each ligandID, get the repeat that got the best score, this will
-    represent that ligand in this VS scoring
+    represent that ligand in this VS scoring. Return the index of those best
+    repeats, ranked by score, and if repStats is set the statistics of the
+    scores of each ligand across repeats in the same order (None otherwise)
     """
 
-    # For each ligID, sort each repeat based on score (lig[9])
-    # The result is a ligDict for which the first of each ligID is
-    # the one with the best score
-    keys = ligDict.keys()
-    for key in keys:
-        repeatsLigInfo = ligDict[key]
-        repeatsLigInfo = sorted(repeatsLigInfo, key=lambda lig: lig[9])
-        ligDict[key] = repeatsLigInfo
+    if resultsLength(results) == 0:
+        bestIndex = np.array([], dtype=np.intp)
+        if repStats:
+            return bestIndex, dict([(column, np.array([]))
+                                    for column in STATS_COLUMNS])
+        return bestIndex, None
+
+    # Sort the dockings by ligand ID, then score. The sort is stable, so
+    # repeats with equal scores stay in the order they were parsed
+    order = np.lexsort((results["Score"], results["No"]))
+    ligIDs = results["No"][order]
+    groupStarts = np.flatnonzero(np.r_[True, ligIDs[1:] != ligIDs[:-1]])
 
-    return ligDict
+    # The first of each ligand ID is the one with the best score
+    bestIndex = order[groupStarts]
+    # Ligands with equal best scores are ranked in the order they were first
+    # parsed
+    firstIndex = np.minimum.reduceat(order, groupStarts)
+    rank = np.lexsort((firstIndex, results["Score"][bestIndex]))
 
+    stats = None
+    if repStats:
+        stats = repeatStats(results["Score"][order], groupStarts)
+        stats = dict([(column, stats[column][rank])
+                      for column in STATS_COLUMNS])
 
-def writeResultFiles(ligDict, projName, vsDir):
+    return bestIndex[rank], stats
+
+
+def repeatStats(scores, groupStarts):
     """
-    Write out the results of this VS
+    Compute the statistics of the scores of each ligand across repeats, the
+    scores being grouped by ligand and sorted within each group, in a single
+    vectorized pass over the groups
     """
-    # Write the ligand info
-    keys = ligDict.keys()
-    vsResult = []
-    for key in keys:
-        # Get only the first in the list of repeats information
-        # for this ligand
-        # for ligInfo in ligDict[key]:
-        ligInfo = ligDict[key][0]
-        vsResult.append(ligInfo)
 
-    # Sort the vsResult based on score, for the sorted full VS result
-    vsResult = sorted(vsResult, key=lambda lig: lig[9])
+    counts = np.diff(np.r_[groupStarts, len(scores)])
+    groupEnds = groupStarts + counts - 1
+
+    mean = np.add.reduceat(scores, groupStarts) / counts
+    deviations = scores - np.repeat(mean, counts)
+    std = np.sqrt(np.add.reduceat(deviations * deviations, groupStarts) /
+                  counts)
+    # Sorted scores: the median is at the middle of each group, and the
+    # range between its first and last score
+    median = (scores[groupStarts + (counts - 1) // 2] +
+              scores[groupStarts + counts // 2]) / 2
+    scoreRange = scores[groupEnds] - scores[groupStarts]
+
+    return {"ScoreMean": mean, "ScoreMedian": median, "ScoreStd": std,
+            "ScoreRange": scoreRange, "Repeats": counts}
+
+
+def writeResultFiles(results, bestIndex, projName, vsDir, prefix="",
+                     stats=None, decimals=None):
+    """
+    Write out the results of this VS, to a results file name starting with
+    the prefix given. The statistics of the scores across repeats, when
+    given, are added as extra columns. The DECIMAL_COLUMNS are written with
+    the number of decimals given, or else found in the results
+    """
 
     print("\nWRITING:\n")
 
     # Create results file
-    print("\tresults_" + projName + ".csv")
-    fileResult = open(vsDir + "/results_" + projName + ".csv", "w")
-    fileResult.write("No,Nat,Nva,dEhb,dEgrid,dEin,dEsurf" +
-                     ",dEel,dEhp,Score,mfScore,Name,Run#\n")
+    resultsCsv = vsDir + "/" + prefix + "results_" + projName + ".csv"
+    print("\t" + os.path.basename(resultsCsv))
+    fileResult = open(resultsCsv, "w")
+    if stats is None:
+        fileResult.write(RESULT_HEADER)
+    else:
+        fileResult.write(RESULT_HEADER[:-1] + "," + ",".join(STATS_COLUMNS) +
+                         "\n")
 
-    # Loop over the sorted results, and write to the result(s) file(s)
-    for ligInfo in vsResult:
-        # Write single repeat result (the best repeat)
-        writeResultLine(ligInfo, fileResult)
+    # Write the best repeat of each ligand, sorted by score
+    writeResultLines(results, bestIndex, fileResult, stats, decimals)
 
     fileResult.close()
 
+    # Write the binary copy of the results file, once the .csv is written so
+    # that it is not older than it
+    print("\t" + os.path.basename(resultsCachePath(resultsCsv)))
+    writeResultsCache(results, bestIndex, resultsCsv, stats)
+
 
-def writeRepeatFile(repFile, repeat, ligDict):
+def resultsCachePath(resultsCsv):
     """
-    Get a repeat result file and repeat number. Extract VS data corresponding
-    to that repeat from ligDict, sort the results according to score, and
-    write those to the corresponding repeat results text file.
+    Return the path of the binary copy of a results .csv file
     """
-    # Store VS repeat results in a list
-    repeatResults = []
 
-    # Get the repeat results from the ligDict, looping over ligand ID
-    for ligID in ligDict.keys():
-        # For each ligID, loop over all repeats
-        for repeatLigInfo in ligDict[ligID]:
-            # If this is the repeat that matches the one we want (last item)
-            if repeat == int(repeatLigInfo[-1]):
-                # Append to the list
-                repeatResults.append(repeatLigInfo)
+    return os.path.splitext(resultsCsv)[0] + CACHE_EXT
+
+
+def writeResultsCache(results, index, resultsCsv, stats=None):
+    """
+    Write the results rows selected by the index, in that order, to the
+    binary copy of the results .csv file, along with the statistics columns
+    when given (already in that order)
+    """
+
+    dtype = [(column, results[column].dtype) for column in RESULT_COLUMNS]
+    if stats is not None:
+        dtype += [(column, stats[column].dtype) for column in STATS_COLUMNS]
+    table = np.empty(len(index), dtype=dtype)
+    for column in RESULT_COLUMNS:
+        table[column] = results[column][index]
+    if stats is not None:
+        for column in STATS_COLUMNS:
+            table[column] = stats[column]
+
+    # Write to a temporary file first, a partially written copy is never
+    # loaded
+    cachePath = resultsCachePath(resultsCsv)
+    with open(cachePath + ".tmp", "wb") as f:
+        np.save(f, table)
+    os.replace(cachePath + ".tmp", cachePath)
+
+
+def loadResultsCache(resultsCsv):
+    """
+    Memory-map the binary copy of a results .csv file, as a structured array
+    with one field per results column (the "Name" field holds UTF-8 bytes).
+    Return None when there is no copy, or when it is older than the .csv
+    """
+
+    cachePath = resultsCachePath(resultsCsv)
+
+    if not os.path.exists(cachePath):
+        return None
+    if os.path.exists(resultsCsv) and \
+            os.path.getmtime(cachePath) < os.path.getmtime(resultsCsv):
+        return None
+
+    return np.load(cachePath, mmap_mode="r")
+
+
+def resultsDbPath(resultsCsv):
+    """
+    Return the path of the SQLite database of a results .csv file
+    """
+
+    return os.path.splitext(resultsCsv)[0] + DB_EXT
+
+
+def writeResultsDb(allResults, sources, results, bestIndex, vsDir,
+                   resultsCsv):
+    """
+    Write the SQLite database of the VS, replacing the previous one. The
+    dockings table holds every docking parsed, along with its slice, .ou
+    file and answers file (paths relative to the VS directory, in the files
+    table). The results table holds the ranked results, as written to the
+    results .csv file. The rows are inserted in a single transaction, and
+    the indexes are built once they are all inserted
+    """
+
+    dbPath = resultsDbPath(resultsCsv)
+    print("\t" + os.path.basename(dbPath))
+
+    # Build the database in a temporary file, a partially written database
+    # is never queried
+    if os.path.exists(dbPath + ".tmp"):
+        os.remove(dbPath + ".tmp")
+    db = sqlite3.connect(dbPath + ".tmp")
+    db.execute("PRAGMA journal_mode = OFF")
+    db.execute("PRAGMA synchronous = OFF")
+
+    energies = [field for field in SCORE_FIELDS if field not in INT_COLUMNS]
+    db.execute("CREATE TABLE files (fileID INTEGER PRIMARY KEY, path TEXT)")
+    db.execute("CREATE TABLE dockings (No INTEGER, Run INTEGER, Slice"
+               " INTEGER, Nat INTEGER, Nva INTEGER, " +
+               ", ".join([field + " REAL" for field in energies]) +
+               ", Name TEXT, ouFile INTEGER, answersFile INTEGER)")
+    db.execute("CREATE TABLE results (Rank INTEGER PRIMARY KEY, No INTEGER,"
+               " Run INTEGER, Score REAL, Name TEXT)")
+
+    with db:
+        # The .ou files, and the answers files of their repeat directories
+        filePaths = {}
+        answersFiles = {}
+        for ouFilePath, ligDockedNum in sources:
+            repeatDir = os.path.dirname(ouFilePath)
+            if repeatDir not in answersFiles:
+                answersFiles[repeatDir] = sortedAnswersFiles(repeatDir)
+            for path in [ouFilePath] + answersFiles[repeatDir][1]:
+                path = os.path.relpath(path, vsDir)
+                if path not in filePaths:
+                    filePaths[path] = len(filePaths) + 1
+        db.executemany("INSERT INTO files VALUES (?, ?)",
+                       [(fileID, path) for path, fileID in
+                        filePaths.items()])
+
+        columns = ["No", "Run", "Nat", "Nva"] + energies
+        insert = "INSERT INTO dockings (" + ", ".join(columns) + \
+            ", Slice, Name, ouFile, answersFile) VALUES (" + \
+            ", ".join(["?"] * (len(columns) + 4)) + ")"
+
+        start = 0
+        for ouFilePath, ligDockedNum in sources:
+            chunk = takeResults(allResults,
+                                np.arange(start, start + ligDockedNum))
+            start += ligDockedNum
+
+            upperLimit = OU_NAME.search(ouFilePath).group(1)
+            sliceNum = int(upperLimit) if upperLimit else None
+            ouFile = filePaths[os.path.relpath(ouFilePath, vsDir)]
+
+            # The answers file of a docking is the last one starting at or
+            # before its ligand ID
+            answersStarts, answersPaths = \
+                answersFiles[os.path.dirname(ouFilePath)]
+            answersIndex = np.searchsorted(answersStarts, chunk["No"],
+                                           side="right")
+            answersIDs = [None] + [filePaths[os.path.relpath(path, vsDir)]
+                                   for path in answersPaths]
+
+            rows = zip(*[chunk[column].tolist() for column in columns] +
+                       [[sliceNum] * ligDockedNum,
+                        np.char.decode(chunk["Name"], "utf-8").tolist(),
+                        [ouFile] * ligDockedNum,
+                        [answersIDs[i] for i in answersIndex.tolist()]])
+            db.executemany(insert, rows)
+
+        rows = zip(range(1, len(bestIndex) + 1),
+                   results["No"][bestIndex].tolist(),
+                   results["Run"][bestIndex].tolist(),
+                   results["Score"][bestIndex].tolist(),
+                   np.char.decode(results["Name"][bestIndex],
+                                  "utf-8").tolist())
+        db.executemany("INSERT INTO results VALUES (?, ?, ?, ?, ?)", rows)
+
+        db.execute("CREATE INDEX dockings_No ON dockings (No)")
+        db.execute("CREATE INDEX dockings_Score ON dockings (Score)")
+        db.execute("CREATE INDEX dockings_Run ON dockings (Run, Score)")
+        db.execute("CREATE INDEX results_No ON results (No)")
+
+    db.close()
+    os.replace(dbPath + ".tmp", dbPath)
+
+
+def sortedAnswersFiles(repeatDir):
+    """
+    Return the first ligand IDs and the paths of the answers files of a
+    repeat directory, sorted by first ligand ID
+    """
+
+    answersFiles = []
+    for obFilePath in glob.glob(repeatDir + "/*_answers*.ob"):
+        start = obFilePath.split("_answers")[-1].replace(".ob", "")
+        if start.isdigit():
+            answersFiles.append([int(start), obFilePath])
+    answersFiles.sort()
+
+    return np.array([start for start, path in answersFiles],
+                    dtype=np.int64), [path for start, path in answersFiles]
+
+
+def connectResultsDb(resultsCsv):
+    """
+    Open the SQLite database of a results .csv file. Return None when there
+    is no database, or when it is older than the .csv
+    """
+
+    dbPath = resultsDbPath(resultsCsv)
+
+    if not os.path.exists(dbPath):
+        return None
+    if os.path.exists(resultsCsv) and \
+            os.path.getmtime(dbPath) < os.path.getmtime(resultsCsv):
+        return None
+
+    return sqlite3.connect(dbPath)
+
+
+def writeRepeatFiles(results, totalRepeatNum, projName, vsDir,
+                     decimals=None):
+    """
+    Write the results of each repeat, sorted according to score, to the
+    corresponding repeat results text file. The results are partitioned by
+    repeat and ranked with a single sort. The DECIMAL_COLUMNS are written
+    with the number of decimals given, or else found in the results
+    """
+
+    # Sort by repeat, then score. Equal scores are ranked in the order their
+    # ligand was first parsed
+    firstIndex = firstParsedIndex(results)
+    order = np.lexsort((np.arange(resultsLength(results)), firstIndex,
+                        results["Score"], results["Run"]))
+
+    if decimals is None:
+        decimals = resultsDecimals(results)
+
+    # Boundaries of each repeat in the sorted results
+    bounds = np.searchsorted(results["Run"][order],
+                             np.arange(1, totalRepeatNum + 2))
+
+    for repeat in range(1, totalRepeatNum + 1):
+        # Initialise a results text file
+        repFileName = "repeat{}_results_{}.csv".format(repeat, projName)
+        print("\t" + repFileName)
+        repFile = open(vsDir + "/" + repFileName, "w")
+        repFile.write(RESULT_HEADER)
+
+        # Write that repeat's results to file
+        writeResultLines(results, order[bounds[repeat - 1]:bounds[repeat]],
+                         repFile, decimals=decimals)
+        repFile.close()
+
+
+def resultsDecimals(results):
+    """
+    Return the number of decimals of each of the DECIMAL_COLUMNS of the
+    results
+    """
+
+    return dict([(column, columnDecimals(results[column]))
+                 for column in DECIMAL_COLUMNS])
+
+
+def columnDecimals(values):
+    """
+    Return the number of decimals the values of a column were read with:
+    the fewest decimals that write each of them back exactly, which is the
+    number of decimals of the .ou files unless every value ends with a zero.
+    Return MAX_DECIMALS + 1 when more are needed. Values that could not be
+    read (NaN) are left out
+    """
+
+    values = values[~np.isnan(values)]
+    for decimals in range(MAX_DECIMALS + 1):
+        values = values[np.round(values, decimals) != values]
+        if len(values) == 0:
+            return decimals
+
+    return MAX_DECIMALS + 1
+
+
+def firstParsedIndex(results):
+    """
+    Return, for each docking, the index of the first docking parsed for the
+    same ligand ID
+    """
 
-    # Sort the repeat VS result list, based on score
-    repeatResults = sorted(repeatResults, key=lambda lig: lig[9])
+    ligIDs, firstIndex, inverse = np.unique(results["No"], return_index=True,
+                                            return_inverse=True)
 
-    # Write results to file
-    for repeatResultsLine in repeatResults:
-        writeResultLine(repeatResultsLine, repFile)
-    repFile.close()
+    return firstIndex[inverse]
 
 
-def writeResultLine(ligInfo, fileResult):
+def writeResultLines(results, index, fileResult, stats=None, decimals=None):
     """
-    Write single results line to file
+    Write the results rows selected by the index to file, in that order,
+    followed by the statistics columns when given (already in that order).
+    The DECIMAL_COLUMNS are written with the number of decimals given, or
+    else found in the results. Rows are formatted by chunks of WRITE_CHUNK
+    lines
     """
-    ligInfoStr = []
-    for val in ligInfo:
-        ligInfoStr.append(str(val))
 
-    fileResult.write(",".join(ligInfoStr))
-    fileResult.write("\n")
+    if decimals is None:
+        decimals = resultsDecimals(results)
+    line = RESULT_LINE.format(**dict(
+        [(column, "%r" if decimals[column] > MAX_DECIMALS else
+          "%." + str(decimals[column]) + "f") for column in DECIMAL_COLUMNS]))
+    if stats is not None:
+        line = line[:-1] + STATS_LINE
+
+    for start in range(0, len(index), WRITE_CHUNK):
+        chunk = takeResults(results, index[start:start + WRITE_CHUNK])
+        chunk["Name"] = np.char.decode(chunk["Name"], "utf-8")
+        columns = [chunk[column].tolist() for column in RESULT_COLUMNS]
+        if stats is not None:
+            columns += [stats[column][start:start + WRITE_CHUNK].tolist()
+                        for column in STATS_COLUMNS]
+        fileResult.write("".join([line % row for row in zip(*columns)]))
 
 
 if __name__ == "__main__":
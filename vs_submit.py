@@ -3,7 +3,8 @@
 # Execute within a VS directory, will crawl through
 # all its subdirs and submit all .slurm or .sge
 # files found there, while pausing for 1 second
-# between each submission
+# between each submission. The .local files are
+# instead run on this machine, a few at a time
 #
 # https://github.com/thomas-coudrat/toolbx_vs
 # Thomas Coudrat <thomas.coudrat@gmail.com>
@@ -14,6 +15,8 @@ import argparse
 import sys
 import socket
 import json
+import subprocess
+import multiprocessing
 
 def main():
     """
@@ -21,7 +24,7 @@ def main():
     """
 
     # Return the queuing system chosen
-    vsDir, queue = parsing()
+    vsDir, queue, jobs = parsing()
 
     # Get the current working directory
     cwd = os.getcwd()
@@ -32,8 +35,12 @@ def main():
     # Ask for confirmation to submit run
     confirmSubmit(queuePaths)
 
-    # Submit all those scripts (using the proper queueing system)
-    submitQueueScripts(queuePaths, cwd, queue)
+    if queue == "local":
+        # Run those scripts on this machine, jobs at a time
+        runLocalScripts(queuePaths, vsDir, jobs)
+    else:
+        # Submit all those scripts (using the proper queueing system)
+        submitQueueScripts(queuePaths, cwd, queue)
 
     print("")
 
@@ -46,22 +53,29 @@ def parsing():
     # Define and collect arguments
     descr = "Submits a VS using either -slurm or -sge queuing system"
     descr_vsDir = "VS directory to be submitted to the queue"
-    descr_queue = "Queuing system to be used (sge/slurm)"
+    descr_queue = "Queuing system to be used (sge/slurm), or local to run" \
+        " the slices built with the local option on this machine"
+    descr_jobs = "Number of slices run at the same time with the local" \
+        " option. Default is the number of CPUs"
 
     parser = argparse.ArgumentParser(description=descr)
     parser.add_argument("vsDir", help=descr_vsDir)
     parser.add_argument("queue", help=descr_queue)
+    parser.add_argument("--jobs", type=int,
+                        default=multiprocessing.cpu_count(), help=descr_jobs)
 
     args = parser.parse_args()
 
     vsDir = args.vsDir
     queue = args.queue
+    jobs = max(1, args.jobs)
 
-    if queue not in ("sge", "slurm"):
-        print("Only 'sge' and 'slurm' are accepted queuing system options")
+    if queue not in ("sge", "slurm", "local"):
+        print("Only 'sge', 'slurm' and 'local' are accepted queuing system " +
+              "options")
         sys.exit()
 
-    return vsDir, queue
+    return vsDir, queue, jobs
 
 
 def confirmSubmit(queuePaths):
@@ -87,6 +101,13 @@ def getQueueScripts(vsDir, queue):
     """
 
     queuePaths = []
+
+    # Job arrays running all the repeats, or the workers of the chunk
+    # queue, written in the VS directory
+    for file in os.listdir(vsDir):
+        if file.endswith("." + queue):
+            queuePaths.append(os.path.join(vsDir, file))
+
     # Listing direct subdirectories to the dir where this was executed
     for subDir in os.listdir(vsDir):
         if subDir.isdigit():
@@ -94,7 +115,7 @@ def getQueueScripts(vsDir, queue):
             files = os.listdir(path)
 
             # For each of these, save every file that ends with .slurm or
-            # .sge in a list, by saving its full path
+            # .sge in a list (slices or job arrays), by saving its full path
             for file in files:
                 if file.endswith("." + queue):
                     queuePaths.append(os.path.join(path, file))
@@ -132,5 +153,61 @@ def submitQueueScripts(queuePaths, cwd, queue):
         time.sleep(1)
 
 
+def runLocalScripts(queuePaths, vsDir, jobs):
+    """
+    Run the slices on this machine, jobs at a time, each in its repeat
+    directory with its output captured to a .out file as the queuing
+    systems do. The exit code and run time of each slice are written to
+    local_status.json in the VS directory as the slices finish
+    """
+
+    queuePaths = sorted([os.path.abspath(queuePath)
+                         for queuePath in queuePaths])
+    statusPath = os.path.join(vsDir, "local_status.json")
+    status = {}
+
+    pool = multiprocessing.Pool(jobs)
+    finished = pool.imap_unordered(runLocalScript, queuePaths)
+
+    try:
+        for queuePath, returnCode, runTime in finished:
+            relPath = os.path.relpath(queuePath, os.path.abspath(vsDir))
+            status[relPath] = {"exitCode": returnCode, "time": runTime}
+            print("\t{:<50}exit code {:<6}{:.1f} s".format(relPath,
+                                                          returnCode,
+                                                          runTime))
+            with open(statusPath + ".tmp", "w") as f:
+                json.dump(status, f, indent=1)
+            os.replace(statusPath + ".tmp", statusPath)
+    finally:
+        pool.close()
+        pool.join()
+
+    failed = sorted([relPath for relPath in status
+                     if status[relPath]["exitCode"] != 0])
+    print("\n" + str(len(status) - len(failed)) + " slices succeeded, " +
+          str(len(failed)) + " failed")
+    for relPath in failed:
+        print("\t" + relPath)
+
+
+def runLocalScript(queuePath):
+    """
+    Run a slice in its directory, writing its output to a .out file next to
+    it. Return its path, exit code and run time in seconds
+    """
+
+    queueDir = os.path.dirname(queuePath)
+    outPath = os.path.splitext(queuePath)[0] + ".out"
+
+    start = time.time()
+    with open(outPath, "w") as outFile:
+        returnCode = subprocess.call(["bash", queuePath], cwd=queueDir,
+                                     stdout=outFile,
+                                     stderr=subprocess.STDOUT)
+
+    return queuePath, returnCode, time.time() - start
+
+
 if __name__ == "__main__":
     main()